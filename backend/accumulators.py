@@ -0,0 +1,267 @@
+"""
+Потоковые (онлайн) аккумуляторы для статистик analytics.py.
+
+Каждый аккумулятор хранит только достаточные статистики: update(trade) добавляет
+сделку за O(1), merge(other) объединяет частичные результаты (по счетам, месяцам,
+тегам) без повторного прохода по сделкам, result() возвращает тот же словарь,
+что и соответствующая пакетная функция analytics.
+
+Статистики, зависящие от порядка сделок (серии, просадка), объединяются
+в хронологическом порядке: a.merge(b) — сделки b идут после сделок a.
+"""
+import math
+from typing import Dict, Optional
+import analytics
+
+def _float(value) -> Optional[float]:
+    return float(value) if value is not None else None
+
+def trade_risk(trade) -> float:
+    # Риск сделки: risk_amount, а если он не задан — модуль PnL (как trade_frame.TradeFrame.risk)
+    risk = _float(getattr(trade, "risk_amount", None)) or 0.0
+    return risk if risk != 0 else abs(float(trade.pnl))
+
+class Welford:
+    """
+    Среднее и дисперсия по алгоритму Уэлфорда; объединение — по формуле Чана и др.
+    """
+    __slots__ = ("count", "mean", "m2")
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def update(self, x: float) -> None:
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+
+    def merge(self, other: "Welford") -> "Welford":
+        if other.count == 0:
+            return self
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.count = count
+        return self
+
+    def std(self, ddof: int = 1) -> float:
+        if self.count <= ddof:
+            return 0.0
+        return math.sqrt(max(self.m2, 0.0) / (self.count - ddof))
+
+class SqnAccumulator:
+    """
+    analytics.calculate_sqn: среднее и стандартное отклонение R (при нулевом риске R = 0).
+    """
+
+    def __init__(self):
+        self.r = Welford()
+
+    def update(self, trade) -> None:
+        if trade.pnl is None:
+            return
+        risk = trade_risk(trade)
+        self.r.update(float(trade.pnl) / risk if risk != 0 else 0.0)
+
+    def merge(self, other: "SqnAccumulator") -> "SqnAccumulator":
+        self.r.merge(other.r)
+        return self
+
+    def result(self) -> Dict:
+        if self.r.count < 2:
+            return {"sqn": 0, "rating": "Недостаточно данных"}
+        return analytics._sqn_from_moments(self.r.count, self.r.mean, self.r.std(ddof=1))
+
+class ZScoreAccumulator:
+    """
+    analytics.calculate_z_score: число сделок, прибыльных и убыточных (нулевые пропускаются)
+    и число серий. Для объединения хранятся знаки первой и последней ненулевой сделки.
+    """
+
+    def __init__(self):
+        self.trades = 0
+        self.wins = 0
+        self.losses = 0
+        self.runs = 0
+        self.first_win: Optional[bool] = None
+        self.last_win: Optional[bool] = None
+
+    def update(self, trade) -> None:
+        if trade.pnl is None:
+            return
+        self.trades += 1
+        pnl = float(trade.pnl)
+        if pnl == 0:
+            return
+        win = pnl > 0
+        if win:
+            self.wins += 1
+        else:
+            self.losses += 1
+        if win != self.last_win:
+            self.runs += 1
+        if self.first_win is None:
+            self.first_win = win
+        self.last_win = win
+
+    def merge(self, other: "ZScoreAccumulator") -> "ZScoreAccumulator":
+        self.trades += other.trades
+        self.wins += other.wins
+        self.losses += other.losses
+        # Серия на стыке считается один раз
+        self.runs += other.runs - (1 if self.last_win is not None and self.last_win == other.first_win else 0)
+        if self.first_win is None:
+            self.first_win = other.first_win
+        if other.last_win is not None:
+            self.last_win = other.last_win
+        return self
+
+    def result(self) -> Dict:
+        if self.trades < 30:
+            return {
+                "z_score": 0,
+                "verdict": "Недостаточно данных (нужно > 30)",
+                "confidence": "Low"
+            }
+        if self.wins + self.losses < 2:
+            return {"z_score": 0, "verdict": "Мало сделок", "confidence": "None"}
+        return analytics._z_score_from_runs(self.wins, self.losses, self.runs)
+
+class AdvancedStatsAccumulator:
+    """
+    analytics.calculate_advanced_stats: валовые прибыль и убыток, сумма R (сделки
+    с положительным риском) и состояние просадки: итог S, пик баланса P (не ниже 0),
+    минимум баланса M и максимальная просадка D. Для a, затем b:
+    P = max(Pa, Sa + Pb), M = min(Ma, Sa + Mb), D = max(Da, Db, Pa - Sa - Mb).
+    """
+
+    def __init__(self):
+        self.trades = 0
+        self.gross_profit = 0.0
+        self.gross_loss = 0.0
+        self.r_sum = 0.0
+        self.total = 0.0
+        self.peak = 0.0
+        self.trough = math.inf
+        self.max_drawdown = 0.0
+
+    def update(self, trade) -> None:
+        if trade.pnl is None:
+            return
+        pnl = float(trade.pnl)
+        self.trades += 1
+        if pnl > 0:
+            self.gross_profit += pnl
+        elif pnl < 0:
+            self.gross_loss -= pnl
+        risk = trade_risk(trade)
+        if risk > 0:
+            self.r_sum += pnl / risk
+        self.total += pnl
+        self.peak = max(self.peak, self.total)
+        self.trough = min(self.trough, self.total)
+        self.max_drawdown = max(self.max_drawdown, self.peak - self.total)
+
+    def merge(self, other: "AdvancedStatsAccumulator") -> "AdvancedStatsAccumulator":
+        if other.trades == 0:
+            return self
+        self.max_drawdown = max(self.max_drawdown, other.max_drawdown, self.peak - self.total - other.trough)
+        self.peak = max(self.peak, self.total + other.peak)
+        self.trough = min(self.trough, self.total + other.trough)
+        self.trades += other.trades
+        self.gross_profit += other.gross_profit
+        self.gross_loss += other.gross_loss
+        self.r_sum += other.r_sum
+        self.total += other.total
+        return self
+
+    def result(self) -> Dict:
+        if self.trades == 0:
+            return {
+                "profit_factor": 0,
+                "r_expectancy": 0,
+                "recovery_factor": 0
+            }
+        return analytics._advanced_from_totals(
+            self.gross_profit, self.gross_loss, self.r_sum / self.trades, self.total, self.max_drawdown
+        )
+
+class MaeMfeAccumulator:
+    """
+    analytics.analyze_mae_mfe: суммы и число отношений MAE и MFE к риску (расстоянию до стопа)
+    по закрытым сделкам со стопом.
+    """
+
+    def __init__(self):
+        self.trades = 0
+        self.mae = [0.0, 0]
+        self.mfe = [0.0, 0]
+
+    def update(self, trade) -> None:
+        # Как в load_trade_frame(closed_only=True): сделки без PnL не учитываются вовсе
+        if trade.pnl is None:
+            return
+        self.trades += 1
+        if trade.exit_at is None:
+            return
+        entry = _float(trade.entry_price) or 0.0
+        stop = _float(trade.stop_loss) or 0.0
+        risk_dist = abs(entry - stop)
+        if stop == 0 or entry == 0 or risk_dist == 0:
+            return
+        for price, state in ((_float(trade.mae_price), self.mae), (_float(trade.mfe_price), self.mfe)):
+            if price:
+                state[0] += abs(entry - price) / risk_dist
+                state[1] += 1
+
+    def merge(self, other: "MaeMfeAccumulator") -> "MaeMfeAccumulator":
+        self.trades += other.trades
+        for state, other_state in ((self.mae, other.mae), (self.mfe, other.mfe)):
+            state[0] += other_state[0]
+            state[1] += other_state[1]
+        return self
+
+    def result(self) -> Dict:
+        if self.trades == 0:
+            return {"recommendations": ["Недостаточно данных для анализа"]}
+        return analytics._mae_mfe_from_averages(
+            self.mae[0] / self.mae[1] if self.mae[1] else None,
+            self.mfe[0] / self.mfe[1] if self.mfe[1] else None,
+        )
+
+class TradeStatsAccumulator:
+    """
+    Все аккумуляторы вместе: update(trade) принимает models.Trade (или объект с теми же
+    полями), result() — словари sqn, z_score, advanced, mae_mfe.
+    """
+
+    def __init__(self):
+        self.sqn = SqnAccumulator()
+        self.z_score = ZScoreAccumulator()
+        self.advanced = AdvancedStatsAccumulator()
+        self.mae_mfe = MaeMfeAccumulator()
+
+    def update(self, trade) -> None:
+        self.sqn.update(trade)
+        self.z_score.update(trade)
+        self.advanced.update(trade)
+        self.mae_mfe.update(trade)
+
+    def merge(self, other: "TradeStatsAccumulator") -> "TradeStatsAccumulator":
+        self.sqn.merge(other.sqn)
+        self.z_score.merge(other.z_score)
+        self.advanced.merge(other.advanced)
+        self.mae_mfe.merge(other.mae_mfe)
+        return self
+
+    def result(self) -> Dict:
+        return {
+            "sqn": self.sqn.result(),
+            "z_score": self.z_score.result(),
+            "advanced": self.advanced.result(),
+            "mae_mfe": self.mae_mfe.result(),
+        }
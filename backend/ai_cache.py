@@ -0,0 +1,227 @@
+import datetime
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import select, update, delete, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+import models
+import ai_service
+
+# Размер LRU в памяти, срок жизни и предельный размер кэша в БД
+AI_CACHE_MEMORY_SIZE = int(os.getenv("AI_CACHE_MEMORY_SIZE", "1024"))
+AI_CACHE_TTL_DAYS = float(os.getenv("AI_CACHE_TTL_DAYS", "30"))
+AI_CACHE_MAX_ROWS = int(os.getenv("AI_CACHE_MAX_ROWS", "100000"))
+# Сколько попаданий в LRU копить до записи last_used_at в БД
+AI_CACHE_TOUCH_BATCH = int(os.getenv("AI_CACHE_TOUCH_BATCH", "64"))
+# Раз в сколько записей в кэш проверять его размер и срок жизни записей
+AI_CACHE_EVICT_EVERY = int(os.getenv("AI_CACHE_EVICT_EVERY", "100"))
+
+# LRU в памяти процесса: {key: (created_at, analysis)}
+_memory: "OrderedDict[str, tuple]" = OrderedDict()
+# Попадания в LRU, еще не записанные в БД: {key: число попаданий}
+_pending_touches: Dict[str, int] = {}
+# Записей в кэш с последней очистки и оценка сверху числа строк в БД (None — неизвестно)
+_evict_state = {"stores": 0, "rows": None}
+
+# Счетчики с момента старта процесса
+counters = {"memory_hits": 0, "db_hits": 0, "misses": 0, "evicted": 0}
+
+def _normalize_number(value) -> Optional[str]:
+    # 101.5, Decimal('101.50000000') и 101.500000001 дают один ключ
+    if value is None:
+        return None
+    return f"{float(value):.6f}"
+
+def _normalize_text(value) -> Optional[str]:
+    if value is None:
+        return None
+    text = " ".join(str(value).split())
+    return text or None
+
+def normalize_inputs(trade_data: Dict) -> Dict:
+    # Только поля, которые попадают в промпт
+    symbol = _normalize_text(trade_data.get("symbol"))
+    return {
+        "symbol": symbol.upper() if symbol else None,
+        "direction": _normalize_text(trade_data.get("direction")),
+        "pnl": _normalize_number(trade_data.get("pnl")),
+        "mae_price": _normalize_number(trade_data.get("mae_price")),
+        "mfe_price": _normalize_number(trade_data.get("mfe_price")),
+        "exit_price": _normalize_number(trade_data.get("exit_price")),
+        "notes": _normalize_text(trade_data.get("notes")),
+        "emotions": _normalize_text(trade_data.get("emotions")),
+    }
+
+def cache_key(trade_data: Dict, model_version: str) -> str:
+    payload = json.dumps(
+        {"model": model_version, "inputs": normalize_inputs(trade_data)},
+        sort_keys=True, ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def _expired(created_at: Optional[datetime.datetime], now: datetime.datetime) -> bool:
+    return created_at is None or now - created_at > datetime.timedelta(days=AI_CACHE_TTL_DAYS)
+
+def _remember(key: str, created_at: datetime.datetime, analysis: Dict) -> None:
+    _memory[key] = (created_at, analysis)
+    _memory.move_to_end(key)
+    while len(_memory) > AI_CACHE_MEMORY_SIZE:
+        _memory.popitem(last=False)
+
+async def _lookup(db: AsyncSession, keys: List[str], now: datetime.datetime) -> Tuple[Dict[str, Dict], List[str]]:
+    """
+    Ищет ответы сначала в LRU, затем в БД. Просроченные записи считаются промахом.
+    Только чтение: возвращает найденное и ключи, найденные в БД (для учета попаданий).
+    """
+    found = {}
+    missing = []
+    for key in keys:
+        entry = _memory.get(key)
+        if entry is not None and not _expired(entry[0], now):
+            _memory.move_to_end(key)
+            found[key] = entry[1]
+            counters["memory_hits"] += 1
+            _pending_touches[key] = _pending_touches.get(key, 0) + 1
+        else:
+            _memory.pop(key, None)
+            missing.append(key)
+
+    if missing:
+        result = await db.execute(
+            select(models.AIAnalysisCache.key, models.AIAnalysisCache.created_at, models.AIAnalysisCache.analysis)
+            .where(models.AIAnalysisCache.key.in_(missing))
+        )
+        db_hits = []
+        for key, created_at, analysis in result:
+            if _expired(created_at, now):
+                continue
+            found[key] = analysis
+            db_hits.append(key)
+            _remember(key, created_at, analysis)
+        counters["db_hits"] += len(db_hits)
+        return found, db_hits
+    return found, []
+
+async def _touch(db: AsyncSession, keys: List[str], now: datetime.datetime, force: bool = False) -> None:
+    """
+    Обновляет hits и last_used_at: попадания в БД — сразу, попадания в LRU копятся
+    в _pending_touches и пишутся вместе с ними, при записи в кэш (force) или
+    когда их набралось AI_CACHE_TOUCH_BATCH.
+    """
+    for key in keys:
+        _pending_touches[key] = _pending_touches.get(key, 0) + 1
+    if not _pending_touches or not (keys or force or len(_pending_touches) >= AI_CACHE_TOUCH_BATCH):
+        return
+    # Один UPDATE на каждое различное число попаданий (обычно одно)
+    by_hits: Dict[int, List[str]] = {}
+    for key, hits in _pending_touches.items():
+        by_hits.setdefault(hits, []).append(key)
+    _pending_touches.clear()
+    cache = models.AIAnalysisCache
+    for hits, hit_keys in by_hits.items():
+        await db.execute(
+            update(cache)
+            .where(cache.key.in_(hit_keys))
+            .values(hits=cache.hits + hits, last_used_at=now)
+        )
+
+async def _store(db: AsyncSession, entries: Dict[str, Dict], model_version: str, now: datetime.datetime) -> None:
+    # Upsert: тот же ключ мог параллельно записать другой воркер или остаться просроченная запись
+    cache = models.AIAnalysisCache
+    insert = pg_insert if db.bind.dialect.name == "postgresql" else sqlite_insert
+    stmt = insert(cache).values([
+        {"key": key, "model_version": model_version, "analysis": analysis,
+         "hits": 0, "created_at": now, "last_used_at": now}
+        for key, analysis in entries.items()
+    ])
+    await db.execute(stmt.on_conflict_do_update(
+        index_elements=[cache.key],
+        set_={
+            "model_version": stmt.excluded.model_version,
+            "analysis": stmt.excluded.analysis,
+            "created_at": stmt.excluded.created_at,
+            "last_used_at": stmt.excluded.last_used_at,
+        }
+    ))
+    for key, analysis in entries.items():
+        _remember(key, now, analysis)
+
+    # count(*) на каждую запись не нужен: очистка — раз в AI_CACHE_EVICT_EVERY записей
+    # или когда по оценке (строк после прошлой очистки + добавленные) кэш больше предела
+    _evict_state["stores"] += 1
+    if _evict_state["rows"] is not None:
+        _evict_state["rows"] += len(entries)
+    if (_evict_state["rows"] is None or _evict_state["rows"] > AI_CACHE_MAX_ROWS
+            or _evict_state["stores"] >= AI_CACHE_EVICT_EVERY):
+        await evict(db, now)
+
+async def evict(db: AsyncSession, now: Optional[datetime.datetime] = None) -> int:
+    """
+    Удаляет просроченные записи и, если кэш больше AI_CACHE_MAX_ROWS,
+    давно не использованные. Возвращает число удаленных строк.
+    """
+    now = now or datetime.datetime.utcnow()
+    cache = models.AIAnalysisCache
+    result = await db.execute(
+        delete(cache).where(cache.created_at < now - datetime.timedelta(days=AI_CACHE_TTL_DAYS))
+    )
+    removed = result.rowcount or 0
+
+    rows = await db.scalar(select(func.count()).select_from(cache))
+    overflow = rows - AI_CACHE_MAX_ROWS
+    if overflow > 0:
+        oldest = select(cache.key).order_by(cache.last_used_at, cache.key).limit(overflow)
+        result = await db.execute(delete(cache).where(cache.key.in_(oldest)))
+        removed += result.rowcount or 0
+
+    _evict_state["stores"] = 0
+    _evict_state["rows"] = min(rows, AI_CACHE_MAX_ROWS)
+    counters["evicted"] += removed
+    return removed
+
+async def analyze_trades_cached(db: AsyncSession, trades_data: List[Dict]) -> List[Dict]:
+    """
+    analyze_trades_batch с кэшем: модель вызывается только для сделок,
+    которых нет в кэше, одинаковые сделки в пачке анализируются один раз.
+    Изменения кэша в БД коммитит вызывающий код вместе со своей транзакцией;
+    запись идет после вызова модели, чтобы не держать блокировку БД на время ответа.
+    """
+    if not trades_data:
+        return []
+    model_version = ai_service.model_version()
+    now = datetime.datetime.utcnow()
+    keys = [cache_key(trade, model_version) for trade in trades_data]
+
+    found, db_hits = await _lookup(db, list(dict.fromkeys(keys)), now)
+
+    # Уникальные промахи в порядке появления
+    to_analyze = {}
+    for key, trade in zip(keys, trades_data):
+        if key not in found and key not in to_analyze:
+            to_analyze[key] = trade
+    fresh = {}
+    if to_analyze:
+        counters["misses"] += len(to_analyze)
+        analyses = await ai_service.analyze_trades_batch(list(to_analyze.values()))
+        fresh = dict(zip(to_analyze, analyses))
+        found.update(fresh)
+
+    # Если кэш все равно пишется, накопленные попадания из LRU уходят в ту же транзакцию
+    await _touch(db, db_hits, now, force=bool(fresh))
+    if fresh:
+        await _store(db, fresh, model_version, now)
+
+    return [dict(found[key]) for key in keys]
+
+def cache_stats() -> Dict:
+    lookups = counters["memory_hits"] + counters["db_hits"] + counters["misses"]
+    hits = counters["memory_hits"] + counters["db_hits"]
+    return {
+        **counters,
+        "memory_size": len(_memory),
+        "hit_rate": round(hits / lookups * 100, 2) if lookups else 0,
+    }
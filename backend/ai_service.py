@@ -1,16 +1,26 @@
 import os
 import json
-from typing import Dict, Optional
+from typing import Dict, List, Optional
 
-# В будущем здесь будет: import openai
-# client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# Бэкенд анализа: stub — локальные правила без сети (разработка и тесты), openai — модель
+AI_BACKEND = os.getenv("AI_BACKEND", "stub")
+AI_MODEL = os.getenv("AI_MODEL", "gpt-4o-mini")
+# Увеличивать при изменении промпта или логики stub: старые ответы в кэше перестанут совпадать
+PROMPT_VERSION = 1
 
-async def analyze_trade_with_ai(trade_data: Dict) -> Dict:
-    """
-    Отправляет данные сделки в AI для анализа поведения и психологии.
-    """
-    # Имитация промпта для AI
-    prompt = f"""
+# openai нужен только для AI_BACKEND=openai
+try:
+    import openai
+except ImportError:
+    openai = None
+
+def model_version() -> str:
+    # Все, от чего зависит ответ, кроме данных сделки (часть ключа кэша анализов)
+    model = AI_MODEL if AI_BACKEND == "openai" else "rules"
+    return f"{AI_BACKEND}:{model}:v{PROMPT_VERSION}"
+
+def build_prompt(trade_data: Dict) -> str:
+    return f"""
     Проанализируй сделку трейдера:
     Символ: {trade_data.get('symbol')}
     Направление: {trade_data.get('direction')}
@@ -25,10 +35,11 @@ async def analyze_trade_with_ai(trade_data: Dict) -> Dict:
     2. Ошибка в управлении позицией?
     3. Психологический совет.
     """
-    
-    # Пока используем мок-логику, имитирующую "умный" ответ
-    pnl = float(trade_data.get('pnl', 0))
-    notes = str(trade_data.get('notes', '')).lower()
+
+def _stub_analysis(trade_data: Dict) -> Dict:
+    # Мок-логика, имитирующая "умный" ответ
+    pnl = float(trade_data.get('pnl') or 0)
+    notes = str(trade_data.get('notes') or '').lower()
     
     if pnl < 0 and ("fomo" in notes or "догнал" in notes):
         return {
@@ -37,7 +48,7 @@ async def analyze_trade_with_ai(trade_data: Dict) -> Dict:
             "advice": "Сделайте паузу на 15 минут после такой сделки. Рынок никуда не убежит.",
             "score": 30
         }
-    elif pnl > 0 and float(trade_data.get('mfe_price', 0)) > float(trade_data.get('exit_price', 0)) * 1.05:
+    elif pnl > 0 and float(trade_data.get('mfe_price') or 0) > float(trade_data.get('exit_price') or 0) * 1.05:
         return {
             "verdict": "Early Exit",
             "analysis": "Хороший системный вход, но вы закрылись слишком рано, не дождавшись цели. Прибыль могла быть в 2 раза выше.",
@@ -51,3 +62,41 @@ async def analyze_trade_with_ai(trade_data: Dict) -> Dict:
             "advice": "Отличная работа. Продолжайте следовать чек-листу.",
             "score": 90
         }
+
+def _build_batch_prompt(trades_data: List[Dict]) -> str:
+    parts = [f"Сделка #{i + 1}:\n{build_prompt(trade)}" for i, trade in enumerate(trades_data)]
+    return (
+        "\n".join(parts)
+        + f"\nОтветь JSON-объектом {{\"results\": [...]}} из {len(trades_data)} элементов в том же порядке,"
+        " у каждого поля verdict, analysis, advice, score (0-100)."
+    )
+
+async def _openai_batch(trades_data: List[Dict]) -> List[Dict]:
+    if openai is None:
+        raise RuntimeError("openai package is required for AI_BACKEND=openai")
+    client = openai.AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    response = await client.chat.completions.create(
+        model=AI_MODEL,
+        messages=[{"role": "user", "content": _build_batch_prompt(trades_data)}],
+        response_format={"type": "json_object"},
+    )
+    results = json.loads(response.choices[0].message.content).get("results", [])
+    if len(results) != len(trades_data):
+        raise ValueError(f"Expected {len(trades_data)} analyses, got {len(results)}")
+    return results
+
+async def analyze_trades_batch(trades_data: List[Dict]) -> List[Dict]:
+    """
+    Анализирует пачку сделок одним вызовом модели. Результаты — в порядке входных сделок.
+    """
+    if not trades_data:
+        return []
+    if AI_BACKEND == "openai":
+        return await _openai_batch(trades_data)
+    return [_stub_analysis(trade) for trade in trades_data]
+
+async def analyze_trade_with_ai(trade_data: Dict) -> Dict:
+    """
+    Отправляет данные сделки в AI для анализа поведения и психологии.
+    """
+    return (await analyze_trades_batch([trade_data]))[0]
@@ -0,0 +1,151 @@
+import asyncio
+import os
+from typing import Dict, List, Optional
+from sqlalchemy import select
+import database
+import models
+import ai_cache
+
+# Сколько пачек анализируется одновременно и сколько сделок в одном вызове модели
+AI_WORKERS = int(os.getenv("AI_WORKERS", "2"))
+AI_BATCH_SIZE = int(os.getenv("AI_BATCH_SIZE", "16"))
+# Сколько секунд ждать добора пачки после первой задачи
+AI_BATCH_LINGER = float(os.getenv("AI_BATCH_LINGER", "0.05"))
+
+# Сколько символов текста ошибки сохранять в Trade.ai_error
+AI_ERROR_MAX_LENGTH = 500
+
+# Статусы Trade.ai_status
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+def trade_ai_input(trade: models.Trade) -> Dict:
+    # Данные сделки для AI (Decimal -> float)
+    return {
+        "symbol": trade.symbol,
+        "direction": trade.direction.value,
+        "pnl": float(trade.pnl),
+        "mae_price": float(trade.mae_price) if trade.mae_price else None,
+        "mfe_price": float(trade.mfe_price) if trade.mfe_price else None,
+        "notes": trade.notes,
+        "emotions": trade.emotions,
+        "exit_price": float(trade.exit_price)
+    }
+
+class AIWorkerPool:
+    """
+    Очередь фонового AI-анализа закрытых сделок.
+    close_trade только ставит сделку в очередь (ai_status = pending);
+    AI_WORKERS воркеров забирают задачи пачками до AI_BATCH_SIZE сделок,
+    анализируют пачку одним вызовом модели (через кэш ai_cache) и записывают Trade.ai_analysis.
+    Статус хранится в БД, поэтому незавершенные задачи переживают перезапуск.
+    """
+
+    def __init__(self, workers: int = AI_WORKERS, batch_size: int = AI_BATCH_SIZE,
+                 linger: float = AI_BATCH_LINGER):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.linger = linger
+        self.queue: Optional[asyncio.Queue] = None
+        self.tasks: List[asyncio.Task] = []
+
+    async def start(self):
+        self.queue = asyncio.Queue()
+        self.tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        await self._recover()
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        self.queue = None
+
+    def enqueue(self, trade_id: int) -> bool:
+        """
+        Ставит сделку в очередь. False — пул не запущен (сделка останется pending
+        и будет подхвачена при следующем старте).
+        """
+        if self.queue is None:
+            return False
+        self.queue.put_nowait(trade_id)
+        return True
+
+    async def join(self):
+        # Дождаться обработки всех поставленных задач
+        if self.queue is not None:
+            await self.queue.join()
+
+    async def _recover(self):
+        # Задачи, не завершенные до остановки процесса
+        async with database.AsyncSessionLocal() as db:
+            result = await db.execute(
+                select(models.Trade.id)
+                .where(models.Trade.ai_status.in_((PENDING, RUNNING)))
+                .order_by(models.Trade.id)
+            )
+            for trade_id in result.scalars():
+                self.enqueue(trade_id)
+
+    async def _next_batch(self) -> List[int]:
+        # Первая задача — ждем сколько нужно, остальные добираем не дольше linger
+        trade_ids = [await self.queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.linger
+        while len(trade_ids) < self.batch_size:
+            if not self.queue.empty():
+                trade_ids.append(self.queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                trade_ids.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return trade_ids
+
+    async def _worker(self):
+        while True:
+            trade_ids = await self._next_batch()
+            try:
+                await self._process(trade_ids)
+            except Exception as e:
+                # Ошибка пачки сохраняется в сделках: клиент видит ее в GET /trades/{id}/analysis
+                await self._mark_failed(trade_ids, f"{type(e).__name__}: {e}")
+            finally:
+                for _ in trade_ids:
+                    self.queue.task_done()
+
+    async def _process(self, trade_ids: List[int]):
+        async with database.AsyncSessionLocal() as db:
+            result = await db.execute(
+                select(models.Trade).where(models.Trade.id.in_(set(trade_ids)))
+            )
+            # Сделку могли удалить или переоткрыть, пока она ждала в очереди
+            trades = [trade for trade in result.scalars() if trade.pnl is not None and trade.exit_price is not None]
+            if not trades:
+                return
+            for trade in trades:
+                trade.ai_status = RUNNING
+            await db.commit()
+
+            # Повторные и одинаковые сделки берутся из кэша, модель видит только новые
+            analyses = await ai_cache.analyze_trades_cached(db, [trade_ai_input(trade) for trade in trades])
+            for trade, analysis in zip(trades, analyses):
+                trade.ai_analysis = analysis
+                trade.ai_error = None
+                trade.ai_status = DONE
+            await db.commit()
+
+    async def _mark_failed(self, trade_ids: List[int], error: str):
+        async with database.AsyncSessionLocal() as db:
+            result = await db.execute(select(models.Trade).where(models.Trade.id.in_(set(trade_ids))))
+            for trade in result.scalars():
+                trade.ai_status = FAILED
+                trade.ai_error = error[:AI_ERROR_MAX_LENGTH]
+            await db.commit()
+
+pool = AIWorkerPool()
@@ -1,19 +1,74 @@
 import numpy as np
-from typing import List, Dict
+from typing import List, Dict, Optional, Union
 from decimal import Decimal
 
-def calculate_optimal_f(trades_pnl: List[float], trades_risk: List[float]) -> Dict:
+# Аналитика принимает как списки, так и массивы NumPy (см. trade_frame.TradeFrame)
+FloatArray = Union[List[float], np.ndarray]
+
+# Сетка f для "холма прибыли" и размер блока сделок при ее расчете
+OPTIMAL_F_GRID = np.linspace(0.01, 1.0, 100)
+_TWR_CHUNK_SIZE = 4096
+# Относительное стандартное отклонение R, ниже которого SQN не считается (все R одинаковы)
+SQN_ZERO_STD_TOLERANCE = 1e-9
+
+def _log_twr(x: np.ndarray, f_values: np.ndarray) -> np.ndarray:
+    """
+    ln(TWR) для каждого f: сумма ln(1 + f * x) по всем сделкам.
+    Считается блоками сделок в переиспользуемом буфере, чтобы матрица f × сделки
+    не занимала память. Сумма логарифмов не переполняется и не уходит в ноль
+    даже на 10^6 сделок.
+    """
+    f_values = np.atleast_1d(np.asarray(f_values, dtype=np.float64))
+    total = np.zeros(len(f_values))
+    buffer = np.empty((len(f_values), min(len(x), _TWR_CHUNK_SIZE)))
+    for start in range(0, len(x), _TWR_CHUNK_SIZE):
+        chunk = x[start:start + _TWR_CHUNK_SIZE]
+        block = buffer[:, :len(chunk)]
+        np.multiply.outer(f_values, chunk, out=block)
+        # HPR = 0 (потеря всего капитала) дает ln = -inf, т.е. TWR = 0
+        with np.errstate(divide="ignore"):
+            np.log1p(block, out=block)
+        total += block.sum(axis=1)
+    return total
+
+def _refine_optimal_f(x: np.ndarray, low: float, high: float, iterations: int = 8) -> float:
+    """
+    Уточнение максимума ln(TWR) шагами Ньютона внутри отрезка [low, high].
+    ln(TWR) вогнута по f, поэтому сходимость — за несколько проходов по сделкам.
+    """
+    # f = 1 обнуляет HPR худшей сделки, поэтому держимся строго внутри
+    high = min(high, 1.0 - 1e-9)
+    f = (low + high) / 2
+    for _ in range(iterations):
+        ratio = x / (1.0 + f * x)
+        first = ratio.sum()                 # d ln(TWR) / df
+        second = -np.square(ratio).sum()    # d2 ln(TWR) / df2
+        if second == 0:
+            break
+        new_f = min(max(f - first / second, low), high)
+        if abs(new_f - f) < 1e-10:
+            return new_f
+        f = new_f
+    return f
+
+def calculate_optimal_f(trades_pnl: FloatArray, trades_risk: FloatArray) -> Dict:
     """
     Расчет Optimal f по Ральфу Винсу.
     trades_pnl: список прибылей/убытков в валюте
     trades_risk: список сумм, которыми рисковали в каждой сделке
+    Возвращает также twr_curve — TWR по сетке f для графика "холма прибыли".
     """
-    if not trades_pnl or len(trades_pnl) < 2:
+    if len(trades_pnl) < 2:
         return {"optimal_f": 0, "expected_growth": 0, "message": "Недостаточно данных для расчета (нужно минимум 2 сделки)"}
 
     # 1. Переводим результаты в R-multiple (результат относительно риска)
     # R = PnL / Risk. Например, заработал $200 при риске $100 -> R = 2.0
-    r_multiples = np.array(trades_pnl) / np.array(trades_risk)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        r_multiples = np.asarray(trades_pnl, dtype=np.float64) / np.asarray(trades_risk, dtype=np.float64)
+    # Сделки с нулевым риском (0/0) в расчет не берем
+    r_multiples = r_multiples[np.isfinite(r_multiples)]
+    if len(r_multiples) < 2:
+        return {"optimal_f": 0, "expected_growth": 0, "message": "Недостаточно данных для расчета (нужно минимум 2 сделки)"}
     
     # Худший результат (самый большой убыток в R)
     worst_case = np.min(r_multiples)
@@ -21,38 +76,50 @@ def calculate_optimal_f(trades_pnl: List[float], trades_risk: List[float]) -> Di
         # Если убытков нет, математика Винса не работает в классическом виде
         return {"optimal_f": 0.5, "expected_growth": 1.0, "message": "У вас нет убыточных сделок! Риск может быть высоким."}
 
-    # 2. Функция для поиска TWR (Terminal Wealth Relative)
-    # TWR = Product(1 + f * (-trade_r / worst_case_r))
-    def get_twr(f):
-        # Ральф Винс использует нормализацию через худший случай
-        hpr = 1 + f * (r_multiples / (-worst_case))
-        # Убираем значения <= 0 для логарифма
-        hpr = hpr[hpr > 0]
-        return np.prod(hpr)
-
-    # 3. Перебор f от 0.01 до 1.0 с шагом 0.01 для поиска максимума
-    f_values = np.linspace(0.01, 1.0, 100)
-    twr_values = [get_twr(f) for f in f_values]
-    
-    best_idx = np.argmax(twr_values)
-    optimal_f = f_values[best_idx]
-    max_twr = twr_values[best_idx]
-    
-    # Геометрическое среднее (G)
-    g = max_twr ** (1 / len(trades_pnl))
+    # 2. TWR (Terminal Wealth Relative) = Product(1 + f * (-trade_r / worst_case_r))
+    # Ральф Винс использует нормализацию через худший случай.
+    # Работаем с ln(TWR): произведение заменяется суммой логарифмов
+    x = r_multiples / (-worst_case)
+
+    # 3. Вся сетка f (0.01..1.0) одним броадкастом
+    log_twr_values = _log_twr(x, OPTIMAL_F_GRID)
+    best_idx = int(np.argmax(log_twr_values))
+
+    # 4. Уточняем максимум между соседними узлами сетки
+    step = OPTIMAL_F_GRID[1] - OPTIMAL_F_GRID[0]
+    low = max(OPTIMAL_F_GRID[best_idx] - step, 0.0)
+    high = min(OPTIMAL_F_GRID[best_idx] + step, 1.0)
+    optimal_f = float(_refine_optimal_f(x, low, high))
+    max_log_twr = float(_log_twr(x, optimal_f)[0])
+    if max_log_twr < log_twr_values[best_idx]:
+        optimal_f, max_log_twr = float(OPTIMAL_F_GRID[best_idx]), float(log_twr_values[best_idx])
+
+    # Геометрическое среднее (G) = TWR^(1/N)
+    n = len(r_multiples)
+    g = np.exp(max_log_twr / n)
+
+    # TWR ограничиваем сверху, чтобы он оставался конечным числом в JSON
+    max_exp = np.log(np.finfo(np.float64).max)
+    twr_values = np.exp(np.minimum(log_twr_values, max_exp))
+    g_values = np.exp(log_twr_values / n)
 
     return {
-        "optimal_f": round(float(optimal_f), 2),
+        "optimal_f": round(float(optimal_f), 4),
         "geometric_mean": round(float(g), 4),
-        "max_twr": round(float(max_twr), 4),
-        "recommended_risk_pct": round(float(optimal_f * 10), 2) # Упрощенная рекомендация
+        "max_twr": round(float(np.exp(min(max_log_twr, max_exp))), 4),
+        "log_twr": round(max_log_twr, 4),
+        "recommended_risk_pct": round(float(optimal_f * 10), 2), # Упрощенная рекомендация
+        "twr_curve": [
+            {"f": round(f, 2), "twr": round(twr, 4), "geometric_mean": round(gm, 6)}
+            for f, twr, gm in zip(OPTIMAL_F_GRID.tolist(), twr_values.tolist(), g_values.tolist())
+        ]
     }
 
-def calculate_z_score(trades_pnl: List[float]) -> Dict:
+def calculate_z_score(trades_pnl: FloatArray) -> Dict:
     """
     Расчет Z-Score (Serial Correlation) для проверки зависимости сделок.
     """
-    if not trades_pnl or len(trades_pnl) < 30:
+    if len(trades_pnl) < 30:
         return {
             "z_score": 0,
             "verdict": "Недостаточно данных (нужно > 30)",
@@ -61,21 +128,27 @@ def calculate_z_score(trades_pnl: List[float]) -> Dict:
 
     # 1. Определяем последовательность выигрышей (W) и проигрышей (L)
     # 0 - убыток, 1 - прибыль
-    sequence = [1 if pnl > 0 else 0 for pnl in trades_pnl if pnl != 0]
+    pnl = np.asarray(trades_pnl, dtype=np.float64)
+    sequence = pnl[pnl != 0] > 0
     
     n = len(sequence)
     if n < 2:
         return {"z_score": 0, "verdict": "Мало сделок", "confidence": "None"}
 
-    wins = sequence.count(1)
-    losses = sequence.count(0)
+    wins = int(np.count_nonzero(sequence))
+    losses = n - wins
 
     # 2. Считаем количество серий (Runs)
     # Серия - это последовательность одинаковых результатов (например, +++ или --)
-    runs = 1
-    for i in range(1, n):
-        if sequence[i] != sequence[i-1]:
-            runs += 1
+    runs = 1 + int(np.count_nonzero(sequence[1:] != sequence[:-1]))
+    return _z_score_from_runs(wins, losses, runs)
+
+def _z_score_from_runs(wins: int, losses: int, runs: int) -> Dict:
+    """
+    Z-Score по числу прибыльных, убыточных сделок и серий
+    (общая часть calculate_z_score и accumulators.ZScoreAccumulator).
+    """
+    n = wins + losses
 
     # 3. Расчет ожидаемого количества серий (Expected Runs)
     # E(R) = 2*W*L / N + 1
@@ -88,6 +161,9 @@ def calculate_z_score(trades_pnl: List[float]) -> Dict:
     
     if denominator == 0:
         return {"z_score": 0, "verdict": "Ошибка расчета", "confidence": "None"}
+    # Только прибыльные или только убыточные сделки: серий не с чем сравнивать (StdDev = 0)
+    if numerator <= 0:
+        return {"z_score": 0, "verdict": "Нет смены знака", "confidence": "None"}
         
     std_dev = np.sqrt(numerator / denominator)
 
@@ -124,32 +200,32 @@ def calculate_z_score(trades_pnl: List[float]) -> Dict:
         "expected_runs": round(expected_runs, 1)
     }
 
-def calculate_sqn(trades_pnl: List[float], trades_risk: List[float]) -> Dict:
+def calculate_sqn(trades_pnl: FloatArray, trades_risk: FloatArray) -> Dict:
     """
     Расчет SQN (System Quality Number) по Ван Тарпу.
     SQN = (Expectancy / StdDev) * sqrt(N)
     Используем R-multiples для расчета.
     """
-    if not trades_pnl or len(trades_pnl) < 2:
+    if len(trades_pnl) < 2:
         return {"sqn": 0, "rating": "Недостаточно данных"}
 
-    # Расчет R-multiples
-    r_multiples = []
-    for pnl, risk in zip(trades_pnl, trades_risk):
-        if risk == 0:
-            r_multiples.append(0)
-        else:
-            r_multiples.append(pnl / risk)
-            
-    r_array = np.array(r_multiples)
+    # Расчет R-multiples (при нулевом риске R = 0)
+    r_array = _r_multiples(trades_pnl, trades_risk, np.not_equal)
     
     avg_r = np.mean(r_array)
     std_dev_r = np.std(r_array, ddof=1) # Стандартное отклонение выборки
-    
-    if std_dev_r == 0:
+    return _sqn_from_moments(len(trades_pnl), avg_r, std_dev_r)
+
+def _sqn_from_moments(n: int, avg_r: float, std_dev_r: float) -> Dict:
+    """
+    SQN и оценка по шкале Ван Тарпа по среднему и стандартному отклонению R
+    (общая часть calculate_sqn и accumulators.SqnAccumulator).
+    Отклонение в пределах ошибки округления (одинаковые R) считается нулевым:
+    np.std и алгоритм Уэлфорда дают для них разный "шум" порядка 1e-17.
+    """
+    if std_dev_r <= SQN_ZERO_STD_TOLERANCE * max(1.0, abs(avg_r)):
         return {"sqn": 0, "rating": "Стабильно (StdDev=0)"}
         
-    n = len(trades_pnl)
     sqn = (avg_r / std_dev_r) * np.sqrt(n)
     
     # Шкала Ван Тарпа
@@ -163,46 +239,43 @@ def calculate_sqn(trades_pnl: List[float], trades_risk: List[float]) -> Dict:
     
     return {"sqn": round(float(sqn), 2), "rating": rating}
 
-def calculate_advanced_stats(trades_pnl: List[float], trades_risk: List[float]) -> Dict:
+def calculate_advanced_stats(trades_pnl: FloatArray, trades_risk: FloatArray) -> Dict:
     """
     Расчет дополнительных метрик: Profit Factor, R-Expectancy, Recovery Factor.
     """
-    if not trades_pnl:
+    if len(trades_pnl) == 0:
         return {
             "profit_factor": 0,
             "r_expectancy": 0,
             "recovery_factor": 0
         }
 
+    pnl = np.asarray(trades_pnl, dtype=np.float64)
+
     # 1. Profit Factor
-    gross_profit = sum(p for p in trades_pnl if p > 0)
-    gross_loss = abs(sum(p for p in trades_pnl if p < 0))
-    profit_factor = round(gross_profit / gross_loss, 2) if gross_loss != 0 else 99.99
+    gross_profit = float(pnl[pnl > 0].sum())
+    gross_loss = abs(float(pnl[pnl < 0].sum()))
 
-    # 2. R-Expectancy
-    r_multiples = []
-    for pnl, risk in zip(trades_pnl, trades_risk):
-        if risk > 0:
-            r_multiples.append(pnl / risk)
-        else:
-            r_multiples.append(0)
-    
-    r_expectancy = round(float(np.mean(r_multiples)), 2) if r_multiples else 0
+    # 2. R-Expectancy (учитываются только сделки с положительным риском)
+    r_multiples = _r_multiples(pnl, trades_risk, np.greater)
 
     # 3. Recovery Factor
-    running_balance = 0
-    max_drawdown = 0
-    peak = 0
-    
-    for pnl in trades_pnl:
-        running_balance += pnl
-        if running_balance > peak:
-            peak = running_balance
-        drawdown = peak - running_balance
-        if drawdown > max_drawdown:
-            max_drawdown = drawdown
-            
-    net_profit = sum(trades_pnl)
+    # Баланс начинается с 0, поэтому пик не может быть ниже нуля
+    running_balance = np.cumsum(pnl)
+    peak = np.maximum.accumulate(np.maximum(running_balance, 0))
+    max_drawdown = float(np.max(peak - running_balance))
+    return _advanced_from_totals(
+        gross_profit, gross_loss, float(np.mean(r_multiples)), float(running_balance[-1]), max_drawdown
+    )
+
+def _advanced_from_totals(gross_profit: float, gross_loss: float, mean_r: float,
+                          net_profit: float, max_drawdown: float) -> Dict:
+    """
+    Profit Factor, R-Expectancy и Recovery Factor по итогам сделок
+    (общая часть calculate_advanced_stats и accumulators.AdvancedStatsAccumulator).
+    """
+    profit_factor = round(gross_profit / gross_loss, 2) if gross_loss != 0 else 99.99
+    r_expectancy = round(mean_r, 2)
     recovery_factor = round(net_profit / max_drawdown, 2) if max_drawdown > 0 else (99.99 if net_profit > 0 else 0)
 
     return {
@@ -211,54 +284,67 @@ def calculate_advanced_stats(trades_pnl: List[float], trades_risk: List[float])
         "recovery_factor": recovery_factor
     }
 
-def analyze_mae_mfe(trades):
+def _r_multiples(trades_pnl: FloatArray, trades_risk: FloatArray, risk_ok) -> np.ndarray:
     """
-    Анализирует MAE/MFE для списка сделок.
+    R = PnL / Risk для сделок, где risk_ok(risk, 0) истинно, иначе 0.
+    """
+    pnl = np.asarray(trades_pnl, dtype=np.float64)
+    risk = np.asarray(trades_risk, dtype=np.float64)
+    valid = risk_ok(risk, 0)
+    return np.divide(pnl, risk, out=np.zeros_like(pnl), where=valid)
+
+def analyze_mae_mfe(frame):
+    """
+    Анализирует MAE/MFE для сделок из trade_frame.TradeFrame.
     Возвращает рекомендации по оптимизации стопов и тейков.
     """
-    if not trades:
+    if len(frame) == 0:
         return {"recommendations": ["Недостаточно данных для анализа"]}
 
-    mae_ratios = []
-    mfe_ratios = []
+    # Нам нужны закрытые сделки с заполненными MAE/MFE и стоп-лоссом
+    # (нулевые цены, как и раньше, считаются незаполненными)
+    entry = np.nan_to_num(frame.entry_price)
+    stop = np.nan_to_num(frame.stop_loss)
+    mae = np.nan_to_num(frame.mae_price)
+    mfe = np.nan_to_num(frame.mfe_price)
 
-    for t in trades:
-        # Нам нужны закрытые сделки с заполненными MAE/MFE и стоп-лоссом
-        if not t.exit_at or not t.stop_loss or not t.entry_price:
-            continue
-        
-        # Расстояние от входа до стопа (риск в пунктах/цене)
-        risk_dist = abs(float(t.entry_price) - float(t.stop_loss))
-        if risk_dist == 0:
-            continue
-        
-        if t.mae_price:
-            # Насколько глубоко цена заходила в минус относительно стопа
-            mae_dist = abs(float(t.entry_price) - float(t.mae_price))
-            mae_ratios.append(mae_dist / risk_dist)
-            
-        if t.mfe_price:
-            # Насколько далеко цена уходила в плюс относительно риска
-            mfe_dist = abs(float(t.entry_price) - float(t.mfe_price))
-            mfe_ratios.append(mfe_dist / risk_dist)
+    # Расстояние от входа до стопа (риск в пунктах/цене)
+    risk_dist = np.abs(entry - stop)
+    usable = frame.is_closed & (stop != 0) & (entry != 0) & (risk_dist != 0)
 
+    # Насколько глубоко цена заходила в минус относительно стопа
+    has_mae = usable & (mae != 0)
+    mae_ratios = np.abs(entry[has_mae] - mae[has_mae]) / risk_dist[has_mae]
+
+    # Насколько далеко цена уходила в плюс относительно риска
+    has_mfe = usable & (mfe != 0)
+    mfe_ratios = np.abs(entry[has_mfe] - mfe[has_mfe]) / risk_dist[has_mfe]
+
+    return _mae_mfe_from_averages(
+        float(np.mean(mae_ratios)) if len(mae_ratios) else None,
+        float(np.mean(mfe_ratios)) if len(mfe_ratios) else None,
+    )
+
+def _mae_mfe_from_averages(avg_mae_ratio: Optional[float], avg_mfe_ratio: Optional[float]) -> Dict:
+    """
+    Рекомендации по средним MAE/MFE в долях риска; None — нет сделок с MAE (MFE)
+    (общая часть analyze_mae_mfe и accumulators.MaeMfeAccumulator).
+    """
     recommendations = []
     
-    if mae_ratios:
-        avg_mae_ratio = sum(mae_ratios) / len(mae_ratios)
+    if avg_mae_ratio is not None:
         if avg_mae_ratio < 0.5:
             recommendations.append("Ваши стоп-лоссы слишком широкие. Средний MAE составляет менее 50% от стопа.")
         elif avg_mae_ratio > 0.8:
             recommendations.append("Ваши стоп-лоссы слишком узкие. Цена часто подходит близко к стопу перед разворотом.")
 
-    if mfe_ratios:
-        avg_mfe_ratio = sum(mfe_ratios) / len(mfe_ratios)
+    if avg_mfe_ratio is not None:
         # Если цена в среднем уходит в 3 раза дальше риска, а мы закрываем раньше
         if avg_mfe_ratio > 3.0:
             recommendations.append("Вы закрываете сделки слишком рано. Средний MFE значительно превышает ваш риск.")
 
     return {
-        "avg_mae_ratio": round(sum(mae_ratios)/len(mae_ratios), 2) if mae_ratios else 0,
-        "avg_mfe_ratio": round(sum(mfe_ratios)/len(mfe_ratios), 2) if mfe_ratios else 0,
+        "avg_mae_ratio": round(avg_mae_ratio, 2) if avg_mae_ratio is not None else 0,
+        "avg_mfe_ratio": round(avg_mfe_ratio, 2) if avg_mfe_ratio is not None else 0,
         "recommendations": recommendations if recommendations else ["Продолжайте торговать, пока паттерны не выявлены."]
     }
@@ -0,0 +1,186 @@
+"""
+Бенчмарк конкурентного доступа к SQLite: читатели (статистика, список сделок)
+работают параллельно с писателем (импорт пачками).
+
+Каждый профиль БД запускается в отдельном процессе на временной копии базы,
+потому что движки создаются при импорте database по переменным окружения.
+
+    python benchmarks/bench_db_concurrency.py --trades 20000 --duration 10 --readers 4
+
+Результат — JSON: задержки читателей (p50/p95/max), число чтений и ошибок,
+скорость записи писателя для профилей development и production.
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROFILES = ("development", "production")
+
+def make_trades(n: int, start: datetime, rnd: random.Random):
+    # Закрытые сделки со случайным PnL и тегами, как после импорта брокерского отчета
+    import models
+    trades = []
+    for i in range(n):
+        entry_at = start + timedelta(minutes=i)
+        entry_price = round(rnd.uniform(50, 500), 2)
+        exit_price = round(entry_price * rnd.uniform(0.97, 1.03), 2)
+        quantity = rnd.randint(1, 100)
+        trades.append({
+            "symbol": rnd.choice(("SBER", "GAZP", "LKOH", "YNDX", "VTBR")),
+            "direction": models.TradeDirection.LONG,
+            "entry_price": entry_price,
+            "exit_price": exit_price,
+            "quantity": quantity,
+            "entry_at": entry_at,
+            "exit_at": entry_at + timedelta(minutes=30),
+            "pnl": round((exit_price - entry_price) * quantity, 2),
+            "tags": rnd.sample(("breakout", "news", "scalp", "swing"), k=rnd.randint(0, 2)),
+        })
+    return trades
+
+def percentile(values, q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+def run_profile(args) -> dict:
+    """
+    Запускается в дочернем процессе с уже выставленными DATABASE_URL и DB_PROFILE.
+    """
+    sys.path.insert(0, BACKEND_DIR)
+    import database
+    import import_service
+    import stats_service
+    import trade_service
+
+    database.init_db()
+    rnd = random.Random(args.seed)
+    start = datetime(2020, 1, 1)
+    with database.SessionLocal() as db:
+        import_service.write_trades(db, make_trades(args.trades, start, rnd), batch_size=5000)
+    start += timedelta(minutes=args.trades)
+
+    stop = threading.Event()
+    latencies = {"stats": [], "list": []}
+    errors = {"read": 0, "write": 0}
+    written = {"trades": 0, "batches": 0, "seconds": 0.0}
+    lock = threading.Lock()
+
+    def reader(kind: str):
+        while not stop.is_set():
+            began = time.perf_counter()
+            try:
+                with database.ReadSessionLocal() as db:
+                    if kind == "stats":
+                        stats_service.compute_dashboard_stats(db, 1)
+                    else:
+                        trade_service.list_trades(db, limit=200, descending=True)
+            except Exception:
+                with lock:
+                    errors["read"] += 1
+                continue
+            with lock:
+                latencies[kind].append(time.perf_counter() - began)
+
+    def writer():
+        nonlocal start
+        began = time.perf_counter()
+        while not stop.is_set():
+            batch = make_trades(args.write_batch, start, rnd)
+            start += timedelta(minutes=args.write_batch)
+            with database.SessionLocal() as db:
+                counts = import_service.write_trades(db, batch, batch_size=args.write_batch)
+            written["trades"] += counts["inserted"]
+            written["batches"] += 1
+            errors["write"] += counts["failed"]
+        written["seconds"] = time.perf_counter() - began
+
+    threads = [threading.Thread(target=writer)]
+    threads += [
+        threading.Thread(target=reader, args=("stats" if i % 2 == 0 else "list",))
+        for i in range(args.readers)
+    ]
+    for thread in threads:
+        thread.start()
+    time.sleep(args.duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    def summary(values):
+        return {
+            "count": len(values),
+            "p50_ms": round(percentile(values, 50) * 1000, 2),
+            "p95_ms": round(percentile(values, 95) * 1000, 2),
+            "max_ms": round(max(values, default=0) * 1000, 2),
+        }
+
+    return {
+        "profile": database.DB_PROFILE,
+        "readers": {kind: summary(values) for kind, values in latencies.items()},
+        "read_errors": errors["read"],
+        "writer": {
+            "trades": written["trades"],
+            "batches": written["batches"],
+            "trades_per_sec": round(written["trades"] / written["seconds"], 1) if written["seconds"] else 0,
+            "failed_rows": errors["write"],
+        },
+    }
+
+def spawn(profile: str, args) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(
+            os.environ,
+            DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'bench.db')}",
+            DB_PROFILE=profile,
+        )
+        env.pop("DATABASE_READ_URL", None)
+        env.pop("ASYNC_DATABASE_URL", None)
+        cmd = [
+            sys.executable, os.path.abspath(__file__), "--child",
+            "--trades", str(args.trades), "--duration", str(args.duration),
+            "--readers", str(args.readers), "--write-batch", str(args.write_batch),
+            "--seed", str(args.seed),
+        ]
+        result = subprocess.run(cmd, env=env, cwd=tmp, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"Profile {profile} failed:\n{result.stderr}")
+        # Результат — JSON, который --child печатает последним. Сейчас больше ничего в stdout
+        # не пишется (сбойные строки write_trades уходят в отчет errors, а не в вывод), но
+        # берем последнюю строку, чтобы отладочный вывод импортируемых модулей не ломал разбор
+        return json.loads(result.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description="SQLite reader/writer concurrency benchmark")
+    parser.add_argument("--trades", type=int, default=20000, help="Сделок в базе перед замером")
+    parser.add_argument("--duration", type=float, default=10, help="Длительность замера, с")
+    parser.add_argument("--readers", type=int, default=4, help="Число потоков-читателей")
+    parser.add_argument("--write-batch", type=int, default=500, help="Сделок в пачке писателя")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--profile", choices=PROFILES, action="append",
+                        help="Профиль БД (по умолчанию оба)")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_profile(args)))
+        return
+
+    results = [spawn(profile, args) for profile in args.profile or PROFILES]
+    print(json.dumps({
+        "trades": args.trades, "duration": args.duration,
+        "readers": args.readers, "write_batch": args.write_batch,
+        "results": results,
+    }, indent=2, ensure_ascii=False))
+
+if __name__ == "__main__":
+    main()
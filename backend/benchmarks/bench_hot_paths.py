@@ -0,0 +1,223 @@
+"""
+Микробенчмарки горячих путей: функции analytics.py, what-if сценарии, разбор отчетов (parse_tinkoff_excel,
+parse_trade_file), Inventory и расчет статистики дашборда на синтетическом журнале.
+
+    python benchmarks/bench_hot_paths.py --sizes 1000,10000,100000 --output before.json
+    python benchmarks/bench_hot_paths.py --sizes 1000,10000,100000 --compare before.json
+
+Для каждого бенчмарка и размера сохраняется лучшее и медианное время из --repeat запусков.
+С --compare печатается отношение к прошлому прогону (> 1 — стало медленнее).
+Большие размеры дорогие для файлов и БД, поэтому для них есть отдельные пределы
+(--max-excel, --max-csv, --max-db); пропущенные замеры попадают в JSON как skipped.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, BACKEND_DIR)
+
+# Отношение времени к базовому прогону, начиная с которого печатается REGRESSION
+REGRESSION_RATIO = 1.2
+
+def measure(fn: Callable, repeat: int) -> Dict:
+    times = []
+    for _ in range(repeat):
+        began = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - began)
+    return {"best_s": min(times), "median_s": statistics.median(times), "repeat": repeat}
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+def parse_sizes(value: str) -> List[int]:
+    # "1000,1e5" -> [1000, 100000]
+    return [int(float(size)) for size in value.split(",") if size.strip()]
+
+def run(args) -> Dict:
+    # Движки БД создаются при импорте database — сначала указываем временную базу
+    tmp = tempfile.TemporaryDirectory()
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp.name, 'bench.db')}"
+    os.environ.pop("DATABASE_READ_URL", None)
+    os.environ.pop("ASYNC_DATABASE_URL", None)
+
+    import analytics
+    import database
+    import import_service
+    import models
+    import stats_service
+    import whatif
+    import rolling
+    from synthetic import SyntheticJournal, write_journal
+
+    database.init_db()
+    selected = set(args.only.split(",")) if args.only else None
+    results = []
+
+    def bench(name: str, size: int, fn: Optional[Callable], limit: Optional[int] = None):
+        if not wanted(name):
+            return
+        if limit is not None and size > limit:
+            results.append({"benchmark": name, "size": size, "skipped": f"size > {limit}"})
+            return
+        result = {"benchmark": name, "size": size, **measure(fn, args.repeat)}
+        result["us_per_trade"] = round(result["best_s"] / size * 1e6, 4)
+        results.append(result)
+        print(f"{name:<40} {size:>10} {result['best_s'] * 1000:>12.2f} ms", file=sys.stderr)
+
+    def wanted(*names: str) -> bool:
+        # Дорогую подготовку (файлы, БД) делаем только для выбранных бенчмарков
+        return not selected or any(
+            name.startswith(prefix) or prefix.startswith(name) for name in names for prefix in selected
+        )
+
+    for size in args.sizes:
+        journal = SyntheticJournal(size, seed=args.seed, n_symbols=args.symbols)
+        frame = journal.trade_frame()
+        pnls, risks = frame.pnl, frame.risk
+
+        bench("analytics.calculate_optimal_f", size, lambda: analytics.calculate_optimal_f(pnls, risks))
+        bench("analytics.calculate_z_score", size, lambda: analytics.calculate_z_score(pnls))
+        bench("analytics.calculate_sqn", size, lambda: analytics.calculate_sqn(pnls, risks))
+        bench("analytics.calculate_advanced_stats", size, lambda: analytics.calculate_advanced_stats(pnls, risks))
+        bench("analytics.analyze_mae_mfe", size, lambda: analytics.analyze_mae_mfe(frame))
+        # Сетка сценариев по умолчанию (300 сочетаний стоп × цель × безубыток)
+        bench("whatif.run_what_if", size, lambda: whatif.run_what_if(frame))
+        bench("rolling.compute_rolling", size, lambda: rolling.compute_rolling(pnls, risks, 100))
+
+        if wanted("import_service.Inventory"):
+            fills = journal.fills()
+
+            def inventory():
+                inventory = import_service.Inventory()
+                for symbol, direction, qty, price in fills:
+                    inventory.process_trade(symbol, direction, qty, price)
+
+            bench("import_service.Inventory", size, inventory)
+            del fills
+
+        if wanted("import_service.parse_trade_file"):
+            if size <= args.max_csv:
+                csv_bytes = journal.to_csv()
+                bench("import_service.parse_trade_file", size,
+                      lambda: import_service.parse_trade_file(csv_bytes, "journal.csv"))
+                del csv_bytes
+            else:
+                bench("import_service.parse_trade_file", size, None, limit=args.max_csv)
+
+        if wanted("import_service.parse_tinkoff_excel"):
+            if size <= args.max_excel:
+                xlsx_bytes = journal.to_tinkoff_excel()
+                bench("import_service.parse_tinkoff_excel", size,
+                      lambda: import_service.parse_tinkoff_excel(xlsx_bytes))
+                del xlsx_bytes
+            else:
+                bench("import_service.parse_tinkoff_excel", size, None, limit=args.max_excel)
+
+        if wanted("stats_service"):
+            if size <= args.max_db:
+                with database.SessionLocal() as db:
+                    for table in (models.TradeTag, models.Trade, models.AccountStats):
+                        db.query(table).delete()
+                    db.commit()
+                    write_journal(db, journal)
+
+                with database.SessionLocal() as db:
+                    # Полный пересчет (первый GET /stats/ после изменения сделок)
+                    bench("stats_service.compute_dashboard_stats", size,
+                          lambda: stats_service.compute_dashboard_stats(db, 1))
+
+                    # Повторный GET /stats/ после перезапуска: снапшот из БД
+                    stats_service.get_dashboard_stats(db, 1)
+
+                    def from_snapshot():
+                        stats_service._snapshot_cache.clear()
+                        stats_service.get_dashboard_stats(db, 1)
+
+                    bench("stats_service.get_dashboard_stats.snapshot", size, from_snapshot)
+                    bench("stats_service.compute_equity_curve", size,
+                          lambda: stats_service.compute_equity_curve(db, 1))
+            else:
+                bench("stats_service.compute_dashboard_stats", size, None, limit=args.max_db)
+                bench("stats_service.get_dashboard_stats.snapshot", size, None, limit=args.max_db)
+                bench("stats_service.compute_equity_curve", size, None, limit=args.max_db)
+        del journal, frame
+
+    tmp.cleanup()
+    return {
+        "meta": {
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "seed": args.seed,
+            "symbols": args.symbols,
+        },
+        "results": results,
+    }
+
+def compare(current: Dict, baseline: Dict) -> None:
+    before = {
+        (row["benchmark"], row["size"]): row["best_s"]
+        for row in baseline["results"] if "best_s" in row
+    }
+    print(f"{'benchmark':<45} {'size':>10} {'before ms':>12} {'after ms':>12} {'ratio':>8}")
+    for row in current["results"]:
+        old = before.get((row["benchmark"], row["size"]))
+        if old is None or "best_s" not in row:
+            continue
+        ratio = row["best_s"] / old if old else float("inf")
+        mark = "  REGRESSION" if ratio > REGRESSION_RATIO else ""
+        print(f"{row['benchmark']:<45} {row['size']:>10} {old * 1000:>12.2f} "
+              f"{row['best_s'] * 1000:>12.2f} {ratio:>8.2f}{mark}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Hot path micro-benchmarks on a synthetic journal")
+    parser.add_argument("--sizes", type=parse_sizes, default=parse_sizes("1e3,1e4,1e5"),
+                        help="Размеры журнала через запятую (до 1e7)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--symbols", type=int, default=200, help="Число инструментов")
+    parser.add_argument("--only", help="Префиксы бенчмарков через запятую, напр. analytics,stats_service")
+    parser.add_argument("--max-excel", type=int, default=10_000,
+                        help="Максимальный размер для parse_tinkoff_excel (xlsx пишется медленно)")
+    parser.add_argument("--max-csv", type=int, default=1_000_000, help="Максимальный размер для parse_trade_file")
+    parser.add_argument("--max-db", type=int, default=1_000_000, help="Максимальный размер для статистики из БД")
+    parser.add_argument("--output", help="Файл для JSON (по умолчанию stdout)")
+    parser.add_argument("--compare", help="JSON прошлого прогона для сравнения")
+    args = parser.parse_args()
+
+    result = run(args)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+    else:
+        print(json.dumps(result, indent=2, ensure_ascii=False))
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(result, json.load(f))
+
+if __name__ == "__main__":
+    main()
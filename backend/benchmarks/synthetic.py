@@ -0,0 +1,221 @@
+"""
+Генератор синтетического журнала сделок для бенчмарков (10^3 .. 10^7 сделок).
+
+Журнал хранится по колонкам (NumPy), поэтому 10^7 сделок занимают около гигабайта
+и создаются за секунды; словари сделок, файлы отчетов и TradeFrame строятся из него
+по требованию. Один и тот же seed дает один и тот же журнал.
+"""
+import io
+import os
+import sys
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+import models
+import trade_frame
+import import_service
+
+TAGS = ("breakout", "trend", "reversal", "news", "scalp", "fomo", "tilt", "disciplined")
+SETUPS = ("Breakout", "Mean Reversion", "Trend Following", "Scalp")
+# Максимум строк на листе Excel
+EXCEL_MAX_ROWS = 1_048_576
+
+class SyntheticJournal:
+    """
+    Закрытые (и немного открытых) сделки в колоночном виде.
+    Время — int64 секунды Unix, у открытых сделок exit_* и pnl — NaN.
+    """
+
+    def __init__(self, n: int, seed: int = 0, n_symbols: int = 200, win_rate: float = 0.55,
+                 open_share: float = 0.01, start: datetime = datetime(2015, 1, 1), years: float = 10):
+        rng = np.random.default_rng(seed)
+        self.n = n
+        self.symbols = np.array([f"SYM{i:04d}" for i in range(n_symbols)], dtype=object)
+
+        # Популярность инструментов по закону Ципфа: немного ликвидных, длинный хвост
+        weights = 1.0 / np.arange(1, n_symbols + 1)
+        self.symbol_index = rng.choice(n_symbols, size=n, p=weights / weights.sum())
+        base_price = np.exp(rng.uniform(np.log(5), np.log(5000), n_symbols))
+
+        start_ts = int(start.timestamp())
+        self.entry_ts = np.sort(rng.integers(start_ts, start_ts + int(years * 365 * 86400), n))
+        self.exit_ts = self.entry_ts + rng.integers(60, 5 * 86400, n)
+
+        self.is_long = rng.random(n) < 0.6
+        sign = np.where(self.is_long, 1.0, -1.0)
+        self.entry_price = np.round(base_price[self.symbol_index] * rng.uniform(0.8, 1.2, n), 4)
+        self.quantity = rng.integers(1, 100, n).astype(np.float64)
+
+        # Стоп в 0.5-3% от входа, результат: прибыль до 4%, убыток до стопа
+        stop_dist = self.entry_price * rng.uniform(0.005, 0.03, n)
+        is_win = rng.random(n) < win_rate
+        move = np.where(is_win, stop_dist * rng.uniform(0.3, 3.0, n), -stop_dist * rng.uniform(0.2, 1.0, n))
+        self.exit_price = np.round(self.entry_price + sign * move, 4)
+        self.stop_loss = np.round(self.entry_price - sign * stop_dist, 4)
+        self.take_profit = np.round(self.entry_price + sign * stop_dist * 2, 4)
+        self.risk_amount = np.round(stop_dist * self.quantity, 2)
+        self.pnl = np.round(sign * (self.exit_price - self.entry_price) * self.quantity, 2)
+
+        # MAE не дальше стопа, MFE не ближе выхода
+        adverse = stop_dist * rng.uniform(0.0, 1.0, n)
+        favorable = np.maximum(np.maximum(move, 0), stop_dist * rng.uniform(0.0, 3.5, n))
+        self.mae_price = np.round(self.entry_price - sign * adverse, 4)
+        self.mfe_price = np.round(self.entry_price + sign * favorable, 4)
+
+        # Теги — битовая маска по TAGS, у каждого тега вероятность 20%
+        bits = rng.random((n, len(TAGS))) < 0.2
+        self.tag_mask = (bits * (1 << np.arange(len(TAGS)))).sum(axis=1)
+        self.setup_index = rng.integers(0, len(SETUPS), n)
+
+        is_open = rng.random(n) < open_share
+        for name in ("exit_price", "pnl", "mae_price", "mfe_price"):
+            getattr(self, name)[is_open] = np.nan
+        self.exit_ts[is_open] = trade_frame.NO_TIMESTAMP
+        self.is_open = is_open
+
+    def __len__(self):
+        return self.n
+
+    def trade_frame(self) -> trade_frame.TradeFrame:
+        """
+        TradeFrame закрытых сделок в порядке закрытия, как его вернул бы load_trade_frame.
+        """
+        closed = np.flatnonzero(~self.is_open)
+        closed = closed[np.argsort(self.exit_ts[closed], kind="stable")]
+        flags = np.where(self.is_long[closed], trade_frame.FLAG_LONG, 0) + trade_frame.FLAG_CLOSED
+        data = np.column_stack([
+            closed + 1, self.pnl[closed], self.risk_amount[closed], self.entry_price[closed],
+            self.exit_price[closed], self.stop_loss[closed], self.mae_price[closed],
+            self.mfe_price[closed], self.quantity[closed], self.entry_ts[closed],
+            self.exit_ts[closed], flags,
+        ]).astype(np.float64)
+        return trade_frame.TradeFrame(data)
+
+    def tags(self, index: int) -> List[str]:
+        mask = int(self.tag_mask[index])
+        return [tag for bit, tag in enumerate(TAGS) if mask & (1 << bit)]
+
+    def trade_dicts(self, start: int = 0, stop: Optional[int] = None) -> List[Dict]:
+        """
+        Сделки [start, stop) в виде словарей для import_service.write_trades.
+        """
+        stop = self.n if stop is None else min(stop, self.n)
+        part = slice(start, stop)
+
+        def values(array):
+            # NaN -> None, numpy-числа -> float
+            return [None if v != v else v for v in array[part].tolist()]
+
+        def times(array):
+            raw = array[part]
+            at = raw.astype("datetime64[s]").astype(object)
+            return [None if ts == trade_frame.NO_TIMESTAMP else dt for ts, dt in zip(raw.tolist(), at)]
+
+        long_, short = models.TradeDirection.LONG, models.TradeDirection.SHORT
+        columns = zip(
+            self.symbols[self.symbol_index[part]].tolist(), self.is_long[part].tolist(),
+            values(self.entry_price), values(self.exit_price), values(self.quantity),
+            times(self.entry_ts), times(self.exit_ts), values(self.stop_loss), values(self.take_profit),
+            values(self.risk_amount), values(self.mae_price), values(self.mfe_price), values(self.pnl),
+            self.setup_index[part].tolist(), range(start, stop),
+        )
+        return [
+            {
+                "symbol": symbol, "direction": long_ if is_long else short,
+                "entry_price": entry_price, "exit_price": exit_price, "quantity": quantity,
+                "entry_at": entry_at, "exit_at": exit_at, "stop_loss": stop_loss,
+                "take_profit": take_profit, "risk_amount": risk_amount,
+                "mae_price": mae_price, "mfe_price": mfe_price, "pnl": pnl,
+                "setup_name": SETUPS[setup], "tags": self.tags(index),
+            }
+            for (symbol, is_long, entry_price, exit_price, quantity, entry_at, exit_at, stop_loss,
+                 take_profit, risk_amount, mae_price, mfe_price, pnl, setup, index) in columns
+        ]
+
+    def fills(self) -> List[tuple]:
+        """
+        Поток исполнений (symbol, direction, qty, price) в порядке времени:
+        вход и выход каждой закрытой сделки — для движка позиций / Inventory.
+        """
+        closed = ~self.is_open
+        symbols = self.symbols[self.symbol_index]
+        long_, short = models.TradeDirection.LONG, models.TradeDirection.SHORT
+        entry_dir = np.where(self.is_long, long_, short)
+        exit_dir = np.where(self.is_long, short, long_)
+
+        symbol = np.concatenate([symbols, symbols[closed]])
+        direction = np.concatenate([entry_dir, exit_dir[closed]])
+        qty = np.concatenate([self.quantity, self.quantity[closed]])
+        price = np.concatenate([self.entry_price, self.exit_price[closed]])
+        order = np.argsort(np.concatenate([self.entry_ts, self.exit_ts[closed]]), kind="stable")
+        return list(zip(
+            symbol[order].tolist(), direction[order].tolist(), qty[order].tolist(), price[order].tolist()
+        ))
+
+    def to_csv(self) -> bytes:
+        """
+        Журнал в универсальном CSV-формате (одна строка — сделка с PnL), как у бирж.
+        """
+        df = pd.DataFrame({
+            "Date": pd.to_datetime(self.entry_ts, unit="s").strftime("%Y-%m-%d %H:%M:%S"),
+            "Symbol": self.symbols[self.symbol_index],
+            "Side": np.where(self.is_long, "BUY", "SELL"),
+            "Price": self.entry_price,
+            "Quantity": self.quantity,
+            "PnL": self.pnl,
+            "Fee": np.round(self.entry_price * self.quantity * 0.0005, 2),
+        })
+        return df.to_csv(index=False).encode("utf-8")
+
+    def to_tinkoff_excel(self) -> bytes:
+        """
+        Брокерский отчет Тинькофф (xlsx): исполнения входа и выхода как отдельные строки.
+        """
+        fills = self.fills()
+        if len(fills) + 10 > EXCEL_MAX_ROWS:
+            raise ValueError(f"{len(fills)} fills do not fit into one Excel sheet")
+        closed = ~self.is_open
+        ts = np.concatenate([self.entry_ts, self.exit_ts[closed]])
+        ts = np.sort(ts, kind="stable")
+        at = pd.to_datetime(ts, unit="s")
+        symbol, direction, qty, price = (np.array(column, dtype=object) for column in zip(*fills))
+        qty = qty.astype(np.float64)
+        price = price.astype(np.float64)
+
+        header = [
+            "Номер сделки", "Номер поручения", "Дата\nзаключения", "Время", "Торговая площадка",
+            "Вид сделки", "Сокращенное наименование", "Код актива", "Цена за единицу",
+            "Количество", "Сумма сделки", "Комиссия брокера", "Комиссия биржи", "Комиссия клир. центра",
+        ]
+        body = pd.DataFrame({
+            0: np.arange(1, len(fills) + 1), 1: np.arange(1, len(fills) + 1) * 10,
+            2: at.strftime("%d.%m.%Y"), 3: at.strftime("%H:%M:%S"), 4: "MOEX",
+            5: np.where(direction == models.TradeDirection.LONG, "Покупка", "Продажа"),
+            6: symbol, 7: symbol, 8: price, 9: qty, 10: np.round(price * qty, 2),
+            11: np.round(price * qty * 0.0005, 2), 12: 0.0, 13: 0.0,
+        })
+        title = pd.DataFrame(
+            [["Отчет о сделках"] + [None] * 13, [None] * 14, header], columns=range(14)
+        )
+        buffer = io.BytesIO()
+        pd.concat([title, body], ignore_index=True).to_excel(buffer, header=False, index=False)
+        return buffer.getvalue()
+
+def write_journal(db, journal: SyntheticJournal, account_id: int = 1, chunk_size: int = 50_000) -> int:
+    """
+    Пишет журнал в БД через import_service.write_trades. Возвращает число записанных сделок.
+    """
+    inserted = 0
+    for start in range(0, len(journal), chunk_size):
+        counts = import_service.write_trades(
+            db, journal.trade_dicts(start, start + chunk_size), account_id=account_id
+        )
+        inserted += counts["inserted"]
+    return inserted
@@ -0,0 +1,118 @@
+import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import select, delete, func, case, cast, Date, Float, insert
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+import models
+
+def trade_day(exit_at: Optional[datetime.datetime], entry_at: Optional[datetime.datetime]) -> Optional[datetime.date]:
+    # День сделки в календаре: дата выхода, а если ее нет — дата входа
+    at = exit_at or entry_at
+    return at.date() if at is not None else None
+
+def _day_rows(account_id: int, items: Iterable[Tuple[Optional[datetime.date], object]], sign: int) -> List[Dict]:
+    """
+    Сворачивает (день, pnl) в приращения по дням. Сделки без PnL (открытые) пропускаются.
+    sign = -1 — вычесть сделки (удаление или повторное закрытие).
+    """
+    buckets: Dict[datetime.date, list] = {}
+    for day, pnl in items:
+        if day is None or pnl is None:
+            continue
+        bucket = buckets.get(day)
+        if bucket is None:
+            bucket = buckets[day] = [0.0, 0, 0]
+        pnl = float(pnl)
+        bucket[0] += sign * pnl
+        bucket[1] += sign
+        if pnl > 0:
+            bucket[2] += sign
+    return [
+        {"account_id": account_id, "day": day, "pnl": pnl, "trades": trades, "wins": wins}
+        for day, (pnl, trades, wins) in buckets.items()
+    ]
+
+def apply_trades(db: Session, account_id: int, items: Iterable[Tuple[Optional[datetime.date], object]],
+                 sign: int = 1) -> None:
+    """
+    Добавляет (sign=1) или вычитает (sign=-1) сделки из daily_pnl в текущей транзакции.
+    items — пары (день, pnl), см. trade_day. Один upsert на пачку дней.
+    """
+    rows = _day_rows(account_id, items, sign)
+    if not rows:
+        return
+    table = models.DailyPnl.__table__
+    insert_ = pg_insert if db.get_bind().dialect.name == "postgresql" else sqlite_insert
+    stmt = insert_(table)
+    conn = db.connection()
+    conn.execute(stmt.on_conflict_do_update(
+        index_elements=[table.c.account_id, table.c.day],
+        set_={
+            "pnl": table.c.pnl + stmt.excluded.pnl,
+            "trades": table.c.trades + stmt.excluded.trades,
+            "wins": table.c.wins + stmt.excluded.wins,
+        }
+    ), rows)
+    if sign < 0:
+        # Дни, где сделок не осталось, календарю не нужны
+        conn.execute(delete(table).where(
+            table.c.account_id == account_id,
+            table.c.day.in_([row["day"] for row in rows]),
+            table.c.trades <= 0,
+        ))
+
+def apply_trade(db: Session, trade: models.Trade, sign: int = 1) -> None:
+    apply_trades(db, trade.account_id, [(trade_day(trade.exit_at, trade.entry_at), trade.pnl)], sign)
+
+def backfill_daily_pnl(db: Session) -> int:
+    """
+    Миграция: заполняет daily_pnl по закрытым сделкам, если таблица еще пустая
+    (один раз, см. database.run_data_migrations).
+    Один GROUP BY в БД. Возвращает число добавленных дней.
+    """
+    if db.query(models.DailyPnl.account_id).first() is not None:
+        return 0
+    t = models.Trade
+    close_at = func.coalesce(t.exit_at, t.entry_at)
+    # В SQLite Date хранится строкой YYYY-MM-DD — это ровно date()
+    day = func.date(close_at) if db.get_bind().dialect.name == "sqlite" else cast(close_at, Date)
+    grouped = (
+        select(
+            t.account_id, day, func.sum(t.pnl), func.count(t.id),
+            func.sum(case((t.pnl > 0, 1), else_=0)),
+        )
+        .where(t.pnl != None, t.account_id != None)
+        .group_by(t.account_id, day)
+    )
+    table = models.DailyPnl.__table__
+    result = db.execute(insert(table).from_select(
+        ["account_id", "day", "pnl", "trades", "wins"], grouped
+    ))
+    db.commit()
+    return result.rowcount or 0
+
+def get_calendar(db: Session, account_id: int, date_from: datetime.date, date_to: datetime.date) -> Dict:
+    """
+    Дневной PnL счета за [date_from, date_to] (включительно) — проход по первичному
+    ключу (account_id, day), без чтения сделок. Дни без закрытых сделок не возвращаются.
+    """
+    d = models.DailyPnl
+    rows = db.execute(
+        select(d.day, cast(d.pnl, Float), d.trades, d.wins)
+        .where(d.account_id == account_id, d.day >= date_from, d.day <= date_to, d.trades > 0)
+        .order_by(d.day)
+    ).all()
+    days = [
+        {"date": day.isoformat(), "pnl": round(pnl or 0, 2), "trades": trades, "wins": wins}
+        for day, pnl, trades, wins in rows
+    ]
+    return {
+        "date_from": date_from.isoformat(),
+        "date_to": date_to.isoformat(),
+        "total_pnl": round(sum(day["pnl"] for day in days), 2),
+        "trading_days": len(days),
+        "winning_days": sum(1 for day in days if day["pnl"] > 0),
+        "losing_days": sum(1 for day in days if day["pnl"] < 0),
+        "days": days,
+    }
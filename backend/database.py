@@ -1,21 +1,91 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, inspect, select, text
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 import os
 
 # Читаем URL из переменной окружения, иначе используем SQLite
 SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./atom.db")
+# URL для чтения (напр. реплика Postgres), по умолчанию та же база
+SQLALCHEMY_READ_DATABASE_URL = os.getenv("DATABASE_READ_URL", SQLALCHEMY_DATABASE_URL)
+
+# Профиль хранилища: development (как раньше) или production
+DB_PROFILE = os.getenv("DB_PROFILE", "development")
+IS_SQLITE = SQLALCHEMY_DATABASE_URL.startswith("sqlite")
+IS_PRODUCTION = DB_PROFILE == "production"
+
+# PRAGMA для каждого соединения SQLite в production:
+# WAL — читатели не ждут писателя, synchronous=NORMAL безопасен в режиме WAL,
+# mmap и кэш страниц ускоряют чтение, busy_timeout — ждать блокировку, а не падать
+SQLITE_PRODUCTION_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+    "cache_size": -int(os.getenv("SQLITE_CACHE_KB", str(64 * 1024))),
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+    "temp_store": "MEMORY",
+}
+# Размер пула читающего движка
+READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", "8"))
 
 # Настройка аргументов подключения
 connect_args = {}
-if SQLALCHEMY_DATABASE_URL.startswith("sqlite"):
+if IS_SQLITE:
     connect_args = {"check_same_thread": False}
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args=connect_args
-)
+def _apply_sqlite_pragmas(target_engine, pragmas: dict):
+    @event.listens_for(target_engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+if IS_SQLITE and IS_PRODUCTION:
+    # Один писатель: запись в SQLite все равно последовательна, поэтому
+    # запросы на запись ждут в пуле, а не конкурируют за блокировку файла
+    engine = create_engine(
+        SQLALCHEMY_DATABASE_URL, connect_args=connect_args, pool_size=1, max_overflow=0
+    )
+    # Отдельный пул только для чтения (query_only запрещает запись на уровне SQLite)
+    read_engine = create_engine(
+        SQLALCHEMY_READ_DATABASE_URL, connect_args=connect_args,
+        pool_size=READ_POOL_SIZE, max_overflow=0
+    )
+    _apply_sqlite_pragmas(engine, SQLITE_PRODUCTION_PRAGMAS)
+    _apply_sqlite_pragmas(read_engine, {**SQLITE_PRODUCTION_PRAGMAS, "query_only": 1})
+else:
+    engine = create_engine(
+        SQLALCHEMY_DATABASE_URL, connect_args=connect_args
+    )
+    if SQLALCHEMY_READ_DATABASE_URL != SQLALCHEMY_DATABASE_URL:
+        read_engine = create_engine(SQLALCHEMY_READ_DATABASE_URL, connect_args=connect_args)
+    else:
+        read_engine = engine
 
 # Создаем сессию для работы с БД
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Сессии для GET-эндпоинтов
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+
+def _async_database_url(url: str) -> str:
+    # Та же база через асинхронный драйвер: aiosqlite для SQLite, asyncpg для Postgres
+    if url.startswith("sqlite://"):
+        return "sqlite+aiosqlite://" + url[len("sqlite://"):]
+    for prefix in ("postgresql+psycopg2://", "postgresql://", "postgres://"):
+        if url.startswith(prefix):
+            return "postgresql+asyncpg://" + url[len(prefix):]
+    return url
+
+# Асинхронный движок для async-эндпоинтов: запросы не блокируют event loop
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", _async_database_url(SQLALCHEMY_DATABASE_URL))
+async_engine = create_async_engine(ASYNC_DATABASE_URL)
+if IS_SQLITE and IS_PRODUCTION:
+    # Пул не ограничиваем: импорт держит соединение весь запрос, а AI-воркерам
+    # тоже нужна запись; очередность обеспечивает busy_timeout
+    _apply_sqlite_pragmas(async_engine.sync_engine, SQLITE_PRODUCTION_PRAGMAS)
+
+# expire_on_commit=False: после commit объекты читаются без повторного (ленивого) запроса
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
 
 # Базовый класс для моделей (импортируем из models.py)
 import models
@@ -23,6 +93,52 @@ import models
 def init_db():
     # Создаем все таблицы
     models.Base.metadata.create_all(bind=engine)
+    ensure_columns()
+    ensure_indexes()
+    run_data_migrations()
+
+def run_data_migrations():
+    # Заполнение новых производных таблиц по уже существующим данным. Каждая миграция
+    # выполняется один раз и отмечается в data_migrations, а не при каждом старте
+    import trade_service
+    import calendar_service
+    migrations = {
+        "backfill_trade_tags": trade_service.backfill_trade_tags,
+        "backfill_daily_pnl": calendar_service.backfill_daily_pnl,
+    }
+    db = SessionLocal()
+    try:
+        applied = set(db.scalars(select(models.DataMigration.name)))
+        for name, migrate in migrations.items():
+            if name in applied:
+                continue
+            migrate(db)
+            db.add(models.DataMigration(name=name))
+            db.commit()
+    finally:
+        db.close()
+
+def ensure_columns():
+    # create_all не добавляет колонки в существующие таблицы:
+    # новые nullable-колонки моделей дописываем через ALTER TABLE
+    with engine.begin() as conn:
+        # Инспектор на том же соединении: у писателя в production одно соединение
+        inspector = inspect(conn)
+        for table in models.Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    column_type = column.type.compile(dialect=engine.dialect)
+                    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+
+def ensure_indexes():
+    # create_all не трогает уже существующие таблицы, поэтому новые индексы
+    # для старых баз создаем отдельно (IF NOT EXISTS через checkfirst)
+    for table in models.Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
 
 # Зависимость для получения сессии БД в эндпоинтах FastAPI
 def get_db():
@@ -31,3 +147,16 @@ def get_db():
         yield db
     finally:
         db.close()
+
+# Сессия только для чтения (GET-эндпоинты)
+def get_read_db():
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+# То же для async-эндпоинтов
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
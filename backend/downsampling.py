@@ -0,0 +1,80 @@
+import numpy as np
+
+# Методы прореживания кривой эквити
+LTTB = "lttb"      # Largest-Triangle-Three-Buckets: сохраняет визуальную форму
+MINMAX = "minmax"  # Минимум и максимум каждой корзины: экстремумы (просадки) не теряются
+METHODS = (LTTB, MINMAX)
+
+def _bucket_edges(n: int, n_buckets: int) -> np.ndarray:
+    # Границы n_buckets примерно равных корзин по индексу точек [0, n)
+    return np.linspace(0, n, n_buckets + 1).astype(np.int64)
+
+def minmax_indices(y: np.ndarray, max_points: int) -> np.ndarray:
+    """
+    Индексы точек после прореживания min/max: первая и последняя точка плюс
+    минимум и максимум каждой из (max_points - 2) / 2 корзин, в исходном порядке.
+    """
+    n = len(y)
+    if n <= max_points or max_points < 4:
+        return np.arange(n) if n <= max_points else np.unique([0, int(np.argmin(y)), int(np.argmax(y)), n - 1])
+
+    n_buckets = (max_points - 2) // 2
+    edges = _bucket_edges(n - 2, n_buckets)
+    counts = np.diff(edges)
+    inner = y[1:n - 1]
+    # Экстремумы корзин через reduceat, затем первая позиция экстремума в каждой корзине
+    mins = np.repeat(np.minimum.reduceat(inner, edges[:-1]), counts)
+    maxs = np.repeat(np.maximum.reduceat(inner, edges[:-1]), counts)
+    min_at = _first_in_buckets(np.flatnonzero(inner == mins), edges)
+    max_at = _first_in_buckets(np.flatnonzero(inner == maxs), edges)
+    return np.unique(np.concatenate(([0], min_at + 1, max_at + 1, [n - 1])))
+
+def _first_in_buckets(positions: np.ndarray, edges: np.ndarray) -> np.ndarray:
+    # positions отсортированы и в каждой корзине есть хотя бы одна
+    return positions[np.searchsorted(positions, edges[:-1])]
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, max_points: int) -> np.ndarray:
+    """
+    Индексы точек по алгоритму Largest-Triangle-Three-Buckets (Steinarsson, 2013).
+    Из каждой корзины берется точка, образующая наибольший треугольник с уже выбранной
+    точкой предыдущей корзины и средней точкой следующей. Площади внутри корзины
+    считаются векторно, цикл — только по корзинам.
+    """
+    n = len(y)
+    if n <= max_points or max_points < 3:
+        return np.arange(n) if n <= max_points else np.array([0, n - 1])
+
+    x = x.astype(np.float64)
+    y = y.astype(np.float64)
+    n_buckets = max_points - 2
+    edges = _bucket_edges(n - 2, n_buckets) + 1
+
+    # Средние точки корзин (для последней корзины "следующая" — последняя точка)
+    sums_x = np.add.reduceat(x[1:n - 1], edges[:-1] - 1)
+    sums_y = np.add.reduceat(y[1:n - 1], edges[:-1] - 1)
+    counts = np.diff(edges)
+    avg_x = np.append(sums_x / counts, x[n - 1])
+    avg_y = np.append(sums_y / counts, y[n - 1])
+
+    selected = np.empty(max_points, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    for i in range(n_buckets):
+        start, stop = edges[i], edges[i + 1]
+        next_x, next_y = avg_x[i + 1], avg_y[i + 1]
+        # Удвоенная площадь треугольника (a, точка корзины, среднее следующей корзины)
+        area = np.abs(
+            (x[a] - next_x) * (y[start:stop] - y[a])
+            - (x[a] - x[start:stop]) * (next_y - y[a])
+        )
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+def downsample_indices(x: np.ndarray, y: np.ndarray, max_points: int, method: str = LTTB) -> np.ndarray:
+    if method not in METHODS:
+        raise ValueError(f"Unknown downsampling method: {method}")
+    if method == MINMAX:
+        return minmax_indices(y, max_points)
+    return lttb_indices(x, y, max_points)
@@ -0,0 +1,195 @@
+import csv
+import io
+from typing import Iterator, List
+from sqlalchemy import select
+import database
+import models
+import metrics
+
+# pyarrow нужен только для колоночных форматов (Parquet / Arrow IPC)
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+# Сколько строк забирать из курсора за раз и размер отдаваемого куска CSV
+EXPORT_BATCH_SIZE = 1000
+CSV_CHUNK_SIZE = 64 * 1024
+# В Parquet каждая пачка становится row group, поэтому пачки крупнее
+COLUMNAR_BATCH_SIZE = 64 * 1024
+
+# Формат -> (MIME-тип, расширение файла)
+EXPORT_FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+}
+
+CSV_HEADER = [
+    "ID", "Symbol", "Direction", "Entry Price", "Exit Price",
+    "Quantity", "PnL", "Entry At", "Exit At", "Tags", "Notes"
+]
+
+def _export_columns():
+    t = models.Trade
+    return [
+        t.id, t.symbol, t.direction, t.entry_price, t.exit_price,
+        t.quantity, t.pnl, t.entry_at, t.exit_at, t.tags, t.notes
+    ]
+
+def iter_trade_batches(batch_size: int = EXPORT_BATCH_SIZE, columns=None) -> Iterator[List]:
+    """
+    Отдает сделки пачками по batch_size строк, читая их потоково (yield_per).
+    На Postgres это серверный курсор, так что в памяти только одна пачка.
+    Сессия своя: генератор живет дольше, чем обработчик запроса.
+    """
+    db = database.ReadSessionLocal()
+    try:
+        stmt = select(*(columns or _export_columns())).order_by(models.Trade.id).execution_options(yield_per=batch_size)
+        for partition in db.execute(stmt).partitions():
+            metrics.add_rows(len(partition))
+            yield partition
+    finally:
+        db.close()
+
+def _drain(output: io.StringIO, chunk_size: int) -> Iterator[str]:
+    """
+    Отдает из буфера полные куски по chunk_size символов, остаток оставляет в буфере.
+    """
+    data = output.getvalue()
+    full = len(data) - len(data) % chunk_size
+    for start in range(0, full, chunk_size):
+        yield data[start:start + chunk_size]
+    output.seek(0)
+    output.truncate()
+    output.write(data[full:])
+
+def iter_csv_chunks(batch_size: int = EXPORT_BATCH_SIZE, chunk_size: int = CSV_CHUNK_SIZE) -> Iterator[str]:
+    """
+    Генерирует CSV кусками по chunk_size символов (последний кусок короче).
+    Заголовок отдается сразу, поэтому время до первого байта не зависит от размера журнала.
+    """
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(CSV_HEADER)
+    yield output.getvalue()
+    output.seek(0)
+    output.truncate()
+
+    for rows in iter_trade_batches(batch_size):
+        writer.writerows(
+            (
+                trade_id, symbol, direction.value, entry_price, exit_price,
+                quantity, pnl, entry_at, exit_at,
+                ", ".join(tags) if tags else "", notes
+            )
+            for trade_id, symbol, direction, entry_price, exit_price,
+                quantity, pnl, entry_at, exit_at, tags, notes in rows
+        )
+        if output.tell() >= chunk_size:
+            yield from _drain(output, chunk_size)
+
+    if output.tell():
+        yield output.getvalue()
+
+def _columnar_fields():
+    """
+    Колонки для Parquet/Arrow: (колонка модели, тип Arrow).
+    Numeric(18, 8) -> decimal128(18, 8), теги -> list<string>.
+    """
+    t = models.Trade
+    money = pa.decimal128(18, 8)
+    return [
+        (t.id, pa.int64()),
+        (t.account_id, pa.int64()),
+        (t.symbol, pa.string()),
+        (t.asset_type, pa.string()),
+        (t.direction, pa.string()),
+        (t.entry_price, money),
+        (t.exit_price, money),
+        (t.quantity, money),
+        (t.leverage, pa.float64()),
+        (t.entry_at, pa.timestamp("us")),
+        (t.exit_at, pa.timestamp("us")),
+        (t.stop_loss, money),
+        (t.take_profit, money),
+        (t.risk_amount, money),
+        (t.mae_price, money),
+        (t.mfe_price, money),
+        (t.pnl, money),
+        (t.commission, money),
+        (t.setup_name, pa.string()),
+        (t.timeframe, pa.string()),
+        (t.exit_reason, pa.string()),
+        (t.tags, pa.list_(pa.string())),
+        (t.notes, pa.string()),
+    ]
+
+class _ChunkSink:
+    """
+    Файлоподобный приемник для писателей pyarrow: накапливает байты до выдачи.
+    tell() считает все записанные байты — Parquet пишет абсолютные смещения в футер.
+    """
+
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self.parts.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self.parts)
+        self.parts = []
+        return data
+
+def iter_columnar_chunks(export_format: str, batch_size: int = COLUMNAR_BATCH_SIZE) -> Iterator[bytes]:
+    """
+    Потоковый экспорт в Parquet или Arrow IPC (stream): каждая пачка строк из курсора
+    становится RecordBatch и сразу отдается клиенту.
+    """
+    if pa is None:
+        raise RuntimeError("pyarrow is required for columnar export")
+
+    fields = _columnar_fields()
+    schema = pa.schema([(column.key, arrow_type) for column, arrow_type in fields])
+    direction_idx = [column.key for column, _ in fields].index("direction")
+
+    sink = _ChunkSink()
+    if export_format == "parquet":
+        writer = pq.ParquetWriter(sink, schema)
+    else:
+        writer = pa.ipc.new_stream(sink, schema)
+
+    for rows in iter_trade_batches(batch_size, [column for column, _ in fields]):
+        values = [list(column) for column in zip(*rows)]
+        values[direction_idx] = [d.value for d in values[direction_idx]]
+        batch = pa.record_batch(
+            [pa.array(column, type=arrow_type) for column, (_, arrow_type) in zip(values, fields)],
+            schema=schema
+        )
+        writer.write_batch(batch)
+        yield sink.drain()
+
+    writer.close()
+    yield sink.drain()
+
+def iter_export_chunks(export_format: str):
+    if export_format == "csv":
+        return iter_csv_chunks()
+    return iter_columnar_chunks(export_format)
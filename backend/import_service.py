@@ -1,301 +1,462 @@
 import pandas as pd
+import numpy as np
 import io
+import os
 from datetime import datetime
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Iterable, Iterator
+from sqlalchemy import insert, select, func
+from sqlalchemy.orm import Session
 import models
+import stats_service
+import position_engine
+import trade_service
+import calendar_service
 import re
 
-class Inventory:
-    def __init__(self):
-        self.positions = {} # {symbol: {'qty': float, 'avg_price': float}}
+# Размер пачки при массовой записи импортированных сделок
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "5000"))
+
+# Обязательные поля сделки (NOT NULL в таблице trades)
+_REQUIRED_FIELDS = ("symbol", "direction", "entry_price", "quantity", "entry_at")
+
+class Inventory(position_engine.PositionEngine):
+    """
+    Прежний интерфейс учета позиции (средняя цена) поверх PositionEngine.
+    """
+
+    def __init__(self, method: str = position_engine.AVERAGE):
+        super().__init__(method)
 
     def process_trade(self, symbol: str, direction: models.TradeDirection, qty: float, price: float) -> Optional[float]:
-        if symbol not in self.positions:
-            self.positions[symbol] = {'qty': 0.0, 'avg_price': 0.0}
-        
-        pos = self.positions[symbol]
-        current_qty = pos['qty']
-        pnl = None
-
-        if direction == models.TradeDirection.LONG:
-            # BUY
-            if current_qty < 0:
-                # Covering a Short position
-                covered_qty = min(abs(current_qty), qty)
-                
-                # Short PnL = (Sell Price - Buy Price) * Qty
-                # Entry (Sell) was avg_price. Exit (Buy) is price.
-                pnl = (pos['avg_price'] - price) * covered_qty
-                
-                # Update position
-                remaining_buy = qty - covered_qty
-                pos['qty'] += covered_qty # Move towards 0 (e.g. -10 + 10 = 0)
-                
-                if remaining_buy > 0:
-                    # Flipped to Long
-                    pos['qty'] = remaining_buy
-                    pos['avg_price'] = price
-            else:
-                # Adding to Long position
-                total_cost = current_qty * pos['avg_price'] + qty * price
-                new_qty = current_qty + qty
-                pos['avg_price'] = total_cost / new_qty if new_qty != 0 else 0
-                pos['qty'] = new_qty
-
-        elif direction == models.TradeDirection.SHORT:
-            # SELL
-            if current_qty > 0:
-                # Closing a Long position
-                closed_qty = min(current_qty, qty)
-                
-                # Long PnL = (Sell Price - Buy Price) * Qty
-                pnl = (price - pos['avg_price']) * closed_qty
-                
-                # Update position
-                remaining_sell = qty - closed_qty
-                pos['qty'] -= closed_qty
-                
-                if remaining_sell > 0:
-                    # Flipped to Short
-                    pos['qty'] = -remaining_sell
-                    pos['avg_price'] = price
-            else:
-                # Adding to Short position (qty is negative or 0)
-                current_abs_qty = abs(current_qty)
-                total_val = current_abs_qty * pos['avg_price'] + qty * price
-                new_abs_qty = current_abs_qty + qty
-                pos['avg_price'] = total_val / new_abs_qty if new_abs_qty != 0 else 0
-                pos['qty'] -= qty # Make it more negative
-
-        return pnl
-
-def parse_tinkoff_excel(contents: bytes) -> List[Dict]:
-    # Read Excel, finding the header row
-    df = pd.read_excel(io.BytesIO(contents), header=None)
-    
-    start_row = -1
-    for i, row in df.iterrows():
-        row_str = row.astype(str).str.cat(sep=' ')
-        if "Номер сделки" in row_str and "Вид сделки" in row_str:
-            start_row = i
-            break
-            
-    if start_row == -1:
+        return self.process_fill(symbol, direction, qty, price)
+
+# Признак фьючерса в коде актива (напр. RIZ5, BRF5)
+_FUTURES_PATTERN = r'[A-Z]{2,4}[A-Z0-9]\d'
+
+def _find_header_row(raw: pd.DataFrame) -> int:
+    """
+    Номер строки-заголовка таблицы сделок (содержит "Номер сделки" и "Вид сделки").
+    Поиск по колонкам, а не по строкам: колонок в отчете единицы.
+    """
+    has_number = pd.Series(False, index=raw.index)
+    has_side = pd.Series(False, index=raw.index)
+    for col in raw.columns:
+        text = raw[col].astype(str)
+        has_number |= text.str.contains("Номер сделки", regex=False)
+        has_side |= text.str.contains("Вид сделки", regex=False)
+    matches = np.flatnonzero((has_number & has_side).to_numpy())
+    if len(matches) == 0:
         raise ValueError("Could not find trade table in Excel file")
-        
-    # Reload with correct header
-    df = pd.read_excel(io.BytesIO(contents), header=start_row)
-    
-    trades = []
-    inventory = Inventory()
-    
-    # Iterate through rows
-    for _, row in df.iterrows():
-        try:
-            # Extract fields using column names (which might contain newlines)
-            cols = {c.replace('\n', ' ').strip(): c for c in df.columns}
-            
-            date_val = row[cols.get('Дата заключения', 'Дата заключения')]
-            time_val = row[cols.get('Время', 'Время')]
-            side_val = row[cols.get('Вид сделки', 'Вид сделки')]
-            symbol_val = row[cols.get('Код актива', 'Код актива')]
-            qty_val = row[cols.get('Количество', 'Количество')]
-            deal_sum_val = row[cols.get('Сумма сделки', 'Сумма сделки')]
-            
-            # Try to get Asset Name
-            asset_name = row.get(cols.get('Сокращенное наименование', 'Сокращенное наименование'), None)
-            if pd.isna(asset_name):
-                 asset_name = row.get(cols.get('Наименование', 'Наименование'), None)
-            
-            if pd.isna(date_val) or pd.isna(symbol_val):
-                continue
-                
-            # Parse Date/Time
-            if isinstance(date_val, str):
-                date_str = date_val
-            else:
-                date_str = date_val.strftime("%d.%m.%Y")
-                
-            if isinstance(time_val, str):
-                time_str = time_val
-            else:
-                time_str = time_val.strftime("%H:%M:%S")
-                
-            entry_at = datetime.strptime(f"{date_str} {time_str}", "%d.%m.%Y %H:%M:%S")
-            
-            # Parse Side
-            side_str = str(side_val).lower()
-            
-            # Filter REPO/Swap
-            if 'репо' in side_str or 'рпс' in side_str:
-                continue
-                
-            if 'покупка' in side_str:
-                direction = models.TradeDirection.LONG
-            elif 'продажа' in side_str:
-                direction = models.TradeDirection.SHORT
-            else:
-                continue
-                
-            symbol = str(symbol_val).strip()
-            quantity = float(qty_val)
-            
-            # Infer Asset Type
-            asset_type = "Stock" # Default
-            if re.search(r'[A-Z]{2,4}[A-Z0-9]\d', symbol): # e.g. RIZ5, SiH5
-                asset_type = "Futures"
-            
-            # Calculate Effective Price in RUB (Deal Sum / Quantity)
-            # This handles Futures (points -> rub) and Bonds (clean price -> dirty price) correctly
-            if pd.notna(deal_sum_val):
-                deal_sum = float(deal_sum_val)
-                if quantity != 0:
-                    price = deal_sum / quantity
-                else:
-                    price = 0.0
-            else:
-                # Fallback to 'Цена за единицу' if Deal Sum is missing (unlikely for valid trades)
-                price = float(row[cols.get('Цена за единицу', 'Цена за единицу')])
-
-            # Calculate Total Commission
-            comm_broker = row.get(cols.get('Комиссия брокера', 'Комиссия брокера'), 0)
-            comm_exchange = row.get(cols.get('Комиссия биржи', 'Комиссия биржи'), 0)
-            comm_clear = row.get(cols.get('Комиссия клир. центра', 'Комиссия клир. центра'), 0)
-            
-            def parse_comm(val):
-                try: return abs(float(val)) if pd.notna(val) else 0.0
-                except: return 0.0
-                
-            commission = parse_comm(comm_broker) + parse_comm(comm_exchange) + parse_comm(comm_clear)
-            
-            # PnL Logic
-            pnl = inventory.process_trade(symbol, direction, quantity, price)
-                
-            trades.append({
-                "symbol": symbol,
-                "asset_name": str(asset_name) if asset_name else None,
-                "asset_type": asset_type,
-                "direction": direction,
-                "entry_price": price,
-                "quantity": quantity,
-                "entry_at": entry_at,
-                "pnl": pnl,
-                "commission": commission,
-                "notes": "Imported from Tinkoff Excel",
-                "tags": ["Tinkoff", "Imported"]
-            })
-            
-        except Exception as e:
-            # Skip bad rows
-            print(f"Error parsing row {row.name}: {e}")
-            continue
-            
-    return trades
+    return int(matches[0])
 
-def parse_trade_file(contents: bytes, filename: str) -> List[Dict]:
+def _combine_date_time(dates: pd.Series, times: pd.Series) -> pd.Series:
     """
-    Парсит файл (CSV/Excel) и возвращает список словарей для создания сделок.
+    Склеивает "Дата заключения" и "Время" в datetime.
+    Ячейки бывают строками (03.12.2025 / 09:19:29) или уже датой/временем из Excel.
+    """
+    date_text = dates.astype(str)
+    ru = date_text.str.extract(r'^\s*(\d{2})\.(\d{2})\.(\d{4})')
+    iso = date_text.str.extract(r'^\s*(\d{4})-(\d{2})-(\d{2})')
+    day = ru[0].fillna(iso[2])
+    month = ru[1].fillna(iso[1])
+    year = ru[2].fillna(iso[0])
+    time_text = times.astype(str).str.extract(r'(\d{1,2}:\d{2}:\d{2})')[0]
+    return pd.to_datetime(
+        year + "-" + month + "-" + day + " " + time_text,
+        format="%Y-%m-%d %H:%M:%S", errors="coerce"
+    )
+
+def parse_tinkoff_excel(contents: bytes, cost_method: str = position_engine.AVERAGE) -> List[Dict]:
+    # Один проход чтения: без заголовка, затем ищем строку-заголовок таблицы
+    raw = pd.read_excel(io.BytesIO(contents), header=None)
+    start_row = _find_header_row(raw)
+
+    # Названия колонок могут содержать переносы строк
+    names = [str(c).replace('\n', ' ').strip() for c in raw.iloc[start_row]]
+    body = raw.iloc[start_row + 1:]
+    # При повторяющихся названиях берем первую колонку
+    columns = {}
+    for position, name in enumerate(names):
+        columns.setdefault(name, body.iloc[:, position])
+
+    def column(name):
+        return columns.get(name, pd.Series(np.nan, index=body.index))
+
+    required = ['Дата заключения', 'Время', 'Вид сделки', 'Код актива', 'Количество', 'Сумма сделки']
+    missing = [name for name in required if name not in columns]
+    if missing:
+        raise ValueError(f"Tinkoff report is missing columns: {missing}")
+
+    # Классификация сделок: РЕПО/своп отбрасываем, остальное по виду сделки
+    side = column('Вид сделки').astype(str).str.lower()
+    is_repo = side.str.contains('репо', regex=False) | side.str.contains('рпс', regex=False)
+    is_buy = side.str.contains('покупка', regex=False)
+    is_sell = side.str.contains('продажа', regex=False)
+
+    entry_at = _combine_date_time(column('Дата заключения'), column('Время'))
+    quantity = pd.to_numeric(column('Количество'), errors='coerce')
+
+    # Эффективная цена в рублях (Сумма сделки / Количество): корректна для фьючерсов
+    # (пункты -> рубли) и облигаций (чистая -> грязная цена). Если суммы нет — цена за единицу
+    deal_sum = pd.to_numeric(column('Сумма сделки'), errors='coerce')
+    unit_price = pd.to_numeric(column('Цена за единицу'), errors='coerce')
+    price = np.where(
+        deal_sum.notna(),
+        np.where(quantity != 0, deal_sum / quantity.where(quantity != 0, 1), 0.0),
+        unit_price
+    )
+
+    # Общая комиссия: брокер + биржа + клиринг (нечисловые значения считаем нулем)
+    commission = sum(
+        pd.to_numeric(column(name), errors='coerce').abs().fillna(0.0)
+        for name in ('Комиссия брокера', 'Комиссия биржи', 'Комиссия клир. центра')
+    )
+
+    asset_name = column('Сокращенное наименование')
+    asset_name = asset_name.where(asset_name.notna(), column('Наименование'))
+
+    symbol = column('Код актива')
+    valid = (
+        column('Дата заключения').notna() & symbol.notna()
+        & ~is_repo & (is_buy | is_sell)
+        & entry_at.notna() & quantity.notna() & pd.notna(price)
+    ).to_numpy()
+
+    symbols = symbol.astype(str).str.strip()[valid]
+    directions = np.where(is_buy, models.TradeDirection.LONG, models.TradeDirection.SHORT)[valid]
+    asset_types = np.where(symbols.str.contains(_FUTURES_PATTERN, regex=True), "Futures", "Stock")
+    quantities = quantity.to_numpy(dtype=float)[valid]
+    prices = price[valid].astype(float)
+    commissions = commission.to_numpy(dtype=float)[valid]
+    names_valid = asset_name[valid]
+    asset_names = [str(n) for n in names_valid] if names_valid.notna().all() else [
+        str(n) if pd.notna(n) else None for n in names_valid
+    ]
+    entry_times = entry_at[valid].dt.to_pydatetime()
+    symbols = symbols.tolist()
+
+    # PnL — единственный последовательный шаг: зависит от текущей позиции по инструменту.
+    # Инструменты независимы, поэтому большие отчеты движок делит по символам между процессами
+    fills = list(zip(symbols, directions, quantities.tolist(), prices.tolist(), entry_times, range(len(symbols))))
+    pnls, _ = position_engine.match_fills(fills, cost_method, collect_round_trips=False)
+
+    return [
+        {
+            "symbol": sym,
+            "asset_name": name,
+            "asset_type": asset_type,
+            "direction": direction,
+            "entry_price": px,
+            "quantity": qty,
+            "entry_at": ts,
+            "pnl": pnl,
+            "commission": comm,
+            "notes": "Imported from Tinkoff Excel",
+            "tags": ["Tinkoff", "Imported"]
+        }
+        for sym, name, asset_type, direction, px, qty, ts, pnl, comm in zip(
+            symbols, asset_names, asset_types.tolist(), directions, prices.tolist(),
+            quantities.tolist(), entry_times, pnls, commissions.tolist()
+        )
+    ]
+
+# Маппинг колонок универсального парсера (можно расширять)
+GENERIC_COL_MAP = {
+    'date': ['date', 'time', 'created time', 'date(utc)'],
+    'symbol': ['symbol', 'pair', 'instrument', 'contract'],
+    'side': ['side', 'type', 'direction', 'operation'],
+    'price': ['price', 'avg price', 'entry price', 'avg_price_usd'],
+    'quantity': ['amount', 'quantity', 'executed', 'size', 'qty'],
+    'pnl': ['pnl', 'realized pnl', 'profit', 'net profit'],
+    'fee': ['fee', 'commission']
+}
+
+# Сколько строк CSV разбирать за раз и сколько ошибок сохранять в отчете
+CSV_CHUNK_SIZE = 50_000
+MAX_REPORTED_ERRORS = 1000
+
+def new_error_report() -> Dict:
+    return {"count": 0, "rows": []}
+
+def _detect_generic_columns(columns: List[str]) -> Dict[str, Optional[str]]:
+    """
+    Находит колонки универсального формата по GENERIC_COL_MAP.
+    """
+    lower_cols = {c.lower(): c for c in columns}
+
+    def get_col(key):
+        for candidate in GENERIC_COL_MAP[key]:
+            if candidate in lower_cols:
+                return lower_cols[candidate]
+        return None
+
+    detected = {key: get_col(key) for key in GENERIC_COL_MAP}
+    required = ['date', 'symbol', 'side', 'price', 'quantity']
+    if not all(detected[key] for key in required):
+        raise ValueError(f"Could not detect required columns. Found: {list(columns)}")
+    return detected
+
+def _report_errors(errors: Dict, messages: pd.Series) -> None:
     """
+    Добавляет ошибочные строки в отчет: {"count": N, "rows": [{"line": ..., "error": ...}]}.
+    messages — текст ошибки по номеру строки файла.
+    Хранится не больше MAX_REPORTED_ERRORS строк, счетчик — полный.
+    """
+    errors["count"] += len(messages)
+    room = MAX_REPORTED_ERRORS - len(errors["rows"])
+    if room > 0:
+        errors["rows"].extend(
+            {"line": int(line), "error": message} for line, message in messages.iloc[:room].items()
+        )
+
+def report_error(errors: Dict, line: Optional[int], message: str) -> None:
+    # Одна ошибка в отчете (line = None — ошибка не относится к строке файла)
+    errors["count"] += 1
+    if len(errors["rows"]) < MAX_REPORTED_ERRORS:
+        errors["rows"].append({"line": line, "error": message})
+
+def _report_write_error(errors: Dict, trade: Dict, error: Exception) -> None:
+    # Строка, которую не удалось записать в БД, попадает в тот же отчет, что и ошибки разбора.
+    # У ошибок SQLAlchemy orig — исходная ошибка драйвера, без текста SQL и параметров
+    report_error(
+        errors, trade.get("line"),
+        f"failed to save trade {trade.get('symbol')} at {trade.get('entry_at')}: "
+        f"{getattr(error, 'orig', None) or error}"
+    )
+
+def _parse_generic_frame(df: pd.DataFrame, cols: Dict[str, Optional[str]], filename: str,
+                         errors: Dict) -> List[Dict]:
+    """
+    Колоночное преобразование кусочка универсального отчета в словари сделок.
+    """
+    # Парсинг даты: сначала быстрый путь ISO 8601, затем смешанные форматы.
+    # utc=True: колонка может смешивать даты без зоны и с зоной (иначе pandas падает
+    # с "Mixed timezones detected"); даты с зоной приводятся к UTC, и зона отбрасывается,
+    # как у остальных (naive) дат в БД
+    raw_date = df[cols['date']]
+    entry_at = pd.to_datetime(raw_date, errors='coerce', format='ISO8601', utc=True).dt.tz_localize(None)
+    retry = entry_at.isna() & raw_date.notna()
+    if retry.any():
+        entry_at[retry] = pd.to_datetime(
+            raw_date[retry].astype(str), errors='coerce', format='mixed', utc=True
+        ).dt.tz_localize(None)
+
+    # Парсинг направления (неизвестные типы, напр. Transfer, пропускаем без ошибки)
+    side = df[cols['side']].astype(str).str.lower()
+    is_buy = side.str.contains('buy', regex=False) | side.str.contains('long', regex=False)
+    is_sell = side.str.contains('sell', regex=False) | side.str.contains('short', regex=False)
+    known_side = is_buy | is_sell
+
+    # Числовые поля
+    price = pd.to_numeric(df[cols['price']], errors='coerce').astype(float)
+    quantity = pd.to_numeric(df[cols['quantity']], errors='coerce').astype(float)
+    if cols['pnl']:
+        raw_pnl = df[cols['pnl']]
+        pnl = pd.to_numeric(raw_pnl, errors='coerce').astype(float)
+        bad_pnl = pnl.isna() & raw_pnl.notna()
+    else:
+        pnl = pd.Series(np.nan, index=df.index)
+        bad_pnl = pd.Series(False, index=df.index)
+    symbol = df[cols['symbol']]
+
+    checks = [
+        (entry_at.isna(), "invalid date"),
+        (symbol.isna(), "missing symbol"),
+        (price.isna(), "invalid price"),
+        (quantity.isna(), "invalid quantity"),
+        (bad_pnl, "invalid pnl"),
+    ]
+    valid = known_side.copy()
+    messages = pd.Series(None, index=df.index, dtype=object)
+    for failed, message in checks:
+        failed = failed & valid
+        messages[failed] = message
+        valid &= ~failed
+    messages = messages.dropna()
+    if len(messages):
+        # Номер строки в файле (1 — заголовок)
+        messages.index = messages.index + 2
+        _report_errors(errors, messages)
+
+    directions = np.where(is_buy, models.TradeDirection.LONG, models.TradeDirection.SHORT)[valid.to_numpy()]
+    pnls = pnl[valid].astype(object).where(pnl[valid].notna(), None)
+    notes = f"Imported from {filename}"
+
+    return [
+        {
+            "symbol": sym,
+            "direction": direction,
+            "entry_price": px,
+            "quantity": qty,
+            "entry_at": ts,
+            "pnl": trade_pnl,
+            "notes": notes,
+            "tags": ["Imported"],
+            "line": line
+        }
+        for sym, direction, px, qty, ts, trade_pnl, line in zip(
+            symbol[valid].astype(str).str.upper().tolist(),
+            directions,
+            price[valid].tolist(),
+            quantity[valid].tolist(),
+            entry_at[valid].dt.to_pydatetime(),
+            pnls.tolist(),
+            # Номер строки в файле для отчета об ошибках записи
+            (df.index[valid.to_numpy()] + 2).tolist()
+        )
+    ]
+
+def _normalize_columns(df: pd.DataFrame) -> pd.DataFrame:
+    # Нормализация имен колонок для Generic парсера
+    df.columns = [c.strip() for c in df.columns]
+    return df
+
+def iter_trade_file_chunks(stream, filename: str, errors: Dict,
+                           chunksize: int = CSV_CHUNK_SIZE,
+                           cost_method: str = position_engine.AVERAGE) -> Iterator[List[Dict]]:
+    """
+    Разбирает файл сделок и отдает сделки кусками (списками словарей).
+    CSV читается потоково по chunksize строк, поэтому пиковая память не растет
+    с размером файла. Excel читается целиком и отдается одним куском.
+    Ошибочные строки попадают в errors (см. new_error_report), а не в stdout.
+    Формат и колонки проверяются сразу при вызове (ValueError), до первой записи в БД.
+    cost_method — учет позиции для PnL брокерских отчетов: average или fifo.
+    """
+    if cost_method not in position_engine.METHODS:
+        raise ValueError(f"Unknown cost method: {cost_method}")
     if filename.endswith(('.xls', '.xlsx')):
+        contents = stream.read()
         # Try Tinkoff Excel parser first if it looks like a report
         try:
-            return parse_tinkoff_excel(contents)
-        except:
-            # Fallback to generic excel parser (implemented below via pandas)
+            return iter([parse_tinkoff_excel(contents, cost_method)])
+        except Exception:
+            # Fallback to generic excel parser
             pass
+        try:
+            df = _normalize_columns(pd.read_excel(io.BytesIO(contents)))
+        except Exception as e:
+            raise ValueError(f"Failed to read file: {str(e)}")
+        cols = _detect_generic_columns(df.columns)
+        return iter([_parse_generic_frame(df, cols, filename, errors)])
+
+    if not filename.endswith('.csv'):
+        raise ValueError("Failed to read file: Unsupported file format")
 
     try:
-        if filename.endswith('.csv'):
-            df = pd.read_csv(io.BytesIO(contents))
-        elif filename.endswith(('.xls', '.xlsx')):
-            df = pd.read_excel(io.BytesIO(contents))
-        else:
-            raise ValueError("Unsupported file format")
+        reader = pd.read_csv(stream, chunksize=chunksize)
+        first = _normalize_columns(next(reader))
+    except StopIteration:
+        return iter([])
     except Exception as e:
         raise ValueError(f"Failed to read file: {str(e)}")
+    cols = _detect_generic_columns(first.columns)
 
-    trades = []
-    
-    # Нормализация имен колонок для Generic парсера
-    df.columns = [c.strip() for c in df.columns]
-    lower_cols = {c.lower(): c for c in df.columns}
+    def chunks():
+        yield _parse_generic_frame(first, cols, filename, errors)
+        for df in reader:
+            yield _parse_generic_frame(_normalize_columns(df), cols, filename, errors)
 
+    return chunks()
 
-    # Маппинг колонок (можно расширять)
-    col_map = {
-        'date': ['date', 'time', 'created time', 'date(utc)'],
-        'symbol': ['symbol', 'pair', 'instrument', 'contract'],
-        'side': ['side', 'type', 'direction', 'operation'],
-        'price': ['price', 'avg price', 'entry price', 'avg_price_usd'],
-        'quantity': ['amount', 'quantity', 'executed', 'size', 'qty'],
-        'pnl': ['pnl', 'realized pnl', 'profit', 'net profit'],
-        'fee': ['fee', 'commission']
-    }
+def parse_trade_file(contents: bytes, filename: str) -> List[Dict]:
+    """
+    Парсит файл (CSV/Excel) и возвращает список словарей для создания сделок.
+    """
+    errors = new_error_report()
+    chunks = iter_trade_file_chunks(io.BytesIO(contents), filename, errors)
+    return [trade for chunk in chunks for trade in chunk]
 
-    def get_col(key):
-        for candidate in col_map[key]:
-            if candidate in lower_cols:
-                return lower_cols[candidate]
-        return None
+def _trade_row_template() -> Dict:
+    """
+    Шаблон строки для executemany: все колонки trades (кроме id) со значениями по умолчанию.
+    У всех строк пачки должен быть одинаковый набор ключей.
+    """
+    template = {}
+    for column in models.Trade.__table__.columns:
+        if column.primary_key:
+            continue
+        default = column.default
+        template[column.key] = default.arg if default is not None and default.is_scalar else None
+    return template
 
-    # Проверяем обязательные поля
-    required = ['date', 'symbol', 'side', 'price', 'quantity']
-    missing = [key for key in required if get_col(key) is None]
-    
-    if missing:
-        # Если не нашли стандартные, пробуем специфичные для Binance/Bybit
-        # Но пока вернем ошибку или пустой список
-        print(f"Missing columns: {missing}")
-        # Fallback logic could go here
-        pass
-
-    date_col = get_col('date')
-    symbol_col = get_col('symbol')
-    side_col = get_col('side')
-    price_col = get_col('price')
-    qty_col = get_col('quantity')
-    pnl_col = get_col('pnl')
-
-    if not all([date_col, symbol_col, side_col, price_col, qty_col]):
-         raise ValueError(f"Could not detect required columns. Found: {df.columns.tolist()}")
-
-    for _, row in df.iterrows():
+def write_trades(db: Session, trades: Iterable[Dict], account_id: int = 1,
+                 batch_size: int = IMPORT_BATCH_SIZE, errors: Optional[Dict] = None) -> Dict[str, int]:
+    """
+    Массовая запись сделок через Core insert (executemany) с коммитом каждой пачки.
+    Строки без обязательных полей пропускаются (skipped). Если пачка не записалась,
+    она повторяется построчно, и сбойные строки считаются как failed и попадают
+    в отчет errors (см. new_error_report), если он передан.
+    """
+    template = _trade_row_template()
+    counts = {"inserted": 0, "skipped": 0, "failed": 0}
+    batch = []
+    # Исходные словари пачки — для отчета об ошибках (строки пачки содержат только колонки trades)
+    sources = []
+    # Вставка по таблице, а не по модели: ORM bulk insert дробит пачку на группы
+    # по набору NULL-колонок, а Core отдает ее драйверу одним executemany.
+    # id новых сделок нужны для записи trade_tags
+    table = models.Trade.__table__
+    is_sqlite = db.get_bind().dialect.name == "sqlite"
+    returning_stmt = insert(table).returning(table.c.id, sort_by_parameter_order=True)
+
+    def insert_rows(rows):
+        conn = db.connection()
+        if is_sqlite:
+            # RETURNING с порядком строк SQLite выполняет построчно. Пачка пишется после
+            # bump_stats_version, то есть под блокировкой записи: других писателей нет,
+            # и id можно выдать самим, как это сделал бы SQLite (max(id) + 1, ...)
+            last_id = conn.execute(select(func.max(table.c.id))).scalar() or 0
+            trade_ids = range(last_id + 1, last_id + 1 + len(rows))
+            for trade_id, row in zip(trade_ids, rows):
+                row["id"] = trade_id
+            conn.execute(insert(table), rows)
+        else:
+            trade_ids = conn.execute(returning_stmt, rows).scalars().all()
+        trade_service.insert_tag_rows(db, [
+            tag_row
+            for trade_id, row in zip(trade_ids, rows)
+            for tag_row in trade_service.tag_rows(trade_id, row["account_id"], row["tags"])
+        ])
+        calendar_service.apply_trades(db, account_id, [
+            (calendar_service.trade_day(row["exit_at"], row["entry_at"]), row["pnl"]) for row in rows
+        ])
+
+    def flush():
+        if not batch:
+            return
         try:
-            # Парсинг даты
-            raw_date = row[date_col]
-            entry_at = pd.to_datetime(raw_date).to_pydatetime()
-
-            # Парсинг направления
-            raw_side = str(row[side_col]).lower()
-            if 'buy' in raw_side or 'long' in raw_side:
-                direction = models.TradeDirection.LONG
-            elif 'sell' in raw_side or 'short' in raw_side:
-                direction = models.TradeDirection.SHORT
-            else:
-                continue # Пропускаем неизвестные типы (напр. Transfer)
-
-            # Числовые поля
-            price = float(row[price_col])
-            quantity = float(row[qty_col])
-            
-            pnl = None
-            if pnl_col and pd.notna(row[pnl_col]):
-                pnl = float(row[pnl_col])
-
-            trade = {
-                "symbol": str(row[symbol_col]).upper(),
-                "direction": direction,
-                "entry_price": price,
-                "quantity": quantity,
-                "entry_at": entry_at,
-                "pnl": pnl,
-                "notes": f"Imported from {filename}",
-                "tags": ["Imported"]
-            }
-            trades.append(trade)
-            
-        except Exception as e:
-            print(f"Skipping row due to error: {e}")
+            stats_service.bump_stats_version(db, account_id)
+            insert_rows(batch)
+            db.commit()
+            counts["inserted"] += len(batch)
+        except Exception:
+            db.rollback()
+            for row, trade in zip(batch, sources):
+                try:
+                    stats_service.bump_stats_version(db, account_id)
+                    insert_rows([row])
+                    db.commit()
+                    counts["inserted"] += 1
+                except Exception as e:
+                    db.rollback()
+                    counts["failed"] += 1
+                    if errors is not None:
+                        _report_write_error(errors, trade, e)
+        batch.clear()
+        sources.clear()
+
+    for trade in trades:
+        if (any(trade.get(field) is None for field in _REQUIRED_FIELDS)
+                or not isinstance(trade["direction"], models.TradeDirection)):
+            counts["skipped"] += 1
             continue
+        row = dict(template)
+        row.update((key, value) for key, value in trade.items() if key in template)
+        row["account_id"] = account_id
+        batch.append(row)
+        sources.append(trade)
+        if len(batch) >= batch_size:
+            flush()
+    flush()
 
-    return trades
+    return counts
@@ -1,16 +1,33 @@
-from fastapi import FastAPI, Depends, HTTPException, UploadFile, File
+from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Query, Response
 from fastapi.openapi.docs import get_swagger_ui_html, get_redoc_html
 from fastapi.openapi.utils import get_openapi
 from fastapi.middleware.cors import CORSMiddleware
 import database
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 import models
 import schemas
 import analytics
-import ai_service
+import ai_worker
+import ai_cache
 import import_service
-import csv
-import io
+import stats_service
+import trade_frame
+import monte_carlo
+import export_service
+import trade_service
+import metrics
+import downsampling
+import calendar_service
+import patterns
+import rolling
+import whatif
+import process_pool
+import numpy as np
+from typing import Optional
+from decimal import Decimal
+import asyncio
+from datetime import date, datetime, timedelta
 from fastapi.responses import StreamingResponse
 
 # Инициализируем базу данных при запуске
@@ -35,8 +52,13 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
+# Задержка по маршрутам, SQL и строки на запрос, профилировщик медленных запросов (см. /metrics)
+app.add_middleware(metrics.MetricsMiddleware)
+metrics.instrument_models(models.Base)
+
 # Ручная настройка Swagger UI для работы через HTTPS прокси
 @app.get("/docs", include_in_schema=False)
 async def custom_swagger_ui_html():
@@ -61,6 +83,12 @@ async def startup_event():
     print("Registered routes:")
     for route in app.routes:
         print(f" - {route.path} ({route.name})")
+    await ai_worker.pool.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await ai_worker.pool.stop()
+    process_pool.shutdown()
 
 @app.get("/test-docs", include_in_schema=False)
 async def custom_docs():
@@ -70,6 +98,11 @@ async def custom_docs():
 async def read_root():
     return {"message": "Добро пожаловать в API для ATOM!"}
 
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    # Формат Prometheus (text exposition 0.0.4)
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 @app.post("/trades/", response_model=schemas.Trade)
 def create_trade(trade: schemas.TradeCreate, db: Session = Depends(database.get_db)):
     # 1. Создаем объект модели SQLAlchemy
@@ -77,61 +110,105 @@ def create_trade(trade: schemas.TradeCreate, db: Session = Depends(database.get_
     
     # 2. Сохраняем в базу
     db.add(db_trade)
+    db.flush()
+    trade_service.sync_trade_tags(db, db_trade.id, db_trade.account_id, db_trade.tags)
+    stats_service.bump_stats_version(db, db_trade.account_id)
     db.commit()
     db.refresh(db_trade)
     return db_trade
 
 @app.post("/trades/import")
-async def import_trades(file: UploadFile = File(...), db: Session = Depends(database.get_db)):
-    contents = await file.read()
+async def import_trades(
+    file: UploadFile = File(...),
+    batch_size: int = Query(import_service.IMPORT_BATCH_SIZE, ge=1, le=100_000),
+    cost_method: str = Query("average", pattern="^(average|fifo)$"),
+    db: AsyncSession = Depends(database.get_async_db)
+):
+    # Файл читается кусками прямо из загрузки, куски сразу уходят в БД.
+    # Разбор (pandas) идет в потоке, запись — через async-сессию, event loop не блокируется
+    errors = import_service.new_error_report()
     try:
-        trades_data = import_service.parse_trade_file(contents, file.filename)
+        chunks = await asyncio.to_thread(
+            import_service.iter_trade_file_chunks,
+            file.file, file.filename, errors, cost_method=cost_method
+        )
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     
-    imported_count = 0
-    for trade_dict in trades_data:
-        # Добавляем account_id (пока хардкод 1, как и везде)
-        trade_dict["account_id"] = 1
-        
-        # Создаем модель
-        db_trade = models.Trade(**trade_dict)
-        db.add(db_trade)
-        imported_count += 1
-    
-    db.commit()
-    return {"message": f"Successfully imported {imported_count} trades"}
+    # Массовая запись пачками (account_id пока хардкод 1, как и везде)
+    counts = {"inserted": 0, "skipped": 0, "failed": 0}
+    stopped = None
+    while True:
+        try:
+            chunk = await asyncio.to_thread(next, chunks, None)
+        except ValueError as e:
+            # Файл не разобрался дальше: уже записанные куски остаются в БД,
+            # поэтому вместо 500 отвечаем счетчиками и ошибкой в отчете
+            stopped = str(e)
+            import_service.report_error(errors, None, f"import stopped: {stopped}")
+            break
+        if chunk is None:
+            break
+        chunk_counts = await db.run_sync(
+            import_service.write_trades, chunk, account_id=1, batch_size=batch_size, errors=errors
+        )
+        for key in counts:
+            counts[key] += chunk_counts[key]
+    # В отчете и ошибки разбора, и строки, которые не удалось записать
+    counts["failed"] = errors["count"]
+    if stopped is None:
+        message = f"Successfully imported {counts['inserted']} trades"
+    else:
+        message = f"Import stopped after {counts['inserted']} trades: {stopped}"
+    return {
+        "message": message,
+        **counts,
+        "errors": errors["rows"]
+    }
 
-@app.get("/trades/", response_model=list[schemas.Trade])
-def read_trades(skip: int = 0, limit: int = 5000, db: Session = Depends(database.get_db)):
-    trades = db.query(models.Trade).offset(skip).limit(limit).all()
+@app.get("/trades/", response_model=list[schemas.TradeListItem], response_model_exclude_unset=True)
+def read_trades(
+    response: Response,
+    limit: int = Query(200, ge=1, le=5000),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    account_id: Optional[int] = None,
+    symbol: Optional[str] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    status: Optional[str] = Query(None, pattern="^(open|closed)$"),
+    tag: Optional[str] = None,
+    order: str = Query("asc", pattern="^(asc|desc)$"),
+    db: Session = Depends(database.get_read_db)
+):
+    # Keyset-пагинация по (entry_at, id): курсор следующей страницы — в заголовке X-Next-Cursor.
+    # fields=id,symbol,pnl — отдать только нужные списку колонки
+    try:
+        trades, next_cursor = trade_service.list_trades(
+            db, limit, cursor=cursor, fields=trade_service.parse_fields(fields),
+            account_id=account_id, symbol=symbol, date_from=date_from, date_to=date_to,
+            status=status, tag=tag, descending=order == "desc"
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     return trades
 
 @app.get("/trades/export")
-def export_trades(db: Session = Depends(database.get_db)):
-    trades = db.query(models.Trade).all()
-    
-    output = io.StringIO()
-    writer = csv.writer(output)
-    
-    # Заголовки
-    writer.writerow([
-        "ID", "Symbol", "Direction", "Entry Price", "Exit Price", 
-        "Quantity", "PnL", "Entry At", "Exit At", "Tags", "Notes"
-    ])
-    
-    for t in trades:
-        writer.writerow([
-            t.id, t.symbol, t.direction.value, t.entry_price, t.exit_price,
-            t.quantity, t.pnl, t.entry_at, t.exit_at, 
-            ", ".join(t.tags) if t.tags else "", t.notes
-        ])
-    
-    output.seek(0)
+def export_trades(export_format: str = Query("csv", alias="format")):
+    # Формат: csv (по умолчанию), parquet или arrow (Arrow IPC stream)
+    if export_format not in export_service.EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported export format: {export_format}")
+    if export_format != "csv" and export_service.pa is None:
+        raise HTTPException(status_code=501, detail="Columnar export requires pyarrow")
+
+    # Данные генерируются потоково: сделки читаются пачками из курсора
+    media_type, extension = export_service.EXPORT_FORMATS[export_format]
     return StreamingResponse(
-        iter([output.getvalue()]),
-        media_type="text/csv",
-        headers={"Content-Disposition": "attachment; filename=atom_trades_export.csv"}
+        export_service.iter_export_chunks(export_format),
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename=atom_trades_export.{extension}"}
     )
 
 @app.delete("/trades/{trade_id}")
@@ -139,15 +216,21 @@ def delete_trade(trade_id: int, db: Session = Depends(database.get_db)):
     trade = db.query(models.Trade).filter(models.Trade.id == trade_id).first()
     if not trade:
         raise HTTPException(status_code=404, detail="Trade not found")
+    trade_service.delete_trade_tags(db, trade.id)
+    calendar_service.apply_trade(db, trade, sign=-1)
     db.delete(trade)
+    stats_service.bump_stats_version(db, trade.account_id)
     db.commit()
     return {"message": "Trade deleted"}
 
 @app.patch("/trades/{trade_id}/close", response_model=schemas.Trade)
-async def close_trade(trade_id: int, trade_close: schemas.TradeClose, db: Session = Depends(database.get_db)):
-    db_trade = db.query(models.Trade).filter(models.Trade.id == trade_id).first()
+async def close_trade(trade_id: int, trade_close: schemas.TradeClose, db: AsyncSession = Depends(database.get_async_db)):
+    db_trade = await db.get(models.Trade, trade_id)
     if not db_trade:
         raise HTTPException(status_code=404, detail="Trade not found")
+
+    # Повторное закрытие: прежний результат убираем из дневного PnL
+    await db.run_sync(calendar_service.apply_trade, db_trade, -1)
     
     # Обновляем данные закрытия
     db_trade.exit_price = trade_close.exit_price
@@ -156,116 +239,146 @@ async def close_trade(trade_id: int, trade_close: schemas.TradeClose, db: Sessio
     db_trade.mae_price = trade_close.mae_price
     db_trade.mfe_price = trade_close.mfe_price
     
-    # Расчет PnL
+    # Расчет PnL (цены в БД — Decimal, цена выхода из запроса — float)
+    exit_price = Decimal(str(trade_close.exit_price))
     if db_trade.direction == models.TradeDirection.LONG:
-        db_trade.pnl = (db_trade.exit_price - db_trade.entry_price) * db_trade.quantity
+        db_trade.pnl = (exit_price - db_trade.entry_price) * db_trade.quantity
     else:
-        db_trade.pnl = (db_trade.entry_price - db_trade.exit_price) * db_trade.quantity
+        db_trade.pnl = (db_trade.entry_price - exit_price) * db_trade.quantity
     
-    # AI Анализ
-    trade_data = {
-        "symbol": db_trade.symbol,
-        "direction": db_trade.direction.value,
-        "pnl": float(db_trade.pnl),
-        "mae_price": float(db_trade.mae_price) if db_trade.mae_price else None,
-        "mfe_price": float(db_trade.mfe_price) if db_trade.mfe_price else None,
-        "notes": db_trade.notes,
-        "exit_price": float(db_trade.exit_price)
-    }
-    db_trade.ai_analysis = await ai_service.analyze_trade_with_ai(trade_data)
+    # AI Анализ — в фоне: статус и результат через GET /trades/{id}/analysis
+    db_trade.ai_analysis = None
+    db_trade.ai_error = None
+    db_trade.ai_status = ai_worker.PENDING
+    await db.run_sync(calendar_service.apply_trade, db_trade)
+    await db.run_sync(stats_service.bump_stats_version, db_trade.account_id)
         
-    db.commit()
-    db.refresh(db_trade)
+    await db.commit()
+    await db.refresh(db_trade)
+    ai_worker.pool.enqueue(db_trade.id)
     return db_trade
 
+@app.get("/trades/{trade_id}/analysis", response_model=schemas.TradeAnalysis)
+def get_trade_analysis(trade_id: int, db: Session = Depends(database.get_read_db)):
+    row = (
+        db.query(models.Trade.ai_status, models.Trade.ai_analysis, models.Trade.ai_error)
+        .filter(models.Trade.id == trade_id).first()
+    )
+    if not row:
+        raise HTTPException(status_code=404, detail="Trade not found")
+    status, analysis, error = row
+    # Сделки, проанализированные до появления очереди, статуса не имеют
+    if status is None and analysis is not None:
+        status = ai_worker.DONE
+    return {"trade_id": trade_id, "status": status, "analysis": analysis, "error": error}
+
+@app.get("/ai/cache/stats")
+def get_ai_cache_stats():
+    # Попадания в кэш AI-анализов (память / БД) и промахи с момента старта процесса
+    return ai_cache.cache_stats()
+
 @app.get("/stats/", response_model=schemas.DashboardStats)
-def get_stats(db: Session = Depends(database.get_db)):
-    trades = db.query(models.Trade).filter(models.Trade.pnl != None).all()
-    
-    total_trades = len(trades)
-    if total_trades == 0:
-        return {
-            "total_pnl": 0,
-            "win_rate": 0,
-            "total_trades": 0,
-            "profitable_trades": 0,
-            "optimal_f": 0
-        }
-    
-    total_pnl = float(sum(t.pnl for t in trades))
-    profitable_trades = len([t for t in trades if t.pnl > 0])
-    win_rate = (profitable_trades / total_trades) * 100
-    
-    # Расчет Optimal f
-    pnls = [float(t.pnl) for t in trades]
-    risks = [float(t.risk_amount) if t.risk_amount else float(abs(t.pnl)) for t in trades]
-    opt_f_data = analytics.calculate_optimal_f(pnls, risks)
-    
-    # Расчет SQN
-    sqn_data = analytics.calculate_sqn(pnls, risks)
+def get_stats(
+    account_id: int = 1,
+    db: Session = Depends(database.get_read_db),
+    write_db: Session = Depends(database.get_db)
+):
+    # Снапшот пересчитывается только после изменения сделок счета.
+    # Сессия записи берет соединение, только если нужно сохранить новый снапшот
+    return stats_service.get_dashboard_stats(db, account_id, write_db=write_db)
 
-    # Расчет Z-Score
-    z_score_data = analytics.calculate_z_score(pnls)
-    
-    # Расчет Advanced Stats
-    adv_stats = analytics.calculate_advanced_stats(pnls, risks)
+@app.get("/stats/equity-curve", response_model=schemas.EquityCurve)
+def get_equity_curve(
+    account_id: int = 1,
+    max_points: int = Query(stats_service.EQUITY_CURVE_POINTS, ge=4, le=100_000),
+    method: str = Query(downsampling.LTTB, pattern="^(lttb|minmax)$"),
+    db: Session = Depends(database.get_read_db)
+):
+    # Отдельно от /stats/: сводка не тащит за собой по точке на каждую сделку
+    return stats_service.get_equity_curve(db, account_id, max_points, method)
 
-    # Анализ MAE/MFE
-    mae_mfe_data = analytics.analyze_mae_mfe(trades)
-    
-    # Расчет кривой эквити
-    sorted_trades = sorted(trades, key=lambda x: x.exit_at if x.exit_at else x.entry_at)
-    equity_curve = []
-    current_balance = 0
-    for t in sorted_trades:
-        current_balance += float(t.pnl)
-        equity_curve.append({
-            "date": (t.exit_at if t.exit_at else t.entry_at).strftime("%Y-%m-%d %H:%M"),
-            "balance": round(current_balance, 2)
-        })
-    
-    # Расчет статистики по тегам
-    tag_performance = {}
-    for t in trades:
-        if not t.tags:
-            continue
-        for tag in t.tags:
-            tag = tag.lower()
-            if tag not in tag_performance:
-                tag_performance[tag] = {"pnl": 0, "total": 0, "wins": 0}
-            tag_performance[tag]["pnl"] += float(t.pnl)
-            tag_performance[tag]["total"] += 1
-            if t.pnl > 0:
-                tag_performance[tag]["wins"] += 1
-    
-    tag_stats = []
-    for tag, data in tag_performance.items():
-        tag_stats.append({
-            "tag": tag,
-            "pnl": round(data["pnl"], 2),
-            "win_rate": round((data["wins"] / data["total"]) * 100, 1),
-            "count": data["total"]
-        })
-    # Сортируем по PnL (от лучших к худшим)
-    tag_stats = sorted(tag_stats, key=lambda x: x["pnl"], reverse=True)
+@app.get("/stats/rolling", response_model=schemas.RollingStats)
+def get_rolling(
+    account_id: int = 1,
+    window: int = Query(rolling.DEFAULT_WINDOW, ge=2, le=10_000),
+    max_points: int = Query(stats_service.EQUITY_CURVE_POINTS, ge=4, le=100_000),
+    db: Session = Depends(database.get_read_db)
+):
+    # Скользящие метрики по последним window сделкам для графиков "как менялась система"
+    return stats_service.get_rolling_metrics(db, account_id, window, max_points)
 
-    return {
-        "total_pnl": total_pnl,
-        "win_rate": win_rate,
-        "total_trades": total_trades,
-        "profitable_trades": profitable_trades,
-        "optimal_f": opt_f_data.get("optimal_f", 0),
-        "sqn": sqn_data,
-        "z_score": z_score_data,
-        "profit_factor": adv_stats.get("profit_factor", 0),
-        "r_expectancy": adv_stats.get("r_expectancy", 0),
-        "recovery_factor": adv_stats.get("recovery_factor", 0),
-        "ahpr": opt_f_data.get("geometric_mean", 0), # Используем Geometric Mean как AHPR
-        "mae_mfe_analysis": mae_mfe_data,
-        "equity_curve": equity_curve,
-        "tag_stats": tag_stats
-    }
+@app.get("/stats/insights", response_model=schemas.Insights)
+def get_insights(
+    account_id: int = 1,
+    min_trades: int = Query(patterns.MIN_TRADES, ge=2),
+    min_t: float = Query(patterns.MIN_T_STAT, ge=0),
+    limit: int = Query(20, ge=1, le=200),
+    db: Session = Depends(database.get_read_db)
+):
+    # Паттерны по дням недели, часам, инструментам, сетапам, тегам и их парам
+    return stats_service.get_insights(db, account_id, min_trades, min_t, limit)
+
+@app.get("/stats/calendar", response_model=schemas.CalendarStats)
+def get_calendar(
+    account_id: int = 1,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    db: Session = Depends(database.get_read_db)
+):
+    # Тепловая карта дневного PnL; по умолчанию — последние 365 дней
+    date_to = date_to or date.today()
+    date_from = date_from or date_to - timedelta(days=364)
+    if date_from > date_to:
+        raise HTTPException(status_code=400, detail="date_from must not be after date_to")
+    return calendar_service.get_calendar(db, account_id, date_from, date_to)
+
+@app.get("/stats/monte-carlo", response_model=schemas.MonteCarloStats)
+def get_monte_carlo(
+    account_id: int = 1,
+    n_paths: int = Query(10000, ge=100, le=1_000_000),
+    n_trades: Optional[int] = Query(None, ge=1, le=100_000),
+    risk_pct: float = Query(1.0, gt=0, le=100),
+    ruin_drawdown_pct: float = Query(50.0, gt=0, le=100),
+    seed: Optional[int] = None,
+    db: Session = Depends(database.get_read_db)
+):
+    # Симуляция по R-multiples закрытых сделок (горизонт по умолчанию — длина истории)
+    frame = trade_frame.load_trade_frame(db, account_id)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        r_multiples = frame.pnl / frame.risk
+    try:
+        return monte_carlo.run_monte_carlo(
+            r_multiples,
+            n_paths=n_paths,
+            n_trades=n_trades,
+            risk_fraction=risk_pct / 100,
+            ruin_drawdown=ruin_drawdown_pct / 100,
+            seed=seed,
+        )
+    except ValueError as e:
+        # Слишком большой объем симуляции (MONTE_CARLO_MAX_CELLS)
+        raise HTTPException(status_code=422, detail=str(e))
+
+@app.get("/stats/what-if", response_model=schemas.WhatIfStats)
+def get_what_if(
+    account_id: int = 1,
+    stops: Optional[str] = Query(None, description="Стопы в R через запятую, напр. 0.5,0.7,1,none"),
+    targets: Optional[str] = Query(None, description="Цели в R через запятую, none — без цели"),
+    breakevens: Optional[str] = Query(None, description="Перенос в безубыток после N R, none — никогда"),
+    db: Session = Depends(database.get_read_db)
+):
+    # Все сочетания стоп × цель × безубыток по MAE/MFE закрытых сделок
+    try:
+        levels = (
+            whatif.parse_levels(stops, whatif.DEFAULT_STOPS),
+            whatif.parse_levels(targets, whatif.DEFAULT_TARGETS),
+            whatif.parse_levels(breakevens, whatif.DEFAULT_BREAKEVENS),
+        )
+        frame = trade_frame.load_trade_frame(db, account_id)
+        return whatif.run_what_if(frame, *levels)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @app.get("/db-check")
-def check_db(db: Session = Depends(database.get_db)):
+def check_db(db: Session = Depends(database.get_read_db)):
     return {"status": "Database is connected and tables are created"}
@@ -0,0 +1,360 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter as _Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Dict, Optional, Sequence, Tuple
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Сбор метрик можно выключить (METRICS_ENABLED=0)
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+# Профилировщик медленных запросов: порог в мс (0 — выключен), шаг сэмплирования и каталог для дампов
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "0"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "./profiles")
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SQL_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1, 5)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 1000)
+ROW_BUCKETS = (0, 1, 10, 100, 1000, 10_000, 100_000, 1_000_000)
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_number(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+class Counter:
+    """
+    Монотонный счетчик с метками (формат Prometheus counter).
+    """
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            items = sorted(self._values.items())
+        for label_values, value in items:
+            yield f"{self.name}{_format_labels(self.labels, label_values)} {_format_number(value)}"
+
+class Histogram:
+    """
+    Гистограмма с метками (формат Prometheus histogram): накопительные корзины, сумма и число.
+    """
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # {метки: [счетчики корзин..., сумма, число]}
+        self._values: Dict[Tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values) -> None:
+        with self._lock:
+            state = self._values.get(label_values)
+            if state is None:
+                state = self._values[label_values] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def render(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            items = sorted((labels, list(state)) for labels, state in self._values.items())
+        for label_values, state in items:
+            for bound, count in zip(self.buckets, state):
+                le = f'le="{_format_number(bound)}"'
+                yield f"{self.name}_bucket{_format_labels(self.labels, label_values, le)} {count}"
+            le = 'le="+Inf"'
+            yield f"{self.name}_bucket{_format_labels(self.labels, label_values, le)} {state[-1]}"
+            yield f"{self.name}_sum{_format_labels(self.labels, label_values)} {state[-2]!r}"
+            yield f"{self.name}_count{_format_labels(self.labels, label_values)} {state[-1]}"
+
+REQUEST_LATENCY = Histogram(
+    "atom_http_request_duration_seconds", "HTTP request latency by route",
+    ("method", "route", "status")
+)
+SQL_DURATION = Histogram(
+    "atom_sql_statement_duration_seconds", "SQL statement execution time",
+    ("route", "operation"), SQL_BUCKETS
+)
+SQL_PER_REQUEST = Histogram(
+    "atom_sql_statements_per_request", "SQL statements executed per request",
+    ("route",), COUNT_BUCKETS
+)
+ROWS_PER_REQUEST = Histogram(
+    "atom_rows_hydrated_per_request", "ORM objects and Core rows loaded per request",
+    ("route",), ROW_BUCKETS
+)
+STAGE_DURATION = Histogram(
+    "atom_stage_duration_seconds", "Time spent in instrumented stages (e.g. stats.optimal_f)",
+    ("stage",)
+)
+SLOW_REQUESTS = Counter(
+    "atom_slow_requests_total", "Requests slower than PROFILE_SLOW_MS (profiled)", ("route",)
+)
+
+REGISTRY = (REQUEST_LATENCY, SQL_DURATION, SQL_PER_REQUEST, ROWS_PER_REQUEST, STAGE_DURATION, SLOW_REQUESTS)
+
+class RequestStats:
+    __slots__ = ("scope", "statements", "rows", "profile", "_route")
+
+    def __init__(self, scope):
+        self.scope = scope
+        self.statements = 0
+        self.rows = 0
+        # Профиль запроса (RequestProfile), если включен PROFILE_SLOW_MS
+        self.profile = None
+        self._route = None
+
+    @property
+    def route(self) -> str:
+        # Шаблон пути (/trades/{trade_id}), а не фактический URL; известен после роутинга
+        if self._route is None:
+            route = getattr(self.scope.get("route"), "path", None)
+            if route is None:
+                return "unmatched"
+            self._route = route
+        return self._route
+
+# Статистика текущего запроса. Объект изменяемый, поэтому SQL из пула потоков
+# (sync-эндпоинты) и из run_sync попадает в тот же запрос
+_current: ContextVar[Optional[RequestStats]] = ContextVar("atom_request_stats", default=None)
+
+def _route_label() -> str:
+    # SQL вне запросов (AI-воркеры, миграции) — "background"
+    stats = _current.get()
+    return stats.route if stats is not None else "background"
+
+def _claim_thread(stats: RequestStats) -> None:
+    # Поток пула (sync-эндпоинт), выполняющий код запроса, сэмплируется для его профиля
+    if stats.profile is not None:
+        stats.profile.claim_thread()
+
+def add_rows(count: int) -> None:
+    """
+    Учитывает строки, загруженные Core-запросом (ORM-объекты считаются автоматически).
+    """
+    stats = _current.get()
+    if stats is not None:
+        stats.rows += count
+        _claim_thread(stats)
+
+@contextmanager
+def stage(name: str):
+    # Время этапа (напр. stats.optimal_f) в atom_stage_duration_seconds
+    if not METRICS_ENABLED:
+        yield
+        return
+    stats = _current.get()
+    if stats is not None:
+        _claim_thread(stats)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_DURATION.observe(time.perf_counter() - started, name)
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if METRICS_ENABLED and context is not None:
+        context._atom_started = time.perf_counter()
+        stats = _current.get()
+        if stats is not None:
+            _claim_thread(stats)
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "_atom_started", None)
+    if started is None:
+        return
+    operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER"
+    SQL_DURATION.observe(time.perf_counter() - started, _route_label(), operation)
+    stats = _current.get()
+    if stats is not None:
+        stats.statements += 1
+
+def _on_load(target, context):
+    stats = _current.get()
+    if stats is not None:
+        stats.rows += 1
+        _claim_thread(stats)
+
+def instrument_models(base) -> None:
+    # Каждый ORM-объект, загруженный из БД, считается строкой запроса
+    event.listen(base, "load", _on_load, propagate=True)
+
+# Файлы, в которых "висят" простаивающие потоки
+_IDLE_FILES = ("threading.py", "selectors.py", "queue.py")
+
+def _folded_stack(frame) -> str:
+    return ";".join(
+        f"{entry.name} ({os.path.basename(entry.filename)}:{entry.lineno})"
+        for entry in traceback.extract_stack(frame)
+    )
+
+class RequestProfile:
+    """
+    Стеки одного запроса: его задача в event loop (только пока она выполняется)
+    и потоки пула, которые выполняют его код (sync-эндпоинты, см. claim_thread).
+    Результат — folded stacks ("frame;frame;frame count"), формат flamegraph.pl / speedscope.
+    """
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.loop = task.get_loop()
+        self.loop_thread = threading.get_ident()
+        self.samples = _Counter()
+
+    def claim_thread(self) -> None:
+        thread_id = threading.get_ident()
+        if thread_id != self.loop_thread and _thread_owners.get(thread_id) is not self:
+            _thread_owners[thread_id] = self
+
+    def dump(self, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+# Поток пула -> профиль запроса, код которого он выполняет (поток переходит к следующему запросу)
+_thread_owners: Dict[int, RequestProfile] = {}
+
+class StackSampler:
+    """
+    Сэмплирующий профилировщик: один фоновый поток на процесс раз в interval снимает
+    стеки только тех потоков и задач, которые обслуживают профилируемые запросы.
+    Пока таких запросов нет, поток спит.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._profiles = set()
+        self._lock = threading.Lock()
+        self._active = threading.Event()
+        self._thread = None
+
+    def add(self, profile: RequestProfile) -> None:
+        with self._lock:
+            self._profiles.add(profile)
+            self._active.set()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="atom-profiler", daemon=True)
+                self._thread.start()
+
+    def remove(self, profile: RequestProfile) -> None:
+        with self._lock:
+            self._profiles.discard(profile)
+            if not self._profiles:
+                self._active.clear()
+        for thread_id, owner in list(_thread_owners.items()):
+            if owner is profile:
+                _thread_owners.pop(thread_id, None)
+
+    def _run(self):
+        while True:
+            self._active.wait()
+            time.sleep(self.interval)
+            with self._lock:
+                profiles = list(self._profiles)
+            if not profiles:
+                continue
+            frames = sys._current_frames()
+            for profile in profiles:
+                # Поток event loop выполняет задачу запроса, только если она текущая
+                frame = frames.get(profile.loop_thread)
+                if frame is not None and asyncio.current_task(profile.loop) is profile.task:
+                    profile.samples[_folded_stack(frame)] += 1
+            for thread_id, profile in list(_thread_owners.items()):
+                frame = frames.get(thread_id)
+                # Простаивающие потоки (ждут задачу или событие) не интересны
+                if frame is None or os.path.basename(frame.f_code.co_filename) in _IDLE_FILES:
+                    continue
+                profile.samples[_folded_stack(frame)] += 1
+
+_sampler = StackSampler(PROFILE_INTERVAL_MS / 1000)
+
+def _dump_profile(profile: RequestProfile, method: str, route: str, duration: float) -> None:
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    name = f"{datetime.now():%Y%m%d-%H%M%S-%f}_{method}_{route.strip('/').replace('/', '_') or 'root'}.folded"
+    profile.dump(os.path.join(PROFILE_DIR, name))
+    print(f"Slow request {method} {route}: {duration * 1000:.0f} ms, profile saved to {name}")
+
+class MetricsMiddleware:
+    """
+    ASGI-middleware: задержка по маршруту (шаблон пути, а не фактический URL),
+    число SQL-запросов и загруженных строк на запрос. При PROFILE_SLOW_MS > 0
+    каждый запрос сэмплируется, и стеки медленных сохраняются в PROFILE_DIR.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats(scope)
+        token = _current.set(stats)
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        if PROFILE_SLOW_MS > 0:
+            stats.profile = RequestProfile(asyncio.current_task())
+            _sampler.add(stats.profile)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration = time.perf_counter() - started
+            _current.reset(token)
+            route = stats.route
+            REQUEST_LATENCY.observe(duration, scope["method"], route, str(status["code"]))
+            SQL_PER_REQUEST.observe(stats.statements, route)
+            ROWS_PER_REQUEST.observe(stats.rows, route)
+            if stats.profile is not None:
+                _sampler.remove(stats.profile)
+                if duration * 1000 >= PROFILE_SLOW_MS:
+                    SLOW_REQUESTS.inc(route)
+                    # Запись файла — в пуле потоков, чтобы не блокировать event loop
+                    await asyncio.get_running_loop().run_in_executor(
+                        None, _dump_profile, stats.profile, scope["method"], route, duration
+                    )
+
+def render() -> str:
+    lines = [line for metric in REGISTRY for line in metric.render()]
+    return "\n".join(lines) + "\n"
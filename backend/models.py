@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, JSON, Enum, Numeric
+from sqlalchemy import Column, Integer, String, Float, Date, DateTime, ForeignKey, JSON, Enum, Numeric, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 import enum
@@ -74,5 +74,82 @@ class Trade(Base):
     notes = Column(String)
     tags = Column(JSON, default=[]) # Теги сделки (напр. ["FOMO", "Trend"])
     ai_analysis = Column(JSON) # Результат анализа от AI
+    ai_status = Column(String) # Статус фонового AI-анализа (pending, running, done, failed)
+    ai_error = Column(String) # Причина ошибки AI-анализа (при ai_status = failed)
     
     account = relationship("Account", back_populates="trades")
+
+    # Индексы под keyset-пагинацию списка сделок: порядок (entry_at, id) + фильтры
+    __table_args__ = (
+        Index("ix_trades_entry_at_id", "entry_at", "id"),
+        Index("ix_trades_account_entry_at_id", "account_id", "entry_at", "id"),
+        Index("ix_trades_symbol_entry_at_id", "symbol", "entry_at", "id"),
+        Index("ix_trades_pnl_entry_at_id", "pnl", "entry_at", "id"),
+    )
+
+class TradeTag(Base):
+    """
+    Нормализованные теги сделок (копия Trade.tags в нижнем регистре) для индексных
+    фильтров и GROUP BY по тегам. Синхронизируется при создании, импорте и удалении сделок.
+    """
+    __tablename__ = "trade_tags"
+
+    trade_id = Column(Integer, ForeignKey("trades.id", ondelete="CASCADE"), primary_key=True)
+    tag = Column(String, primary_key=True)
+    account_id = Column(Integer, ForeignKey("accounts.id"))
+
+    __table_args__ = (
+        # Статистика по тегам счета и фильтр ?tag=
+        Index("ix_trade_tags_account_tag_trade", "account_id", "tag", "trade_id"),
+        Index("ix_trade_tags_tag_trade", "tag", "trade_id"),
+    )
+
+class AccountStats(Base):
+    """
+    Снапшот статистики дашборда по счету.
+    version увеличивается при каждом изменении набора сделок,
+    snapshot_version — версия, для которой посчитан snapshot.
+    """
+    __tablename__ = "account_stats"
+
+    account_id = Column(Integer, ForeignKey("accounts.id"), primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+    snapshot_version = Column(Integer)
+    snapshot = Column(JSON)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+class DailyPnl(Base):
+    """
+    PnL закрытых сделок счета по дням (день — дата выхода, а без нее — входа).
+    Обновляется приращениями при закрытии, импорте и удалении сделок;
+    календарь за любой период читается одним проходом по первичному ключу.
+    """
+    __tablename__ = "daily_pnl"
+
+    account_id = Column(Integer, ForeignKey("accounts.id"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    pnl = Column(Numeric(precision=18, scale=8), nullable=False, default=0)
+    trades = Column(Integer, nullable=False, default=0)
+    wins = Column(Integer, nullable=False, default=0)
+
+class AIAnalysisCache(Base):
+    """
+    Кэш ответов AI: ключ — SHA-256 нормализованных входных данных сделки и версии модели.
+    """
+    __tablename__ = "ai_analysis_cache"
+
+    key = Column(String(64), primary_key=True)
+    model_version = Column(String, nullable=False)
+    analysis = Column(JSON, nullable=False)
+    hits = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow, index=True)
+    last_used_at = Column(DateTime, default=datetime.datetime.utcnow, index=True)
+
+class DataMigration(Base):
+    """
+    Примененные миграции данных (database.run_data_migrations): каждая выполняется один раз.
+    """
+    __tablename__ = "data_migrations"
+
+    name = Column(String, primary_key=True)
+    applied_at = Column(DateTime, default=datetime.datetime.utcnow)
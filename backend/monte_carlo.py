@@ -0,0 +1,87 @@
+import os
+import numpy as np
+from typing import Dict, Optional
+import process_pool
+
+# Максимум ячеек (пути × сделки) в одном блоке симуляции: 2M float64 = 16 МБ на массив
+CHUNK_CELLS = 1 << 21
+# С какого объема (пути × сделки) имеет смысл раздавать блоки по процессам
+PARALLEL_MIN_CELLS = 1 << 25
+# Предел работы одного запроса (пути × сделки)
+MAX_CELLS = int(os.getenv("MONTE_CARLO_MAX_CELLS", str(1 << 28)))
+
+PERCENTILES = (5, 25, 50, 75, 95)
+
+def _simulate_chunk(r_multiples: np.ndarray, n_paths: int, n_trades: int,
+                    risk_fraction: float, seed: np.random.SeedSequence):
+    """
+    Симулирует блок путей: бутстрэп R-multiples с риском risk_fraction капитала на сделку.
+    Возвращает итоговый капитал и максимальную просадку каждого пути (капитал на старте = 1).
+    """
+    rng = np.random.default_rng(seed)
+    samples = r_multiples[rng.integers(0, len(r_multiples), size=(n_paths, n_trades))]
+
+    # Капитал считаем в логарифмах: произведение HPR -> накопленная сумма
+    hpr = np.maximum(1.0 + risk_fraction * samples, 0.0)
+    with np.errstate(divide="ignore"):
+        log_equity = np.cumsum(np.log(hpr, out=samples), axis=1)
+
+    final_equity = np.exp(log_equity[:, -1])
+    # Просадка от пика (пик включает стартовый капитал)
+    peak = np.maximum.accumulate(np.maximum(log_equity, 0.0), axis=1)
+    max_drawdown = 1.0 - np.exp(np.min(log_equity - peak, axis=1))
+    return final_equity, max_drawdown
+
+def run_monte_carlo(r_multiples, n_paths: int = 10000, n_trades: Optional[int] = None,
+                    risk_fraction: float = 0.01, ruin_drawdown: float = 0.5,
+                    seed: Optional[int] = None, max_workers: Optional[int] = None) -> Dict:
+    """
+    Monte Carlo стресс-тест: n_paths случайных перестановок (с возвращением) истории R-multiples.
+    Матрица путей × сделок целиком не создается: пути считаются блоками по CHUNK_CELLS ячеек,
+    большие объемы раздаются по общему пулу процессов (process_pool; max_workers=1 —
+    без процессов). Результат воспроизводим при заданном seed и не зависит от числа процессов.
+    Объем больше MAX_CELLS (пути × сделки) — ValueError.
+    """
+    r_multiples = np.asarray(r_multiples, dtype=np.float64)
+    r_multiples = r_multiples[np.isfinite(r_multiples)]
+    if len(r_multiples) < 2:
+        return {"message": "Недостаточно данных для симуляции (нужно минимум 2 сделки)"}
+
+    n_trades = n_trades or len(r_multiples)
+    if n_paths * n_trades > MAX_CELLS:
+        raise ValueError(
+            f"n_paths * n_trades = {n_paths * n_trades} exceeds the limit of {MAX_CELLS}; "
+            "reduce n_paths or set a shorter n_trades"
+        )
+    paths_per_chunk = max(1, CHUNK_CELLS // n_trades)
+    chunk_sizes = [min(paths_per_chunk, n_paths - start) for start in range(0, n_paths, paths_per_chunk)]
+    # Отдельный поток случайных чисел на каждый блок
+    seeds = np.random.SeedSequence(seed).spawn(len(chunk_sizes))
+
+    args = [(r_multiples, size, n_trades, risk_fraction, chunk_seed)
+            for size, chunk_seed in zip(chunk_sizes, seeds)]
+    parallel = max_workers != 1 and len(chunk_sizes) > 1 and n_paths * n_trades >= PARALLEL_MIN_CELLS
+    if parallel:
+        results = list(process_pool.get_executor().map(_simulate_chunk, *zip(*args)))
+    else:
+        results = [_simulate_chunk(*a) for a in args]
+
+    final_equity = np.concatenate([r[0] for r in results])
+    max_drawdown = np.concatenate([r[1] for r in results])
+
+    final_return_pct = (final_equity - 1.0) * 100
+    drawdown_pct = max_drawdown * 100
+
+    return {
+        "n_paths": n_paths,
+        "n_trades": n_trades,
+        "risk_pct": round(risk_fraction * 100, 4),
+        "risk_of_ruin": round(float(np.mean(max_drawdown >= ruin_drawdown)) * 100, 2),
+        "probability_of_loss": round(float(np.mean(final_equity < 1.0)) * 100, 2),
+        "return_percentiles": {
+            f"p{p}": round(float(v), 2) for p, v in zip(PERCENTILES, np.percentile(final_return_pct, PERCENTILES))
+        },
+        "drawdown_percentiles": {
+            f"p{p}": round(float(v), 2) for p, v in zip(PERCENTILES, np.percentile(drawdown_pct, PERCENTILES))
+        },
+    }
@@ -0,0 +1,265 @@
+from itertools import combinations
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+import pandas as pd
+from sqlalchemy import select, cast, Float
+from sqlalchemy.orm import Session
+import models
+import metrics
+import trade_frame
+
+# Измерения куба. weekday и hour — по времени входа
+DIMENSIONS = (
+    "weekday", "hour", "symbol", "direction", "setup_name", "timeframe", "news_event", "tag",
+)
+# Группировки: каждое измерение отдельно и все пары
+GROUPINGS: Tuple[Tuple[str, ...], ...] = (
+    tuple((dim,) for dim in DIMENSIONS) + tuple(combinations(DIMENSIONS, 2))
+)
+
+# Сколько сделок читать из БД за раз (куб собирается по кускам)
+CUBE_CHUNK_SIZE = 100_000
+# Порог значимости по умолчанию: минимум сделок в ячейке и |t| (t-тест Уэлча против остальных сделок)
+MIN_TRADES = 10
+MIN_T_STAT = 2.0
+
+WEEKDAYS = ("понедельник", "вторник", "среда", "четверг", "пятница", "суббота", "воскресенье")
+_WEEKDAYS_PLURAL = ("понедельникам", "вторникам", "средам", "четвергам", "пятницам", "субботам", "воскресеньям")
+
+# Статистики ячейки: число сделок, сумма PnL, сумма квадратов PnL, прибыльные
+COUNT, SUM, SUM_SQ, WINS = range(4)
+
+class PatternCube:
+    """
+    Куб достаточных статистик (count, sum, sum of squares, wins) PnL закрытых сделок
+    по всем измерениям DIMENSIONS и их парам.
+    Статистики аддитивны: merge() складывает кубы (напр. собранные по кускам),
+    add() с sign=-1 вычитает ранее добавленные сделки; ячейки без сделок удаляются.
+    cells: {группировка: {значения измерений: np.array([count, sum, sum_sq, wins])}}.
+    """
+
+    def __init__(self):
+        self.cells: Dict[Tuple[str, ...], Dict[tuple, np.ndarray]] = {grouping: {} for grouping in GROUPINGS}
+        self.total = np.zeros(4)
+
+    def add(self, trades: pd.DataFrame, tags: Optional[pd.DataFrame] = None, sign: int = 1) -> "PatternCube":
+        """
+        Добавляет сделки за один проход на группировку.
+        trades: колонки pnl и измерения (кроме tag), индекс — id сделки.
+        tags: колонки trade_id и tag (у сделки может быть несколько тегов).
+        """
+        if len(trades) == 0:
+            return self
+        pnl = trades["pnl"].to_numpy(dtype=np.float64)
+        stats = np.column_stack([np.ones_like(pnl), pnl, pnl * pnl, (pnl > 0).astype(np.float64)]) * sign
+        self.total += stats.sum(axis=0)
+
+        # Категориальные коды: одна факторизация на измерение, пропуски -> -1
+        codes = {}
+        for dim in DIMENSIONS[:-1]:
+            dim_codes, uniques = pd.factorize(trades[dim], use_na_sentinel=True)
+            codes[dim] = (dim_codes, np.asarray(uniques, dtype=object))
+
+        # Для группировок с тегом строки "размножаются": сделка попадает в ячейку каждого своего тега
+        tag_rows = None
+        if tags is not None and len(tags):
+            position = trades.index.get_indexer(tags["trade_id"])
+            known = position >= 0
+            tag_rows = position[known]
+            tag_codes, tag_uniques = pd.factorize(tags["tag"].to_numpy()[known])
+            codes["tag"] = (tag_codes, np.asarray(tag_uniques, dtype=object))
+
+        for grouping in GROUPINGS:
+            if "tag" in grouping:
+                if tag_rows is None:
+                    continue
+                columns = [
+                    codes[dim][0] if dim == "tag" else codes[dim][0][tag_rows]
+                    for dim in grouping
+                ]
+                self._accumulate(grouping, columns, [codes[dim][1] for dim in grouping], stats[tag_rows])
+            else:
+                self._accumulate(grouping, [codes[dim][0] for dim in grouping],
+                                 [codes[dim][1] for dim in grouping], stats)
+        return self
+
+    def _accumulate(self, grouping, columns: List[np.ndarray], uniques: List[np.ndarray], stats: np.ndarray):
+        valid = np.logical_and.reduce([column >= 0 for column in columns])
+        if not valid.any():
+            return
+        # Составной ключ ячейки из кодов, затем сумма статистик по ключу (bincount)
+        key = np.zeros(int(valid.sum()), dtype=np.int64)
+        for column, labels in zip(columns, uniques):
+            key = key * len(labels) + column[valid]
+        cell_keys, inverse = np.unique(key, return_inverse=True)
+        sums = np.column_stack([
+            np.bincount(inverse, weights=stats[valid, i], minlength=len(cell_keys)) for i in range(4)
+        ])
+        label_codes = np.unravel_index(cell_keys, [len(labels) for labels in uniques])
+        cells = self.cells[grouping]
+        for index, labels in enumerate(zip(*(labels[codes] for labels, codes in zip(uniques, label_codes)))):
+            _add_to_cell(cells, labels, sums[index])
+
+    def merge(self, other: "PatternCube") -> "PatternCube":
+        self.total += other.total
+        for grouping, other_cells in other.cells.items():
+            cells = self.cells[grouping]
+            for labels, stats in other_cells.items():
+                _add_to_cell(cells, labels, stats)
+        return self
+
+    def grouping_table(self, grouping: Tuple[str, ...]) -> Tuple[List[tuple], np.ndarray]:
+        # Значения и матрица статистик (ячейки × 4) одной группировки
+        cells = self.cells[grouping]
+        if not cells:
+            return [], np.zeros((0, 4))
+        return list(cells), np.array(list(cells.values()))
+
+def _add_to_cell(cells: Dict[tuple, np.ndarray], labels: tuple, stats: np.ndarray) -> None:
+    # Ячейка без сделок (в том числе после вычитания) в кубе не хранится
+    cell = cells.get(labels)
+    if cell is None:
+        if stats[COUNT] > 0:
+            cells[labels] = stats.copy()
+        return
+    cell += stats
+    if cell[COUNT] <= 0:
+        del cells[labels]
+
+def _trades_frame(rows) -> pd.DataFrame:
+    columns = ["id", "pnl", "entry_ts", "direction", "symbol", "setup_name", "timeframe", "news_event"]
+    df = pd.DataFrame.from_records(rows, columns=columns, index="id")
+    entry_at = pd.to_datetime(df.pop("entry_ts").astype("float64"), unit="s")
+    df["weekday"] = entry_at.dt.weekday.astype("Int64")
+    df["hour"] = entry_at.dt.hour.astype("Int64")
+    df["direction"] = df["direction"].map(lambda direction: direction.value if direction is not None else None)
+    return df
+
+def load_pattern_cube(db: Session, account_id: int, chunk_size: int = CUBE_CHUNK_SIZE) -> PatternCube:
+    """
+    Собирает куб по закрытым сделкам счета кусками по chunk_size (keyset по id),
+    так что в памяти одновременно только один кусок сделок.
+    """
+    t = models.Trade
+    tt = models.TradeTag
+    dialect_name = db.get_bind().dialect.name
+    stmt = (
+        select(
+            t.id, cast(t.pnl, Float), trade_frame._epoch_seconds(t.entry_at, dialect_name),
+            t.direction, t.symbol, t.setup_name, t.timeframe, t.news_event,
+        )
+        .where(t.account_id == account_id, t.pnl != None)
+        .order_by(t.id)
+        .limit(chunk_size)
+    )
+    cube = PatternCube()
+    conn = db.connection()
+    last_id = None
+    while True:
+        rows = conn.execute(stmt if last_id is None else stmt.where(t.id > last_id)).all()
+        if not rows:
+            break
+        metrics.add_rows(len(rows))
+        first_id, last_id = rows[0][0], rows[-1][0]
+        tags = pd.DataFrame(
+            conn.execute(
+                select(tt.trade_id, tt.tag)
+                .where(tt.account_id == account_id, tt.trade_id >= first_id, tt.trade_id <= last_id)
+            ).all(),
+            columns=["trade_id", "tag"],
+        )
+        cube.add(_trades_frame(rows), tags)
+        if len(rows) < chunk_size:
+            break
+    return cube
+
+def _describe(dim: str, value) -> str:
+    if dim == "weekday":
+        return f"по {_WEEKDAYS_PLURAL[int(value)]}"
+    if dim == "hour":
+        return f"в {int(value):02d}:00–{int(value):02d}:59"
+    if dim == "symbol":
+        return f"на {value}"
+    if dim == "direction":
+        return "в лонгах" if value == models.TradeDirection.LONG.value else "в шортах"
+    if dim == "setup_name":
+        return f"в сетапе «{value}»"
+    if dim == "timeframe":
+        return f"на таймфрейме {value}"
+    if dim == "news_event":
+        return f"при событии «{value}»"
+    return f"с тегом «{value}»"
+
+def _message(grouping: Sequence[str], values: Sequence, expectancy: float) -> str:
+    verdict = "Ты теряешь" if expectancy < 0 else "Ты зарабатываешь"
+    return f"{verdict} {' '.join(_describe(dim, value) for dim, value in zip(grouping, values))}"
+
+def _welch_t(stats: np.ndarray, total: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    t-статистика Уэлча: среднее PnL ячейки против остальных сделок группировки.
+    Возвращает (t, среднее ячейки, среднее остальных); остальные = итог группировки - ячейка
+    (итог — по различным сделкам, см. _grouping_total).
+    """
+    rest = total - stats
+    with np.errstate(divide="ignore", invalid="ignore"):
+        n, n_rest = stats[:, COUNT], rest[:, COUNT]
+        mean, mean_rest = stats[:, SUM] / n, rest[:, SUM] / n_rest
+        var = (stats[:, SUM_SQ] - stats[:, SUM] * mean) / (n - 1)
+        var_rest = (rest[:, SUM_SQ] - rest[:, SUM] * mean_rest) / (n_rest - 1)
+        t = (mean - mean_rest) / np.sqrt(np.maximum(var, 0) / n + np.maximum(var_rest, 0) / n_rest)
+    return np.nan_to_num(t, nan=0.0, posinf=0.0, neginf=0.0), mean, mean_rest
+
+def _grouping_total(cube: PatternCube, grouping: Tuple[str, ...], stats: np.ndarray) -> np.ndarray:
+    """
+    Итог группировки по различным сделкам, против которого сравнивается ячейка.
+    Сделка с несколькими тегами входит в ячейку каждого тега, поэтому для группировок
+    с тегом сумма ячеек считает ее несколько раз: вместо нее берутся все сделки
+    (tag) или сделки с заданным вторым измерением (сумма ячеек этого измерения).
+    """
+    if "tag" not in grouping:
+        return stats.sum(axis=0)
+    others = [dim for dim in grouping if dim != "tag"]
+    if not others:
+        return cube.total
+    _, dim_stats = cube.grouping_table((others[0],))
+    return dim_stats.sum(axis=0)
+
+def rank_insights(cube: PatternCube, min_trades: int = MIN_TRADES, min_t: float = MIN_T_STAT,
+                  limit: int = 20) -> List[Dict]:
+    """
+    Значимые ячейки куба по убыванию |t|. Пара измерений попадает в выдачу, только если
+    она значимее обоих своих измерений по отдельности (иначе это тот же паттерн).
+    """
+    t_by_cell: Dict[Tuple[Tuple[str, ...], tuple], float] = {}
+    candidates = []
+    for grouping in GROUPINGS:
+        labels, stats = cube.grouping_table(grouping)
+        if not labels:
+            continue
+        t, mean, mean_rest = _welch_t(stats, _grouping_total(cube, grouping, stats))
+        for index, values in enumerate(labels):
+            t_by_cell[(grouping, values)] = t[index]
+            if stats[index, COUNT] >= min_trades and abs(t[index]) >= min_t:
+                candidates.append((grouping, values, stats[index], t[index], mean[index], mean_rest[index]))
+
+    insights = []
+    for grouping, values, stats, t, mean, mean_rest in candidates:
+        if len(grouping) == 2:
+            parents = [t_by_cell.get(((dim,), (value,)), 0.0) for dim, value in zip(grouping, values)]
+            if abs(t) <= max(abs(parent) for parent in parents):
+                continue
+        count = int(stats[COUNT])
+        insights.append({
+            "dimensions": list(grouping),
+            "values": [WEEKDAYS[int(value)] if dim == "weekday" else str(value)
+                       for dim, value in zip(grouping, values)],
+            "trades": count,
+            "total_pnl": round(float(stats[SUM]), 2),
+            "expectancy": round(float(mean), 2),
+            "rest_expectancy": round(float(mean_rest), 2),
+            "win_rate": round(float(stats[WINS]) / count * 100, 2),
+            "t_stat": round(float(t), 2),
+            "message": _message(grouping, values, mean),
+        })
+    insights.sort(key=lambda insight: abs(insight["t_stat"]), reverse=True)
+    return insights[:limit]
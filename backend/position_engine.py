@@ -0,0 +1,245 @@
+from collections import deque
+from itertools import repeat
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+import models
+import process_pool
+
+# Методы учета позиции
+AVERAGE = "average"  # Средняя цена (как раньше в Inventory)
+FIFO = "fifo"        # Закрываем лоты в порядке открытия
+METHODS = (AVERAGE, FIFO)
+
+LONG = models.TradeDirection.LONG
+SHORT = models.TradeDirection.SHORT
+
+# С какого числа сделок имеет смысл раздавать инструменты по процессам
+PARALLEL_MIN_FILLS = 1_000_000
+
+# Сделка (fill): (symbol, direction, qty, price, at, ref); ref — произвольная ссылка, напр. номер строки
+Fill = Tuple[str, models.TradeDirection, float, float, Optional[datetime], object]
+
+class Lot:
+    __slots__ = ("qty", "price", "at", "ref")
+
+    def __init__(self, qty: float, price: float, at: Optional[datetime], ref):
+        self.qty = qty
+        self.price = price
+        self.at = at
+        self.ref = ref
+
+class RoundTrip(NamedTuple):
+    """
+    Завершенная сделка: открывающий и закрывающий fill для закрытого объема.
+    direction — направление позиции (LONG, если закрыт лонг).
+    """
+    symbol: str
+    direction: models.TradeDirection
+    quantity: float
+    entry_price: float
+    exit_price: float
+    entry_at: Optional[datetime]
+    exit_at: Optional[datetime]
+    pnl: float
+    entry_ref: object
+    exit_ref: object
+
+    def as_dict(self) -> Dict:
+        return self._asdict()
+
+class Position:
+    """
+    Состояние по инструменту. qty > 0 — лонг, qty < 0 — шорт.
+    Для FIFO открытые лоты лежат в lots, для средней цены — avg_price и время открытия.
+    """
+    __slots__ = ("qty", "avg_price", "opened_at", "open_ref", "lots")
+
+    def __init__(self):
+        self.qty = 0.0
+        self.avg_price = 0.0
+        self.opened_at = None
+        self.open_ref = None
+        self.lots = deque()
+
+class PositionEngine:
+    """
+    Движок позиций: считает реализованный PnL по потоку сделок и собирает round trips.
+    Инструменты независимы, поэтому поток можно делить по символам (см. match_fills).
+    """
+
+    def __init__(self, method: str = AVERAGE, collect_round_trips: bool = True):
+        if method not in METHODS:
+            raise ValueError(f"Unknown cost method: {method}")
+        self.method = method
+        self.fifo = method == FIFO
+        # Если нужен только PnL (импорт), round trips можно не собирать
+        self.collect_round_trips = collect_round_trips
+        self.positions: Dict[str, Position] = {}
+        self.round_trips: List[RoundTrip] = []
+
+    def process_fill(self, symbol: str, direction: models.TradeDirection, qty: float, price: float,
+                     at: Optional[datetime] = None, ref=None) -> Optional[float]:
+        """
+        Применяет сделку к позиции. Возвращает реализованный PnL, если сделка
+        закрыла (частично или полностью) встречную позицию, иначе None.
+        """
+        pos = self.positions.get(symbol)
+        if pos is None:
+            pos = self.positions[symbol] = Position()
+        return self._apply(pos, symbol, direction == LONG, qty, price, at, ref)
+
+    def _apply(self, pos: "Position", symbol, is_buy: bool, qty: float, price: float, at, ref) -> Optional[float]:
+        current_qty = pos.qty
+
+        # Открытие или добавление к позиции в ту же сторону
+        if (current_qty >= 0) if is_buy else (current_qty <= 0):
+            current_abs_qty = abs(current_qty)
+            total_cost = current_abs_qty * pos.avg_price + qty * price
+            new_abs_qty = current_abs_qty + qty
+            pos.avg_price = total_cost / new_abs_qty if new_abs_qty != 0 else 0
+            pos.qty = new_abs_qty if is_buy else current_qty - qty
+            if current_qty == 0:
+                pos.opened_at = at
+                pos.open_ref = ref
+            if self.fifo:
+                pos.lots.append(Lot(qty, price, at, ref))
+            return None
+
+        # Покупка против шорта или продажа против лонга — закрытие
+        closed_qty = min(abs(current_qty), qty)
+        if self.fifo:
+            pnl = self._close_fifo(pos, symbol, is_buy, closed_qty, price, at, ref)
+        else:
+            # Long PnL = (Sell - Buy) * Qty, Short PnL = (Sell - Buy) * Qty; вход — средняя цена
+            pnl = (pos.avg_price - price) * closed_qty if is_buy else (price - pos.avg_price) * closed_qty
+            if self.collect_round_trips:
+                self.round_trips.append(RoundTrip(
+                    symbol, SHORT if is_buy else LONG, closed_qty, pos.avg_price, price,
+                    pos.opened_at, at, pnl, pos.open_ref, ref
+                ))
+
+        # Move towards 0 (e.g. -10 + 10 = 0)
+        pos.qty = current_qty + closed_qty if is_buy else current_qty - closed_qty
+
+        remaining = qty - closed_qty
+        if remaining > 0:
+            # Переворот позиции: остаток открывает новую
+            pos.qty = remaining if is_buy else -remaining
+            pos.avg_price = price
+            pos.opened_at = at
+            pos.open_ref = ref
+            if self.fifo:
+                pos.lots.clear()
+                pos.lots.append(Lot(remaining, price, at, ref))
+        return pnl
+
+    def _close_fifo(self, pos: "Position", symbol, is_buy: bool, closed_qty: float,
+                    price: float, at, ref) -> float:
+        # Закрываем лоты с начала очереди; каждый (частично) закрытый лот — отдельный round trip
+        direction = SHORT if is_buy else LONG
+        pnl = 0.0
+        left = closed_qty
+        lots = pos.lots
+        while left > 0 and lots:
+            lot = lots[0]
+            matched = min(lot.qty, left)
+            lot_pnl = (lot.price - price) * matched if is_buy else (price - lot.price) * matched
+            pnl += lot_pnl
+            if self.collect_round_trips:
+                self.round_trips.append(RoundTrip(
+                    symbol, direction, matched, lot.price, price, lot.at, at, lot_pnl, lot.ref, ref
+                ))
+            lot.qty -= matched
+            left -= matched
+            if lot.qty <= 0:
+                lots.popleft()
+        # Средняя цена оставшихся лотов
+        remaining_qty = sum(lot.qty for lot in lots)
+        if remaining_qty > 0:
+            pos.avg_price = sum(lot.qty * lot.price for lot in lots) / remaining_qty
+        return pnl
+
+def _match_group(symbols: List[str], is_buy: List[bool], quantities: List[float], prices: List[float],
+                 times: Optional[List], refs: List, method: str, collect_round_trips: bool):
+    """
+    Обрабатывает сделки группы инструментов.
+    Возвращает PnL по сделкам и round trips в порядке закрытия.
+    """
+    engine = PositionEngine(method, collect_round_trips)
+    positions = engine.positions
+    apply = engine._apply
+    pnls = []
+    for symbol, buy, qty, price, at, ref in zip(symbols, is_buy, quantities, prices, times or repeat(None), refs):
+        pos = positions.get(symbol)
+        if pos is None:
+            pos = positions[symbol] = Position()
+        pnls.append(apply(pos, symbol, buy, qty, price, at, ref))
+    return pnls, engine.round_trips
+
+def split_fills_by_symbol(fills: Sequence[Fill], n_groups: int) -> List[List[int]]:
+    """
+    Делит сделки на n_groups групп по символу (все сделки символа — в одной группе).
+    Возвращает индексы сделок каждой группы в исходном порядке.
+    """
+    by_symbol: Dict[str, List[int]] = {}
+    for index, fill in enumerate(fills):
+        by_symbol.setdefault(fill[0], []).append(index)
+
+    # Крупные символы раздаем первыми в наименее загруженную группу
+    groups = [[] for _ in range(max(1, n_groups))]
+    for symbol_indices in sorted(by_symbol.values(), key=len, reverse=True):
+        min(groups, key=len).extend(symbol_indices)
+    return [sorted(group) for group in groups if group]
+
+def match_fills(fills: Sequence[Fill], method: str = AVERAGE, max_workers: Optional[int] = None,
+                collect_round_trips: bool = True) -> Tuple[List[Optional[float]], List[RoundTrip]]:
+    """
+    Прогоняет поток сделок через движок позиций.
+    Возвращает PnL для каждой сделки (в исходном порядке) и round trips в порядке закрытия.
+    Большие многоинструментальные отчеты обрабатываются параллельно по символам.
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown cost method: {method}")
+
+    # Группы раздаются по общему пулу процессов (process_pool); max_workers=1 — без процессов
+    n_workers = max_workers or process_pool.PROCESS_POOL_SIZE
+    groups = None
+    if n_workers > 1 and len(fills) >= PARALLEL_MIN_FILLS:
+        groups = split_fills_by_symbol(fills, n_workers)
+
+    if groups is None or len(groups) <= 1:
+        pnls, trips = _match_group(
+            [f[0] for f in fills], [f[1] == LONG for f in fills], [f[2] for f in fills],
+            [f[3] for f in fills], [f[4] for f in fills], [f[5] for f in fills],
+            method, collect_round_trips
+        )
+        return pnls, trips
+
+    # В процессы уходят только символы, флаги и числа; вместо ссылок — индексы сделок
+    args = [
+        (
+            [fills[i][0] for i in group], [fills[i][1] == LONG for i in group],
+            [fills[i][2] for i in group], [fills[i][3] for i in group], None, group
+        )
+        for group in groups
+    ]
+    n = len(args)
+    results = list(process_pool.get_executor().map(
+        _match_group, *zip(*args), [method] * n, [collect_round_trips] * n
+    ))
+
+    pnls: List[Optional[float]] = [None] * len(fills)
+    trips = []
+    for group, (group_pnls, group_trips) in zip(groups, results):
+        for index, pnl in zip(group, group_pnls):
+            pnls[index] = pnl
+        trips.extend(group_trips)
+
+    # Сортируем по индексу закрывающей сделки (sort стабилен) и подставляем время и ссылки
+    trips.sort(key=lambda trip: trip.exit_ref)
+    round_trips = [
+        RoundTrip(symbol, direction, qty, entry_price, exit_price,
+                  fills[entry][4], fills[exit_][4], pnl, fills[entry][5], fills[exit_][5])
+        for symbol, direction, qty, entry_price, exit_price, _, _, pnl, entry, exit_ in trips
+    ]
+    return pnls, round_trips
@@ -0,0 +1,36 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+# Размер общего пула процессов для CPU-задач (Monte Carlo, сопоставление сделок)
+PROCESS_POOL_SIZE = int(os.getenv("PROCESS_POOL_SIZE", "0")) or os.cpu_count() or 1
+
+_executor: Optional[ProcessPoolExecutor] = None
+_lock = threading.Lock()
+
+def _context():
+    # fork из многопоточного сервера небезопасен (копируются захваченные другими
+    # потоками блокировки), поэтому процессы стартуют через forkserver, где его нет — spawn
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
+    return multiprocessing.get_context("spawn")
+
+def get_executor() -> ProcessPoolExecutor:
+    """
+    Общий долгоживущий пул процессов: создается при первом обращении и переиспользуется
+    всеми запросами, вместо отдельного пула (и запуска процессов) на каждый вызов.
+    """
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=PROCESS_POOL_SIZE, mp_context=_context())
+        return _executor
+
+def shutdown() -> None:
+    global _executor
+    with _lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,78 @@
+import numpy as np
+from typing import Dict
+import analytics
+
+# Окно по умолчанию (сделок)
+DEFAULT_WINDOW = 50
+
+def _window_sums(x: np.ndarray, window: int) -> np.ndarray:
+    """
+    Суммы по скользящему окну [i - window + 1, i] для i >= window - 1 через разность
+    накопленных сумм: O(n) независимо от размера окна.
+    """
+    cumulative = np.concatenate(([0.0], np.cumsum(x)))
+    return cumulative[window:] - cumulative[:-window]
+
+def rolling_mean_std(x: np.ndarray, window: int):
+    """
+    Скользящие среднее и выборочное стандартное отклонение (ddof=1).
+    Ряд предварительно центрируется по общему среднему: дисперсия от сдвига не зависит,
+    а разность накопленных сумм квадратов не теряет точность на длинной истории.
+    """
+    shift = x.mean() if len(x) else 0.0
+    centered = x - shift
+    sums = _window_sums(centered, window)
+    sums_sq = _window_sums(centered * centered, window)
+    mean = sums / window
+    if window < 2:
+        return mean + shift, np.zeros_like(mean)
+    variance = (sums_sq - sums * mean) / (window - 1)
+    # Ошибка округления разности накопленных сумм растет с длиной истории:
+    # дисперсию ниже этого порога считаем нулевой (окно из одинаковых значений)
+    noise = 64 * np.finfo(np.float64).eps * float(np.sum(centered * centered)) / (window - 1)
+    variance[variance <= noise] = 0.0
+    return mean + shift, np.sqrt(variance)
+
+def underwater(pnl: np.ndarray) -> np.ndarray:
+    """
+    Просадка от пика после каждой сделки (в валюте, >= 0). Баланс начинается с 0,
+    как в analytics.calculate_advanced_stats.
+    """
+    balance = np.cumsum(pnl)
+    peak = np.maximum.accumulate(np.maximum(balance, 0.0))
+    return peak - balance
+
+def compute_rolling(pnl, risk, window: int = DEFAULT_WINDOW) -> Dict[str, np.ndarray]:
+    """
+    Скользящие метрики по последним window сделкам для каждой сделки, начиная с window-й:
+    SQN (в R, как analytics.calculate_sqn), матожидание (средний PnL), win rate,
+    profit factor (99.99 без убытков, как в analytics). drawdown — просадка от пика
+    всей истории на момент сделки. Все ряды — O(n) через накопленные суммы.
+    """
+    pnl = np.asarray(pnl, dtype=np.float64)
+    if window < 1:
+        raise ValueError("window must be positive")
+    if len(pnl) < window:
+        empty = np.empty(0)
+        return {name: empty for name in ("sqn", "expectancy", "win_rate", "profit_factor", "drawdown")}
+
+    r_multiples = analytics._r_multiples(pnl, risk, np.not_equal)
+    mean_r, std_r = rolling_mean_std(r_multiples, window)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sqn = np.where(std_r > 0, mean_r / std_r * np.sqrt(window), 0.0)
+
+    losses = -np.minimum(pnl, 0.0)
+    gross_profit = _window_sums(np.maximum(pnl, 0.0), window)
+    gross_loss = _window_sums(losses, window)
+    # Окно без убытков: остаток округления вместо точного нуля
+    no_loss = gross_loss <= 64 * np.finfo(np.float64).eps * float(losses.sum())
+    with np.errstate(divide="ignore", invalid="ignore"):
+        profit_factor = np.where(no_loss, 99.99, gross_profit / gross_loss)
+
+    return {
+        "sqn": sqn,
+        "expectancy": (gross_profit - gross_loss) / window,
+        "win_rate": _window_sums((pnl > 0).astype(np.float64), window) / window * 100,
+        "profit_factor": profit_factor,
+        "drawdown": underwater(pnl)[window - 1:],
+    }
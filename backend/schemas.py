@@ -43,16 +43,64 @@ class Trade(TradeBase):
     mae_price: Optional[float] = None
     mfe_price: Optional[float] = None
     ai_analysis: Optional[dict] = None
+    ai_status: Optional[str] = None
+    ai_error: Optional[str] = None
 
     class Config:
         from_attributes = True
 
+class TradeListItem(BaseModel):
+    # Элемент списка сделок: при ?fields= приходят только выбранные поля,
+    # поэтому все поля необязательные (отдается с response_model_exclude_unset)
+    id: Optional[int] = None
+    account_id: Optional[int] = None
+    symbol: Optional[str] = None
+    asset_name: Optional[str] = None
+    asset_type: Optional[str] = None
+    direction: Optional[models.TradeDirection] = None
+    entry_price: Optional[float] = None
+    exit_price: Optional[float] = None
+    quantity: Optional[float] = None
+    leverage: Optional[float] = None
+    entry_at: Optional[datetime] = None
+    exit_at: Optional[datetime] = None
+    stop_loss: Optional[float] = None
+    take_profit: Optional[float] = None
+    risk_amount: Optional[float] = None
+    mae_price: Optional[float] = None
+    mfe_price: Optional[float] = None
+    pnl: Optional[float] = None
+    commission: Optional[float] = None
+    setup_name: Optional[str] = None
+    timeframe: Optional[str] = None
+    news_event: Optional[str] = None
+    screenshot_url: Optional[str] = None
+    exit_reason: Optional[str] = None
+    emotions: Optional[str] = None
+    notes: Optional[str] = None
+    tags: Optional[list[str]] = None
+    ai_analysis: Optional[dict] = None
+    ai_status: Optional[str] = None
+    ai_error: Optional[str] = None
+
+    class Config:
+        from_attributes = True
+
+class TradeAnalysis(BaseModel):
+    trade_id: int
+    status: Optional[str] = None # pending, running, done, failed (None — анализ не запускался)
+    analysis: Optional[dict] = None
+    error: Optional[str] = None # Причина ошибки при status = failed
+
 class DashboardStats(BaseModel):
     total_pnl: float
     win_rate: float
     total_trades: int
     profitable_trades: int
+    first_trade_at: Optional[datetime] = None
+    last_trade_at: Optional[datetime] = None
     optimal_f: float
+    optimal_f_curve: List[dict] = [] # "Холм прибыли": [{"f": ..., "twr": ..., "geometric_mean": ...}]
     sqn: Optional[dict] = None
     z_score: Optional[dict] = None
     profit_factor: float = 0
@@ -60,5 +108,89 @@ class DashboardStats(BaseModel):
     recovery_factor: float = 0
     ahpr: float = 0
     mae_mfe_analysis: Optional[dict] = None
-    equity_curve: List[dict] = [] # Данные для графика: [{"date": "...", "balance": ...}]
     tag_stats: List[dict] = [] # Статистика по тегам: [{"tag": "...", "pnl": ..., "win_rate": ...}]
+
+class EquityPoint(BaseModel):
+    date: str # "YYYY-MM-DD HH:MM"
+    balance: float
+
+class EquityCurve(BaseModel):
+    points: List[EquityPoint] = []
+    total_points: int = 0 # Точек до прореживания (закрытых сделок)
+    method: Optional[str] = None # lttb / minmax; None — кривая отдана целиком
+
+class RollingPoint(BaseModel):
+    date: str
+    trade: int # Номер сделки (по времени закрытия), которой заканчивается окно
+    sqn: float
+    expectancy: float # Средний PnL сделки в окне
+    win_rate: float
+    profit_factor: float
+    drawdown: float # Просадка от пика всей истории на момент сделки
+
+class RollingStats(BaseModel):
+    window: int
+    points: List[RollingPoint] = []
+    total_points: int = 0 # Полных окон до прореживания
+    method: Optional[str] = None # minmax по просадке; None — ряд отдан целиком
+
+class CalendarDay(BaseModel):
+    date: str # YYYY-MM-DD
+    pnl: float
+    trades: int
+    wins: int
+
+class CalendarStats(BaseModel):
+    date_from: str
+    date_to: str
+    total_pnl: float = 0
+    trading_days: int = 0
+    winning_days: int = 0
+    losing_days: int = 0
+    days: List[CalendarDay] = [] # Только дни с закрытыми сделками
+
+class Insight(BaseModel):
+    dimensions: List[str] # weekday, hour, symbol, direction, setup_name, timeframe, news_event, tag
+    values: List[str]
+    trades: int
+    total_pnl: float
+    expectancy: float # Средний PnL сделки в ячейке
+    rest_expectancy: float # Средний PnL остальных сделок
+    win_rate: float
+    t_stat: float # t-статистика Уэлча (ячейка против остальных)
+    message: str
+
+class Insights(BaseModel):
+    total_trades: int = 0
+    insights: List[Insight] = [] # По убыванию |t_stat|
+
+class WhatIfMetrics(BaseModel):
+    total_pnl: float = 0
+    win_rate: float = 0
+    expectancy_r: float = 0
+    sqn: float = 0
+    profit_factor: float = 0
+    max_drawdown: float = 0
+
+class WhatIfScenario(WhatIfMetrics):
+    stop_r: Optional[float] = None # Стоп в R от входа; None — как в сделке
+    target_r: Optional[float] = None # Цель в R; None — без цели
+    breakeven_r: Optional[float] = None # Перенос стопа в безубыток после движения на N R
+
+class WhatIfStats(BaseModel):
+    n_trades: int = 0 # Сделок со стопом, MAE и MFE
+    skipped_trades: int = 0
+    baseline: Optional[WhatIfMetrics] = None # Фактический результат тех же сделок
+    best: Optional[WhatIfScenario] = None # Сценарий с наибольшим PnL
+    scenarios: List[WhatIfScenario] = []
+    message: Optional[str] = None
+
+class MonteCarloStats(BaseModel):
+    n_paths: int = 0
+    n_trades: int = 0
+    risk_pct: float = 0
+    risk_of_ruin: float = 0 # % путей, где просадка достигла порога разорения
+    probability_of_loss: float = 0 # % путей, закончившихся в минусе
+    return_percentiles: dict = {} # {"p5": ..., "p50": ..., "p95": ...} в % к депозиту
+    drawdown_percentiles: dict = {} # Максимальная просадка по путям в %
+    message: Optional[str] = None
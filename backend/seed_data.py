@@ -1,13 +1,33 @@
-import sqlite3
 from datetime import datetime, timedelta
 import random
 import json
+import os
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.orm import Session
+import stats_service
+
+# База из DATABASE_URL (sqlite:///путь), иначе atom.db рядом со скриптом
+DATABASE_URL = os.getenv("DATABASE_URL", "")
+DB_PATH = (
+    DATABASE_URL[len("sqlite:///"):] if DATABASE_URL.startswith("sqlite:///")
+    else os.path.join(os.path.dirname(os.path.abspath(__file__)), "atom.db")
+)
 
 def seed_db():
-    conn = sqlite3.connect('/workspaces/ATOM/backend/atom.db')
-    cursor = conn.cursor()
+    # Сид пишет SQL напрямую (sqlite3-курсор), но через соединение сессии SQLAlchemy:
+    # версия статистики поднимается bump_stats_version в той же транзакции
+    db = Session(create_engine(f"sqlite:///{DB_PATH}"))
+    cursor = db.connection().connection.dbapi_connection.cursor()
+
+    # Счета, чья статистика меняется: все, у кого были сделки или снимок, и счет сида
+    accounts = {1} | {row[0] for row in cursor.execute("SELECT DISTINCT account_id FROM trades")}
+    has_stats = inspect(db.connection()).has_table("account_stats")
+    if has_stats:
+        accounts |= {row[0] for row in cursor.execute("SELECT account_id FROM account_stats")}
 
     # Очистим старые данные для чистого теста
+    cursor.execute("DELETE FROM trade_tags")
+    cursor.execute("DELETE FROM daily_pnl")
     cursor.execute("DELETE FROM trades")
     
     symbols = ["BTC/USDT", "ETH/USDT", "SOL/USDT", "AAPL", "TSLA", "NVDA"]
@@ -68,9 +88,27 @@ def seed_db():
         ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
     """, trades_to_add)
 
-    conn.commit()
+    # Нормализованные теги (теги сида — латиница, так что lower() в SQLite подходит)
+    cursor.execute("""
+        INSERT OR IGNORE INTO trade_tags (trade_id, account_id, tag)
+        SELECT trades.id, trades.account_id, lower(json_each.value) FROM trades, json_each(trades.tags)
+    """)
+
+    # Дневной PnL для календаря
+    cursor.execute("""
+        INSERT INTO daily_pnl (account_id, day, pnl, trades, wins)
+        SELECT account_id, date(coalesce(exit_at, entry_at)), sum(pnl), count(*), sum(pnl > 0)
+        FROM trades WHERE pnl IS NOT NULL GROUP BY account_id, date(coalesce(exit_at, entry_at))
+    """)
+
+    # Сохраненные снимки статистики устарели (таблицы нет, если API еще не запускался)
+    if has_stats:
+        for account_id in sorted(account for account in accounts if account is not None):
+            stats_service.bump_stats_version(db, account_id)
+
+    db.commit()
     print(f"Successfully seeded {len(trades_to_add)} trades.")
-    conn.close()
+    db.close()
 
 if __name__ == "__main__":
     seed_db()
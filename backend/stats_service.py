@@ -0,0 +1,351 @@
+import datetime
+import numpy as np
+from typing import Dict, List, Optional
+from sqlalchemy import func, case, cast, Float
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+import models
+import analytics
+import trade_frame
+import metrics
+import downsampling
+import patterns
+import rolling
+
+# Кэш снапшотов в памяти процесса: {(account_id, version): stats}
+# Ключ версионирован, поэтому инвалидация не нужна — старые версии просто вытесняются
+_snapshot_cache: Dict[tuple, Dict] = {}
+_SNAPSHOT_CACHE_SIZE = 128
+# Кривые эквити кэшируются так же: {(account_id, version, max_points, method): curve}
+_curve_cache: Dict[tuple, Dict] = {}
+# Скользящие метрики: {(account_id, version, window, max_points): series}
+_rolling_cache: Dict[tuple, Dict] = {}
+# Кубы паттернов: {(account_id, version): PatternCube}
+_cube_cache: Dict[tuple, patterns.PatternCube] = {}
+
+# Точек кривой эквити по умолчанию (график все равно не покажет больше)
+EQUITY_CURVE_POINTS = 1000
+
+def bump_stats_version(db: Session, account_id: int) -> None:
+    """
+    Помечает статистику счета устаревшей (вызывать при любом изменении сделок).
+    Выполняется в той же транзакции, что и изменение сделок.
+    """
+    table = models.AccountStats.__table__
+    stmt = _insert(db)(table).values(account_id=account_id, version=1)
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=[table.c.account_id],
+        set_={"version": table.c.version + 1},
+    ))
+
+def _insert(db: Session):
+    # INSERT ... ON CONFLICT есть в обоих диалектах, но строится разными конструкторами
+    return pg_insert if db.get_bind().dialect.name == "postgresql" else sqlite_insert
+
+def get_stats_version(db: Session, account_id: int) -> int:
+    version = db.query(models.AccountStats.version).filter(
+        models.AccountStats.account_id == account_id
+    ).scalar()
+    return version or 0
+
+def get_dashboard_stats(db: Session, account_id: int, write_db: Optional[Session] = None) -> Dict:
+    """
+    Возвращает статистику дашборда, пересчитывая ее только если набор сделок изменился.
+    Порядок поиска: кэш в памяти -> снапшот в БД -> полный пересчет.
+    Чтение и расчет идут через db, новый снапшот сохраняется через write_db
+    (по умолчанию тот же db; для read-only сессии передается сессия записи).
+    """
+    version = get_stats_version(db, account_id)
+    cache_key = (account_id, version)
+
+    cached = _snapshot_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    row = db.get(models.AccountStats, account_id)
+    if row is not None and row.snapshot is not None and row.snapshot_version == version:
+        stats = row.snapshot
+    else:
+        stats = compute_dashboard_stats(db, account_id)
+        _save_snapshot(write_db or db, account_id, version, stats)
+
+    if len(_snapshot_cache) >= _SNAPSHOT_CACHE_SIZE:
+        _snapshot_cache.pop(next(iter(_snapshot_cache)))
+    _snapshot_cache[cache_key] = stats
+    return stats
+
+def _save_snapshot(db: Session, account_id: int, version: int, stats: Dict) -> None:
+    """
+    Один upsert: строка счета создается, если ее нет, а существующая обновляется
+    только если за время расчета сделки не изменились (version не сдвинулась).
+    Параллельные первые снапшоты не конфликтуют на вставке.
+    """
+    table = models.AccountStats.__table__
+    stmt = _insert(db)(table).values(
+        account_id=account_id, version=version, snapshot_version=version,
+        snapshot=stats, updated_at=datetime.datetime.utcnow(),
+    )
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=[table.c.account_id],
+        set_={
+            "snapshot": stmt.excluded.snapshot,
+            "snapshot_version": stmt.excluded.snapshot_version,
+            "updated_at": stmt.excluded.updated_at,
+        },
+        where=table.c.version == stmt.excluded.version,
+    ))
+    db.commit()
+
+def _closed_trades_filter(account_id: int):
+    return (models.Trade.account_id == account_id, models.Trade.pnl != None)
+
+def query_trade_aggregates(db: Session, account_id: int) -> Dict:
+    """
+    Простые агрегаты по закрытым сделкам, посчитанные в БД одним запросом:
+    сумма PnL, количество сделок, количество прибыльных, даты первой и последней сделки.
+    """
+    pnl = cast(models.Trade.pnl, Float)
+    row = db.query(
+        func.count(models.Trade.id),
+        func.sum(pnl),
+        func.sum(case((models.Trade.pnl > 0, 1), else_=0)),
+        func.min(models.Trade.entry_at),
+        func.max(func.coalesce(models.Trade.exit_at, models.Trade.entry_at)),
+    ).filter(*_closed_trades_filter(account_id)).one()
+
+    total_trades, total_pnl, profitable_trades, first_at, last_at = row
+    return {
+        "total_trades": total_trades or 0,
+        "total_pnl": float(total_pnl or 0),
+        "profitable_trades": int(profitable_trades or 0),
+        # Снапшот хранится в JSON-колонке, поэтому даты сразу в ISO-строках
+        "first_trade_at": first_at.isoformat() if first_at else None,
+        "last_trade_at": last_at.isoformat() if last_at else None,
+    }
+
+def query_tag_stats(db: Session, account_id: int) -> List[Dict]:
+    """
+    Статистика по тегам: GROUP BY по нормализованной таблице trade_tags
+    (индекс account_id, tag), теги в ней уже в нижнем регистре.
+    """
+    pnl = cast(models.Trade.pnl, Float)
+    rows = db.query(
+        models.TradeTag.tag,
+        func.sum(pnl),
+        func.count(),
+        func.sum(case((models.Trade.pnl > 0, 1), else_=0)),
+    ).join(models.Trade, models.Trade.id == models.TradeTag.trade_id).filter(
+        models.TradeTag.account_id == account_id,
+        *_closed_trades_filter(account_id)
+    ).group_by(models.TradeTag.tag).all()
+
+    tag_stats = []
+    for tag, tag_pnl, total, wins in rows:
+        tag_stats.append({
+            "tag": tag,
+            "pnl": round(float(tag_pnl or 0), 2),
+            "win_rate": round((int(wins or 0) / total) * 100, 1),
+            "count": total
+        })
+    # Сортируем по PnL (от лучших к худшим)
+    return sorted(tag_stats, key=lambda x: x["pnl"], reverse=True)
+
+def compute_dashboard_stats(db: Session, account_id: int) -> Dict:
+    """
+    Полный пересчет статистики дашборда по закрытым сделкам счета.
+    Простые агрегаты считаются в БД, аналитика работает с колоночным TradeFrame.
+    """
+    # Каждый этап пишется в atom_stage_duration_seconds{stage="stats.*"}
+    with metrics.stage("stats.aggregates"):
+        aggregates = query_trade_aggregates(db, account_id)
+
+    total_trades = aggregates["total_trades"]
+    if total_trades == 0:
+        return {
+            "total_pnl": 0,
+            "win_rate": 0,
+            "total_trades": 0,
+            "profitable_trades": 0,
+            "optimal_f": 0
+        }
+
+    total_pnl = aggregates["total_pnl"]
+    profitable_trades = aggregates["profitable_trades"]
+    win_rate = (profitable_trades / total_trades) * 100
+
+    # Колоночная выборка: только числовые колонки, без ORM-объектов и Decimal
+    with metrics.stage("stats.load_frame"):
+        frame = trade_frame.load_trade_frame(db, account_id)
+        pnls = frame.pnl
+        risks = frame.risk
+
+    # Расчет Optimal f
+    with metrics.stage("stats.optimal_f"):
+        opt_f_data = analytics.calculate_optimal_f(pnls, risks)
+
+    # Расчет SQN
+    with metrics.stage("stats.sqn"):
+        sqn_data = analytics.calculate_sqn(pnls, risks)
+
+    # Расчет Z-Score
+    with metrics.stage("stats.z_score"):
+        z_score_data = analytics.calculate_z_score(pnls)
+
+    # Расчет Advanced Stats
+    with metrics.stage("stats.advanced_stats"):
+        adv_stats = analytics.calculate_advanced_stats(pnls, risks)
+
+    # Анализ MAE/MFE
+    with metrics.stage("stats.mae_mfe"):
+        mae_mfe_data = analytics.analyze_mae_mfe(frame)
+
+    # Расчет статистики по тегам
+    with metrics.stage("stats.tag_stats"):
+        tag_stats = query_tag_stats(db, account_id)
+
+    return {
+        "total_pnl": total_pnl,
+        "win_rate": win_rate,
+        "total_trades": total_trades,
+        "profitable_trades": profitable_trades,
+        "first_trade_at": aggregates["first_trade_at"],
+        "last_trade_at": aggregates["last_trade_at"],
+        "optimal_f": opt_f_data.get("optimal_f", 0),
+        "optimal_f_curve": opt_f_data.get("twr_curve", []),
+        "sqn": sqn_data,
+        "z_score": z_score_data,
+        "profit_factor": adv_stats.get("profit_factor", 0),
+        "r_expectancy": adv_stats.get("r_expectancy", 0),
+        "recovery_factor": adv_stats.get("recovery_factor", 0),
+        "ahpr": opt_f_data.get("geometric_mean", 0), # Используем Geometric Mean как AHPR
+        "mae_mfe_analysis": mae_mfe_data,
+        "tag_stats": tag_stats
+    }
+
+def _format_minutes(timestamps: np.ndarray) -> np.ndarray:
+    # Секунды Unix -> "YYYY-MM-DD HH:MM" (np.char падает на пустом массиве)
+    if len(timestamps) == 0:
+        return np.array([], dtype=str)
+    return np.char.replace(
+        np.datetime_as_string(timestamps.astype("datetime64[s]"), unit="m"), "T", " "
+    )
+
+def get_equity_curve(db: Session, account_id: int, max_points: int = EQUITY_CURVE_POINTS,
+                     method: str = downsampling.LTTB) -> Dict:
+    """
+    Кривая эквити счета, прореженная до max_points точек.
+    Пересчитывается только после изменения сделок (тот же ключ версии, что у снапшота).
+    """
+    cache_key = (account_id, get_stats_version(db, account_id), max_points, method)
+    cached = _curve_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    curve = compute_equity_curve(db, account_id, max_points, method)
+    if len(_curve_cache) >= _SNAPSHOT_CACHE_SIZE:
+        _curve_cache.pop(next(iter(_curve_cache)))
+    _curve_cache[cache_key] = curve
+    return curve
+
+def compute_equity_curve(db: Session, account_id: int, max_points: int = EQUITY_CURVE_POINTS,
+                         method: str = downsampling.LTTB) -> Dict:
+    """
+    Баланс после каждой закрытой сделки (накопленный PnL), прореженный с сохранением формы:
+    LTTB или min/max по корзинам (просадки не сглаживаются). Даты форматируются
+    только для оставшихся точек.
+    """
+    with metrics.stage("stats.equity_curve"):
+        # Сделки упорядочены по времени закрытия
+        timestamps, pnls = trade_frame.load_equity_series(db, account_id)
+        balances = np.cumsum(pnls)
+        total_points = len(balances)
+
+        downsampled = total_points > max_points
+        if downsampled:
+            indices = downsampling.downsample_indices(timestamps, balances, max_points, method)
+            balances = balances[indices]
+            timestamps = timestamps[indices]
+
+        dates = _format_minutes(timestamps)
+        points = [
+            {"date": date, "balance": balance}
+            for date, balance in zip(dates.tolist(), np.round(balances, 2).tolist())
+        ]
+    return {
+        "points": points,
+        "total_points": total_points,
+        "method": method if downsampled else None,
+    }
+
+def get_rolling_metrics(db: Session, account_id: int, window: int = rolling.DEFAULT_WINDOW,
+                        max_points: int = EQUITY_CURVE_POINTS) -> Dict:
+    # Кэшируется по версии статистики, как кривая эквити
+    cache_key = (account_id, get_stats_version(db, account_id), window, max_points)
+    cached = _rolling_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    result = compute_rolling_metrics(db, account_id, window, max_points)
+    if len(_rolling_cache) >= _SNAPSHOT_CACHE_SIZE:
+        _rolling_cache.pop(next(iter(_rolling_cache)))
+    _rolling_cache[cache_key] = result
+    return result
+
+def compute_rolling_metrics(db: Session, account_id: int, window: int = rolling.DEFAULT_WINDOW,
+                            max_points: int = EQUITY_CURVE_POINTS) -> Dict:
+    """
+    Скользящие SQN, матожидание, win rate, profit factor и просадка по закрытым сделкам
+    (см. rolling.compute_rolling). Длинные ряды прореживаются min/max по просадке,
+    остальные метрики берутся в тех же точках.
+    """
+    with metrics.stage("stats.rolling"):
+        frame = trade_frame.load_trade_frame(db, account_id)
+        series = rolling.compute_rolling(frame.pnl, frame.risk, window)
+        total_points = len(series["drawdown"])
+        timestamps = frame.close_ts[window - 1:]
+        trade_numbers = np.arange(window, len(frame) + 1)
+
+        downsampled = total_points > max_points
+        if downsampled:
+            indices = downsampling.minmax_indices(series["drawdown"], max_points)
+            series = {name: values[indices] for name, values in series.items()}
+            timestamps = timestamps[indices]
+            trade_numbers = trade_numbers[indices]
+
+        dates = _format_minutes(timestamps)
+        # + 0.0 убирает -0.0 после округления
+        columns = {name: (np.round(values, 2) + 0.0).tolist() for name, values in series.items()}
+        points = [
+            {"date": date, "trade": trade, **dict(zip(columns, values))}
+            for date, trade, values in zip(dates.tolist(), trade_numbers.tolist(), zip(*columns.values()))
+        ]
+    return {
+        "window": window,
+        "points": points,
+        "total_points": total_points,
+        "method": downsampling.MINMAX if downsampled else None,
+    }
+
+def get_insights(db: Session, account_id: int, min_trades: int = patterns.MIN_TRADES,
+                 min_t: float = patterns.MIN_T_STAT, limit: int = 20) -> Dict:
+    """
+    Значимые паттерны ("ты теряешь по пятницам"): ячейки куба patterns.PatternCube,
+    где матожидание заметно отличается от остальных сделок.
+    Куб собирается один раз на версию статистики, ранжирование по нему дешевое.
+    """
+    cache_key = (account_id, get_stats_version(db, account_id))
+    cube = _cube_cache.get(cache_key)
+    if cube is None:
+        with metrics.stage("stats.pattern_cube"):
+            cube = patterns.load_pattern_cube(db, account_id)
+        if len(_cube_cache) >= _SNAPSHOT_CACHE_SIZE:
+            _cube_cache.pop(next(iter(_cube_cache)))
+        _cube_cache[cache_key] = cube
+
+    with metrics.stage("stats.insights"):
+        insights = patterns.rank_insights(cube, min_trades, min_t, limit)
+    return {
+        "total_trades": int(cube.total[patterns.COUNT]),
+        "insights": insights,
+    }
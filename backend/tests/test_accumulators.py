@@ -0,0 +1,131 @@
+import random
+from datetime import datetime
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+import accumulators
+import analytics
+import trade_frame
+
+def make_trade(pnl, risk_amount=None, entry_price=100.0, stop_loss=95.0,
+               mae_price=97.0, mfe_price=106.0, closed=True):
+    return SimpleNamespace(
+        pnl=pnl, risk_amount=risk_amount, entry_price=entry_price, stop_loss=stop_loss,
+        mae_price=mae_price, mfe_price=mfe_price, exit_at=datetime(2024, 1, 1) if closed else None,
+    )
+
+def random_trades(n, seed):
+    # Смесь прибыльных, убыточных, нулевых и открытых сделок, часть без риска, стопа и MAE
+    rng = random.Random(seed)
+    trades = []
+    for _ in range(n):
+        entry = rng.uniform(50, 150)
+        trades.append(make_trade(
+            pnl=None if rng.random() < 0.05 else (0.0 if rng.random() < 0.05 else rng.gauss(20, 100)),
+            risk_amount=None if rng.random() < 0.1 else rng.uniform(10, 200),
+            entry_price=entry,
+            stop_loss=None if rng.random() < 0.1 else entry * rng.uniform(0.9, 0.99),
+            mae_price=None if rng.random() < 0.1 else entry * rng.uniform(0.9, 1.0),
+            mfe_price=entry * rng.uniform(1.0, 1.2),
+            closed=rng.random() > 0.05,
+        ))
+    return trades
+
+def _nan(value):
+    return np.nan if value is None else float(value)
+
+def batch_result(trades):
+    # Те же статистики пакетными функциями analytics (как в stats_service)
+    closed = [trade for trade in trades if trade.pnl is not None]
+    pnl = np.array([float(trade.pnl) for trade in closed])
+    risk = np.array([accumulators.trade_risk(trade) for trade in closed])
+    frame = trade_frame.TradeFrame(np.array([
+        [i, float(trade.pnl), _nan(trade.risk_amount), _nan(trade.entry_price), np.nan,
+         _nan(trade.stop_loss), _nan(trade.mae_price), _nan(trade.mfe_price), 1.0, 0.0, 0.0,
+         trade_frame.FLAG_CLOSED if trade.exit_at is not None else 0]
+        for i, trade in enumerate(closed)
+    ], dtype=np.float64))
+    return {
+        "sqn": analytics.calculate_sqn(pnl, risk),
+        "z_score": analytics.calculate_z_score(pnl),
+        "advanced": analytics.calculate_advanced_stats(pnl, risk),
+        "mae_mfe": analytics.analyze_mae_mfe(frame),
+    }
+
+def sequential_result(trades):
+    acc = accumulators.TradeStatsAccumulator()
+    for trade in trades:
+        acc.update(trade)
+    return acc.result()
+
+def merged_result(trades, cuts):
+    # Части по границам cuts объединяются в хронологическом порядке
+    merged = accumulators.TradeStatsAccumulator()
+    bounds = [0, *cuts, len(trades)]
+    for start, end in zip(bounds, bounds[1:]):
+        part = accumulators.TradeStatsAccumulator()
+        for trade in trades[start:end]:
+            part.update(trade)
+        merged.merge(part)
+    return merged.result()
+
+def assert_matches_batch(trades, cuts):
+    expected = batch_result(trades)
+    assert sequential_result(trades) == expected
+    assert merged_result(trades, cuts) == expected
+
+@pytest.mark.parametrize("n", [2, 5, 29, 31, 100, 2000])
+@pytest.mark.parametrize("seed", range(3))
+def test_random_trades_match_batch(n, seed):
+    trades = random_trades(n, seed)
+    cuts = sorted(random.Random(seed).sample(range(n + 1), min(4, n + 1)))
+    assert_matches_batch(trades, cuts)
+
+def test_empty():
+    assert_matches_batch([], [])
+    # Пустые части при объединении ничего не меняют
+    assert merged_result([], [0, 0]) == batch_result([])
+
+def test_one_trade():
+    trades = [make_trade(50.0, risk_amount=25.0)]
+    assert_matches_batch(trades, [0])
+    assert_matches_batch(trades, [1])
+
+def test_all_wins():
+    trades = [make_trade(10.0 + i, risk_amount=20.0) for i in range(40)]
+    assert_matches_batch(trades, [7, 20, 33])
+    assert sequential_result(trades)["z_score"]["z_score"] == 0
+
+def test_all_losses():
+    trades = [make_trade(-10.0 - i, risk_amount=20.0) for i in range(40)]
+    assert_matches_batch(trades, [7, 20, 33])
+    assert sequential_result(trades)["z_score"]["z_score"] == 0
+    assert sequential_result(trades)["advanced"]["profit_factor"] == 0
+
+def test_open_trades_are_ignored():
+    trades = random_trades(50, 7)
+    with_open = trades + [make_trade(None, closed=False) for _ in range(5)]
+    assert sequential_result(with_open) == sequential_result(trades)
+
+@pytest.mark.parametrize("r", [0.1, 0.7, 2.2])
+def test_constant_r_has_zero_std(r):
+    # np.std одинаковых R дает ~1e-17, а Уэлфорд — 0: обе ветки должны видеть нулевое отклонение
+    trades = [make_trade(r * 40.0, risk_amount=40.0) for _ in range(7)]
+    expected = {"sqn": 0, "rating": "Стабильно (StdDev=0)"}
+    assert batch_result(trades)["sqn"] == expected
+    assert sequential_result(trades)["sqn"] == expected
+    assert merged_result(trades, [3, 5])["sqn"] == expected
+
+def test_welford_merge_matches_numpy():
+    values = np.random.default_rng(0).normal(1.5, 3.0, 1001)
+    left, right = accumulators.Welford(), accumulators.Welford()
+    for x in values[:400]:
+        left.update(x)
+    for x in values[400:]:
+        right.update(x)
+    left.merge(right)
+    assert left.count == len(values)
+    assert left.mean == pytest.approx(np.mean(values))
+    assert left.std(ddof=1) == pytest.approx(np.std(values, ddof=1))
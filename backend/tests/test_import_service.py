@@ -0,0 +1,34 @@
+import io
+from datetime import datetime
+
+import import_service
+
+def test_generic_csv_mixed_timezones():
+    # Даты без зоны и с зоной в одной колонке: с зоной приводятся к UTC без tzinfo
+    contents = (
+        "date,symbol,side,price,quantity,pnl\n"
+        "2024-02-01 10:00:00,AAA,BUY,10,1,5\n"
+        "2024-02-03T10:00:00Z,BBB,SELL,20,2,-3\n"
+        "2024-02-04T10:00:00+03:00,CCC,BUY,30,1,1\n"
+        "01/02/2024 10:00,DDD,BUY,40,1,2\n"
+    ).encode()
+    trades = import_service.parse_trade_file(contents, "trades.csv")
+    assert [trade["entry_at"] for trade in trades] == [
+        datetime(2024, 2, 1, 10, 0),
+        datetime(2024, 2, 3, 10, 0),
+        datetime(2024, 2, 4, 7, 0),
+        datetime(2024, 1, 2, 10, 0),
+    ]
+    assert all(trade["entry_at"].tzinfo is None for trade in trades)
+
+def test_generic_csv_reports_invalid_dates():
+    contents = (
+        "date,symbol,side,price,quantity,pnl\n"
+        "2024-02-01 10:00:00,AAA,BUY,10,1,5\n"
+        "not a date,BBB,BUY,20,1,5\n"
+    ).encode()
+    errors = import_service.new_error_report()
+    chunks = import_service.iter_trade_file_chunks(io.BytesIO(contents), "trades.csv", errors)
+    trades = [trade for chunk in chunks for trade in chunk]
+    assert [trade["symbol"] for trade in trades] == ["AAA"]
+    assert errors == {"count": 1, "rows": [{"line": 3, "error": "invalid date"}]}
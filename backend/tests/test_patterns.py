@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+
+import patterns
+
+def make_trades(pnls, symbol="AAA"):
+    # Кадр сделок в формате PatternCube.add: pnl и измерения, индекс — id сделки
+    n = len(pnls)
+    return pd.DataFrame({
+        "pnl": np.asarray(pnls, dtype=np.float64),
+        "direction": ["long"] * n,
+        "symbol": [symbol] * n,
+        "setup_name": [None] * n,
+        "timeframe": ["H1"] * n,
+        "news_event": [None] * n,
+        "weekday": pd.array([4] * n, dtype="Int64"),
+        "hour": pd.array([10] * n, dtype="Int64"),
+    }, index=pd.Index(range(1, n + 1), name="id"))
+
+def make_tags(pairs):
+    return pd.DataFrame(pairs, columns=["trade_id", "tag"])
+
+def insight(insights, dimensions, values):
+    return next(i for i in insights if i["dimensions"] == dimensions and i["values"] == values)
+
+def test_tag_insights_compare_against_distinct_trades():
+    # 20 убыточных сделок с тегами a и b, 20 прибыльных с тегом c
+    pnls = [-10.0 + (i % 5 - 2) for i in range(20)] + [10.0 + (i % 5 - 2) for i in range(20)]
+    trades = make_trades(pnls)
+    tags = make_tags(
+        [(trade_id, tag) for trade_id in range(1, 21) for tag in ("a", "b")]
+        + [(trade_id, "c") for trade_id in range(21, 41)]
+    )
+    cube = patterns.PatternCube().add(trades, tags)
+    insights = patterns.rank_insights(cube, min_trades=1, min_t=0, limit=1000)
+
+    # Остальные для a — только 20 прибыльных сделок (не 40 с повторным счетом и самими a)
+    a = insight(insights, ["tag"], ["a"])
+    assert a["trades"] == 20
+    assert a["rest_expectancy"] == 10.0
+    losers, winners = np.array(pnls[:20]), np.array(pnls[20:])
+    expected_t = (losers.mean() - winners.mean()) / np.sqrt(
+        losers.var(ddof=1) / 20 + winners.var(ddof=1) / 20
+    )
+    assert a["t_stat"] == round(float(expected_t), 2)
+    assert insight(insights, ["tag"], ["c"])["rest_expectancy"] == -10.0
+
+    # Пара (symbol, tag): остальные — сделки символа без тега c (в выдачу пара не попадает,
+    # так как не значимее тега c, поэтому проверяем сам расчет)
+    grouping = ("symbol", "tag")
+    labels, stats = cube.grouping_table(grouping)
+    total = patterns._grouping_total(cube, grouping, stats)
+    assert total[patterns.COUNT] == 40
+    _, _, mean_rest = patterns._welch_t(stats, total)
+    assert mean_rest[labels.index(("AAA", "c"))] == -10.0
+
+def test_add_then_subtract_returns_empty_cube():
+    trades = make_trades([5.0, -3.0, 7.0, 0.0])
+    tags = make_tags([(1, "a"), (1, "b"), (3, "a")])
+    cube = patterns.PatternCube().add(trades, tags)
+    assert cube.cells[("tag",)]
+    cube.add(trades, tags, sign=-1)
+    assert all(not cells for cells in cube.cells.values())
+    assert cube.total[patterns.COUNT] == 0
+
+def test_subtract_from_empty_cube_stores_no_negative_cells():
+    cube = patterns.PatternCube().add(make_trades([5.0, -3.0]), make_tags([(1, "a")]), sign=-1)
+    assert all(not cells for cells in cube.cells.values())
+    merged = patterns.PatternCube().merge(cube)
+    assert all(not cells for cells in merged.cells.values())
+
+def test_chunked_merge_matches_single_pass():
+    rng = np.random.default_rng(0)
+    trades = make_trades(rng.normal(0, 50, 200))
+    trades["symbol"] = rng.choice(["AAA", "BBB", "CCC"], 200)
+    tags = make_tags([(trade_id, tag) for trade_id in range(1, 201) for tag in ("x", "y") if rng.random() < 0.4])
+    full = patterns.PatternCube().add(trades, tags)
+    chunked = patterns.PatternCube()
+    for start in range(0, 200, 70):
+        part = trades.iloc[start:start + 70]
+        chunked.merge(patterns.PatternCube().add(part, tags[tags["trade_id"].isin(part.index)]))
+    for grouping in patterns.GROUPINGS:
+        assert full.cells[grouping].keys() == chunked.cells[grouping].keys()
+        for labels, stats in full.cells[grouping].items():
+            assert np.allclose(stats, chunked.cells[grouping][labels])
@@ -0,0 +1,122 @@
+import numpy as np
+from sqlalchemy import select, func, case, cast, Float, Integer, BigInteger
+from sqlalchemy.orm import Session
+import models
+import metrics
+
+# Биты в TradeFrame.flags
+FLAG_LONG = 1
+FLAG_CLOSED = 2
+
+# Значение для отсутствующей метки времени (аналог NaT)
+NO_TIMESTAMP = np.iinfo(np.int64).min
+
+def _epoch_seconds(column, dialect_name: str):
+    """
+    Unix-время колонки DateTime, посчитанное в БД (без парсинга datetime в Python).
+    """
+    if dialect_name == "postgresql":
+        return cast(func.extract("epoch", column), BigInteger)
+    return cast(func.strftime("%s", column), Integer)
+
+class TradeFrame:
+    """
+    Сделки в колоночном виде (struct-of-arrays) для аналитики.
+    Цены и суммы — float64 (NaN вместо NULL), время — int64 секунды Unix.
+    """
+
+    def __init__(self, data: np.ndarray):
+        # data: матрица float64 в порядке колонок _FRAME_COLUMNS
+        data = data.reshape(-1, len(_FRAME_COLUMNS))
+        self.id = data[:, 0].astype(np.int64)
+        self.pnl = data[:, 1]
+        self.risk_amount = data[:, 2]
+        self.entry_price = data[:, 3]
+        self.exit_price = data[:, 4]
+        self.stop_loss = data[:, 5]
+        self.mae_price = data[:, 6]
+        self.mfe_price = data[:, 7]
+        self.quantity = data[:, 8]
+        self.entry_ts = np.where(np.isnan(data[:, 9]), NO_TIMESTAMP, data[:, 9]).astype(np.int64)
+        self.exit_ts = np.where(np.isnan(data[:, 10]), NO_TIMESTAMP, data[:, 10]).astype(np.int64)
+        self.flags = data[:, 11].astype(np.uint8)
+
+    def __len__(self):
+        return len(self.id)
+
+    @property
+    def is_long(self) -> np.ndarray:
+        return (self.flags & FLAG_LONG) != 0
+
+    @property
+    def is_closed(self) -> np.ndarray:
+        return (self.flags & FLAG_CLOSED) != 0
+
+    @property
+    def close_ts(self) -> np.ndarray:
+        # Время события для кривой эквити: выход, а если его нет — вход
+        return np.where(self.exit_ts != NO_TIMESTAMP, self.exit_ts, self.entry_ts)
+
+    @property
+    def risk(self) -> np.ndarray:
+        # Риск сделки: risk_amount, а если он не задан — модуль PnL
+        has_risk = np.nan_to_num(self.risk_amount) != 0
+        return np.where(has_risk, self.risk_amount, np.abs(self.pnl))
+
+_FRAME_COLUMNS = (
+    "id", "pnl", "risk_amount", "entry_price", "exit_price", "stop_loss",
+    "mae_price", "mfe_price", "quantity", "entry_ts", "exit_ts", "flags",
+)
+
+def load_trade_frame(db: Session, account_id: int, closed_only: bool = True) -> TradeFrame:
+    """
+    Загружает сделки счета одним Core-запросом в TradeFrame.
+    Numeric-колонки приводятся к float в БД, поэтому Decimal и ORM-объекты не создаются.
+    Сделки упорядочены по времени закрытия (затем по id).
+    """
+    t = models.Trade
+    dialect_name = db.get_bind().dialect.name
+    close_at = func.coalesce(t.exit_at, t.entry_at)
+
+    stmt = select(
+        t.id,
+        cast(t.pnl, Float),
+        cast(t.risk_amount, Float),
+        cast(t.entry_price, Float),
+        cast(t.exit_price, Float),
+        cast(t.stop_loss, Float),
+        cast(t.mae_price, Float),
+        cast(t.mfe_price, Float),
+        cast(t.quantity, Float),
+        _epoch_seconds(t.entry_at, dialect_name),
+        _epoch_seconds(t.exit_at, dialect_name),
+        case((t.direction == models.TradeDirection.LONG, FLAG_LONG), else_=0)
+        + case((t.exit_at != None, FLAG_CLOSED), else_=0),
+    ).where(t.account_id == account_id).order_by(close_at, t.id)
+
+    if closed_only:
+        stmt = stmt.where(t.pnl != None)
+
+    # Core-выполнение через соединение сессии: без ORM-загрузчика строк
+    rows = db.connection().execute(stmt).all()
+    metrics.add_rows(len(rows))
+    # Одно преобразование в матрицу float64 вместо поэлементного float(): None -> NaN
+    return TradeFrame(np.array([tuple(row) for row in rows], dtype=np.float64))
+
+def load_equity_series(db: Session, account_id: int):
+    """
+    Только то, что нужно кривой эквити: время закрытия (int64 секунды Unix) и PnL
+    закрытых сделок в том же порядке, что и load_trade_frame.
+    """
+    t = models.Trade
+    close_at = func.coalesce(t.exit_at, t.entry_at)
+    stmt = (
+        select(_epoch_seconds(close_at, db.get_bind().dialect.name), cast(t.pnl, Float))
+        .where(t.account_id == account_id, t.pnl != None)
+        .order_by(close_at, t.id)
+    )
+    rows = db.connection().execute(stmt).all()
+    metrics.add_rows(len(rows))
+    data = np.array([tuple(row) for row in rows], dtype=np.float64).reshape(-1, 2)
+    timestamps = np.where(np.isnan(data[:, 0]), NO_TIMESTAMP, data[:, 0]).astype(np.int64)
+    return timestamps, data[:, 1]
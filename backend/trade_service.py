@@ -0,0 +1,147 @@
+import base64
+import json
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import select, tuple_, insert, delete
+from sqlalchemy.orm import Session
+import models
+import schemas
+import metrics
+
+# Поля, которые можно запросить через ?fields= (колонки trades, отдаваемые в списке)
+LIST_FIELDS = tuple(schemas.TradeListItem.model_fields)
+# Ключ сортировки нужен для курсора, поэтому эти поля выбираются всегда
+_CURSOR_FIELDS = ("entry_at", "id")
+
+def normalize_tags(tags: Optional[Iterable]) -> List[str]:
+    # Регистр сводим в Python: lower() в SQLite не понимает кириллицу
+    if not tags:
+        return []
+    return list(dict.fromkeys(str(tag).strip().lower() for tag in tags if str(tag).strip()))
+
+def tag_rows(trade_id: int, account_id: Optional[int], tags: Optional[Iterable]) -> List[Dict]:
+    return [{"trade_id": trade_id, "account_id": account_id, "tag": tag} for tag in normalize_tags(tags)]
+
+def insert_tag_rows(db: Session, rows: List[Dict]) -> None:
+    if rows:
+        db.connection().execute(insert(models.TradeTag.__table__), rows)
+
+def sync_trade_tags(db: Session, trade_id: int, account_id: Optional[int], tags: Optional[Iterable]) -> None:
+    """
+    Приводит trade_tags сделки в соответствие с Trade.tags (в той же транзакции).
+    """
+    delete_trade_tags(db, trade_id)
+    insert_tag_rows(db, tag_rows(trade_id, account_id, tags))
+
+def delete_trade_tags(db: Session, trade_id: int) -> None:
+    db.execute(delete(models.TradeTag).where(models.TradeTag.trade_id == trade_id))
+
+def backfill_trade_tags(db: Session, batch_size: int = 5000) -> int:
+    """
+    Миграция: заполняет trade_tags по Trade.tags, если таблица еще пустая
+    (один раз, см. database.run_data_migrations). Сделки читаются потоком
+    по batch_size, и каждая пачка сразу записывается. Возвращает число добавленных строк.
+    """
+    if db.query(models.TradeTag.trade_id).first() is not None:
+        return 0
+    t = models.Trade
+    stmt = select(t.id, t.account_id, t.tags).where(t.tags != None).order_by(t.id)
+    added = 0
+    for trades in db.execute(stmt.execution_options(yield_per=batch_size)).partitions():
+        rows = [row for trade_id, account_id, tags in trades for row in tag_rows(trade_id, account_id, tags)]
+        insert_tag_rows(db, rows)
+        added += len(rows)
+    db.commit()
+    return added
+
+def encode_cursor(entry_at: datetime, trade_id: int) -> str:
+    payload = json.dumps([entry_at.isoformat(), trade_id]).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """
+    Разбирает курсор (entry_at, id) последней полученной сделки.
+    Некорректный курсор -> ValueError.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        entry_at, trade_id = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.fromisoformat(entry_at), int(trade_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+def parse_fields(fields: Optional[str]) -> Optional[List[str]]:
+    """
+    Разбирает ?fields=id,symbol,pnl. None — все поля. Неизвестное поле -> ValueError.
+    """
+    if not fields:
+        return None
+    names = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = [name for name in names if name not in LIST_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {unknown}")
+    return names
+
+def list_trades(db: Session, limit: int, cursor: Optional[str] = None, fields: Optional[List[str]] = None,
+                account_id: Optional[int] = None, symbol: Optional[str] = None,
+                date_from: Optional[datetime] = None, date_to: Optional[datetime] = None,
+                status: Optional[str] = None, tag: Optional[str] = None,
+                descending: bool = False) -> Tuple[List, Optional[str]]:
+    """
+    Страница списка сделок с keyset-пагинацией по (entry_at, id).
+    Стоимость страницы не зависит от ее номера: следующая страница начинается
+    сразу за курсором по индексу, без OFFSET.
+    Возвращает (сделки, курсор следующей страницы или None).
+    При fields сделки — словари только с выбранными полями (плюс entry_at и id).
+    """
+    t = models.Trade
+    if fields is None:
+        stmt = select(t)
+    else:
+        names = list(dict.fromkeys([*fields, *_CURSOR_FIELDS]))
+        stmt = select(*(getattr(t, name) for name in names))
+
+    if account_id is not None:
+        stmt = stmt.where(t.account_id == account_id)
+    if symbol:
+        stmt = stmt.where(t.symbol == symbol)
+    if date_from:
+        stmt = stmt.where(t.entry_at >= date_from)
+    if date_to:
+        stmt = stmt.where(t.entry_at <= date_to)
+    if status == "open":
+        stmt = stmt.where(t.pnl == None)
+    elif status == "closed":
+        stmt = stmt.where(t.pnl != None)
+    if tag:
+        # По индексу trade_tags (tag, trade_id): читаются только сделки с этим тегом
+        tagged = select(models.TradeTag.trade_id).where(models.TradeTag.tag == tag.strip().lower())
+        if account_id is not None:
+            tagged = tagged.where(models.TradeTag.account_id == account_id)
+        stmt = stmt.where(t.id.in_(tagged))
+
+    key = tuple_(t.entry_at, t.id)
+    if cursor:
+        after = tuple_(*decode_cursor(cursor))
+        stmt = stmt.where(key < after if descending else key > after)
+    if descending:
+        stmt = stmt.order_by(t.entry_at.desc(), t.id.desc())
+    else:
+        stmt = stmt.order_by(t.entry_at, t.id)
+
+    # Берем на одну строку больше, чтобы узнать, есть ли следующая страница
+    if fields is None:
+        rows = db.execute(stmt.limit(limit + 1)).scalars().all()
+    else:
+        rows = [dict(row._mapping) for row in db.execute(stmt.limit(limit + 1))]
+        metrics.add_rows(len(rows))
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        if fields is None:
+            next_cursor = encode_cursor(last.entry_at, last.id)
+        else:
+            next_cursor = encode_cursor(last["entry_at"], last["id"])
+    return rows, next_cursor
@@ -0,0 +1,168 @@
+import itertools
+import numpy as np
+from typing import Dict, List, Optional, Sequence
+import trade_frame
+
+# Максимум ячеек (сделки × сценарии) в одном блоке, как в monte_carlo
+CHUNK_CELLS = 1 << 21
+# Больше сценариев за запрос не считаем
+MAX_SCENARIOS = 5000
+
+# Сетка по умолчанию: стоп 0.5-1R, цель 1-5R или без цели, безубыток после 0.5-2R или никогда
+DEFAULT_STOPS = (0.5, 0.6, 0.7, 0.8, 0.9, 1.0)
+DEFAULT_TARGETS = (1.0, 1.5, 2.0, 2.5, 3.0, 3.5, 4.0, 4.5, 5.0, None)
+DEFAULT_BREAKEVENS = (0.5, 1.0, 1.5, 2.0, None)
+
+def parse_levels(value: Optional[str], default: Sequence[Optional[float]]) -> List[Optional[float]]:
+    """
+    Уровни в R из строки "0.5,1,none" (none — правило не применяется).
+    """
+    if value is None or not value.strip():
+        return list(default)
+    levels = []
+    for item in value.split(","):
+        item = item.strip().lower()
+        if item in ("none", "off", ""):
+            levels.append(None)
+            continue
+        level = float(item)
+        if not level > 0:
+            raise ValueError(f"Level must be positive: {item}")
+        levels.append(level)
+    return levels
+
+class ExcursionFrame:
+    """
+    Сделки в единицах R (R — расстояние от входа до стопа): результат выхода и
+    максимальные неблагоприятное (MAE) и благоприятное (MFE) движения.
+    Только закрытые сделки со стопом, MAE и MFE; порядок — по времени закрытия.
+    """
+
+    def __init__(self, frame: trade_frame.TradeFrame):
+        sign = np.where(frame.is_long, 1.0, -1.0)
+        risk_per_unit = np.abs(frame.entry_price - frame.stop_loss)
+        usable = (
+            frame.is_closed & (risk_per_unit > 0)
+            & np.isfinite(frame.pnl) & np.isfinite(frame.exit_price)
+            & np.isfinite(frame.mae_price) & np.isfinite(frame.mfe_price)
+            & np.isfinite(frame.quantity)
+        )
+        self.skipped = int(len(frame) - np.count_nonzero(usable))
+        r = risk_per_unit[usable]
+        entry = frame.entry_price[usable]
+        sign = sign[usable]
+        self.pnl = frame.pnl[usable]
+        # Денежный риск сделки (1R)
+        self.risk = r * frame.quantity[usable]
+        self.exit_r = sign * (frame.exit_price[usable] - entry) / r
+        self.mae_r = np.maximum(sign * (entry - frame.mae_price[usable]) / r, 0.0)
+        self.mfe_r = np.maximum(sign * (frame.mfe_price[usable] - entry) / r, 0.0)
+        # Издержки в R: разница между фактическим PnL и движением цены
+        self.cost_r = self.pnl / self.risk - self.exit_r
+
+    def __len__(self):
+        return len(self.pnl)
+
+def _as_levels(levels: np.ndarray) -> np.ndarray:
+    # None (правило выключено) -> бесконечно далекий уровень
+    return np.array([np.inf if level is None else level for level in levels], dtype=np.float64)
+
+def _reprice_r(trades: ExcursionFrame, stop: np.ndarray, target: np.ndarray,
+               breakeven: np.ndarray) -> np.ndarray:
+    """
+    Результат каждой сделки в R в каждом сценарии: матрица сделки × сценарии одним броадкастом.
+    MAE/MFE не говорят, что случилось раньше, поэтому оценка консервативная:
+    - стоп сработал, если MAE дошел до него (даже если цель тоже была достигнута);
+    - иначе цель сработала, если до нее дошел MFE;
+    - иначе безубыток: цена дошла до уровня переноса стопа и закрылась в минусе,
+      значит после этого она вернулась к входу — результат 0;
+    - иначе фактический выход. Более широкий стоп, чем был, не "продлевает" сделку.
+    Комиссии и проскальзывание фактической сделки сохраняются (cost_r).
+    """
+    shape = (len(trades), len(stop))
+    exit_r, mae_r, mfe_r = trades.exit_r[:, None], trades.mae_r[:, None], trades.mfe_r[:, None]
+    result = np.empty(shape)
+    result[:] = exit_r
+    # Правила накладываются от слабого к сильному: безубыток, цель, стоп
+    np.copyto(result, 0.0, where=(mfe_r >= breakeven) & (exit_r < 0))
+    np.copyto(result, np.broadcast_to(target, shape), where=mfe_r >= target)
+    np.copyto(result, np.broadcast_to(-stop, shape), where=mae_r >= stop)
+    result += trades.cost_r[:, None]
+    return result
+
+def _summarize(r_multiples: np.ndarray, risk: np.ndarray) -> Dict[str, np.ndarray]:
+    # Метрики по столбцам (сценариям) матрицы R-multiples сделки × сценарии; матрица портится
+    n = r_multiples.shape[0]
+    mean_r = r_multiples.sum(axis=0) / n
+    sum_sq = np.einsum("ij,ij->j", r_multiples, r_multiples)
+    var_r = np.maximum(sum_sq - n * mean_r * mean_r, 0.0) / (n - 1) if n > 1 else np.zeros(len(mean_r))
+    std_r = np.sqrt(var_r)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sqn = np.where(std_r > 1e-12, mean_r / std_r * np.sqrt(n), 0.0)
+    win_rate = np.count_nonzero(r_multiples > 0, axis=0) / n * 100
+
+    pnl = np.multiply(r_multiples, risk[:, None], out=r_multiples)
+    gross_profit = np.maximum(pnl, 0.0).sum(axis=0)
+    # Баланс и просадка от пика, баланс начинается с 0 (как в analytics.calculate_advanced_stats)
+    balance = np.cumsum(pnl, axis=0, out=pnl)
+    total_pnl = balance[-1].copy()
+    peak = np.maximum.accumulate(balance, axis=0)
+    np.maximum(peak, 0.0, out=peak)
+    max_drawdown = np.subtract(peak, balance, out=peak).max(axis=0)
+    gross_loss = gross_profit - total_pnl
+    with np.errstate(divide="ignore", invalid="ignore"):
+        profit_factor = np.where(gross_loss > 0, gross_profit / gross_loss, 99.99)
+    return {
+        "total_pnl": total_pnl,
+        "win_rate": win_rate,
+        "expectancy_r": mean_r,
+        "sqn": sqn,
+        "profit_factor": profit_factor,
+        "max_drawdown": max_drawdown,
+    }
+
+def _rows(metrics: Dict[str, np.ndarray]) -> List[Dict]:
+    columns = {name: np.round(values, 2).tolist() for name, values in metrics.items()}
+    return [dict(zip(columns, values)) for values in zip(*columns.values())]
+
+def run_what_if(frame: trade_frame.TradeFrame, stops: Sequence[Optional[float]] = DEFAULT_STOPS,
+                targets: Sequence[Optional[float]] = DEFAULT_TARGETS,
+                breakevens: Sequence[Optional[float]] = DEFAULT_BREAKEVENS) -> Dict:
+    """
+    "Что, если": история сделок, переоцененная по всем сочетаниям стопа, цели и
+    переноса в безубыток (уровни в R от входа). Сценарии считаются блоками
+    по CHUNK_CELLS ячеек, внутри блока — один броадкаст по сделкам × сценариям.
+    """
+    trades = ExcursionFrame(frame)
+    combos = list(itertools.product(stops, targets, breakevens))
+    if len(combos) > MAX_SCENARIOS:
+        raise ValueError(f"Too many scenarios: {len(combos)} > {MAX_SCENARIOS}")
+    if len(trades) < 2:
+        return {
+            "n_trades": len(trades), "skipped_trades": trades.skipped, "scenarios": [],
+            "message": "Недостаточно сделок со стопом, MAE и MFE (нужно минимум 2)",
+        }
+
+    stop, target, breakeven = (_as_levels(levels) for levels in zip(*combos))
+    baseline = _rows(_summarize((trades.pnl / trades.risk)[:, None], trades.risk))[0]
+
+    per_chunk = max(1, CHUNK_CELLS // len(trades))
+    parts = [
+        _summarize(_reprice_r(trades, stop[start:start + per_chunk], target[start:start + per_chunk],
+                              breakeven[start:start + per_chunk]), trades.risk)
+        for start in range(0, len(combos), per_chunk)
+    ]
+    results = {name: np.concatenate([part[name] for part in parts]) for name in parts[0]}
+
+    scenarios = [
+        {"stop_r": s, "target_r": t, "breakeven_r": b, **row}
+        for (s, t, b), row in zip(combos, _rows(results))
+    ]
+    best = int(np.argmax(results["total_pnl"]))
+    return {
+        "n_trades": len(trades),
+        "skipped_trades": trades.skipped,
+        "baseline": baseline,
+        "best": scenarios[best],
+        "scenarios": scenarios,
+    }
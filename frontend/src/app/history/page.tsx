@@ -4,6 +4,7 @@ import { useEffect, useState } from 'react';
 import Link from 'next/link';
 import { ArrowLeft, Trash2, Zap, Download, Upload, Plus, Filter } from 'lucide-react';
 import { AddTradeModal } from '@/components/AddTradeModal';
+import { getApiUrl, waitForAnalysis } from '@/lib/api';
 
 interface Trade {
   id: number;
@@ -13,42 +14,42 @@ interface Trade {
   direction: string;
   pnl: number | null;
   commission?: number;
-  leverage?: number;
   entry_price: number;
   quantity: number;
   entry_at: string;
-  exit_at?: string;
   setup_name?: string;
   timeframe?: string;
   tags?: string[];
-  ai_analysis?: {
-    verdict: string;
-    analysis: string;
-    advice: string;
-    score: number;
-  };
 }
 
+// Only the columns the table renders
+const TRADE_FIELDS = 'id,symbol,asset_name,asset_type,direction,pnl,commission,entry_price,quantity,entry_at,setup_name,timeframe,tags';
+const PAGE_SIZE = 200;
+
 export default function HistoryPage() {
   const [trades, setTrades] = useState<Trade[]>([]);
   const [loading, setLoading] = useState(true);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [selectedTag, setSelectedTag] = useState<string | null>(null);
   const [filterDirection, setFilterDirection] = useState<'ALL' | 'LONG' | 'SHORT'>('ALL');
   const [isModalOpen, setIsModalOpen] = useState(false);
 
-  const getApiUrl = (path: string) => {
-    if (typeof window !== 'undefined' && window.location.hostname.includes('github.dev')) {
-      const codespaceName = window.location.hostname.split('-3000')[0];
-      return `https://${codespaceName}-8000.app.github.dev${path}`;
-    }
-    return `http://localhost:8000${path}`;
+  // One page of the journal, newest trades first; the next page starts at X-Next-Cursor
+  const fetchPage = async (cursor: string | null) => {
+    const params = new URLSearchParams({ order: 'desc', limit: String(PAGE_SIZE), fields: TRADE_FIELDS });
+    if (cursor) params.set('cursor', cursor);
+    const res = await fetch(getApiUrl(`/trades/?${params}`));
+    const page: Trade[] = await res.json();
+    return { page, cursor: res.headers.get('X-Next-Cursor') };
   };
 
+  // Reload from the first page (after changes); older pages are fetched on demand
   const fetchTrades = async () => {
     try {
-      const res = await fetch(getApiUrl('/trades/'));
-      const data = await res.json();
-      setTrades(data.reverse());
+      const { page, cursor } = await fetchPage(null);
+      setTrades(page);
+      setNextCursor(cursor);
     } catch (error) {
       console.error('Failed to fetch trades:', error);
     } finally {
@@ -56,6 +57,20 @@ export default function HistoryPage() {
     }
   };
 
+  const loadMore = async () => {
+    if (!nextCursor || loadingMore) return;
+    setLoadingMore(true);
+    try {
+      const { page, cursor } = await fetchPage(nextCursor);
+      setTrades(prev => [...prev, ...page]);
+      setNextCursor(cursor);
+    } catch (error) {
+      console.error('Failed to fetch trades:', error);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   useEffect(() => {
     fetchTrades();
   }, []);
@@ -80,6 +95,11 @@ export default function HistoryPage() {
       });
       if (response.ok) {
         fetchTrades();
+        // Refresh once the background AI analysis has finished
+        waitForAnalysis(tradeId).then(result => {
+          if (result?.status === 'failed') console.error('AI analysis failed:', result.error);
+          fetchTrades();
+        });
       }
     } catch (error) {
       console.error('Failed to close trade:', error);
@@ -300,6 +320,18 @@ export default function HistoryPage() {
             </tbody>
           </table>
         </div>
+
+        {nextCursor && (
+          <div className="mt-6 flex justify-center">
+            <button
+              onClick={loadMore}
+              disabled={loadingMore}
+              className="text-[10px] font-mono uppercase tracking-widest border border-border px-4 py-2 hover:bg-border transition-colors disabled:opacity-50"
+            >
+              {loadingMore ? 'Loading...' : 'Load older trades'}
+            </button>
+          </div>
+        )}
       </div>
     </main>
   );
@@ -3,6 +3,7 @@
 import { useEffect, useState } from 'react';
 import { StatsCard } from '@/components/StatsCard';
 import { AddTradeModal } from '@/components/AddTradeModal';
+import { getApiUrl, waitForAnalysis } from '@/lib/api';
 import Link from 'next/link';
 import { Activity, TrendingUp, Target, Zap, AlertTriangle, Plus, Lock, Download, Upload, Trash2, BookOpen, GitGraph, History } from 'lucide-react';
 import { LineChart, Line, XAxis, YAxis, CartesianGrid, Tooltip, ResponsiveContainer, AreaChart, Area } from 'recharts';
@@ -28,6 +29,8 @@ interface Trade {
   };
 }
 
+const TRADE_FIELDS = 'id,symbol,asset_name,asset_type,direction,pnl,commission,entry_price,quantity,setup_name,timeframe,tags,ai_analysis';
+
 interface DashboardData {
   total_pnl: number;
   win_rate: number;
@@ -52,12 +55,21 @@ interface DashboardData {
     avg_mfe_ratio: number;
     recommendations: string[];
   };
-  equity_curve: { date: string; balance: number }[];
   tag_stats: { tag: string; pnl: number; win_rate: number; count: number }[];
 }
 
+interface EquityCurve {
+  points: { date: string; balance: number }[];
+  total_points: number;
+  method: string | null;
+}
+
+// The chart cannot show more points than this; the server downsamples to fit
+const EQUITY_CURVE_POINTS = 1000;
+
 export default function Home() {
   const [stats, setStats] = useState<DashboardData | null>(null);
+  const [equityCurve, setEquityCurve] = useState<EquityCurve | null>(null);
   const [trades, setTrades] = useState<Trade[]>([]);
   const [loading, setLoading] = useState(true);
   const [isModalOpen, setIsModalOpen] = useState(false);
@@ -65,14 +77,6 @@ export default function Home() {
   const [logs, setLogs] = useState<{msg: string, time: string}[]>([]);
   const [mounted, setMounted] = useState(false);
 
-  const getApiUrl = (path: string) => {
-    if (typeof window !== 'undefined' && window.location.hostname.includes('github.dev')) {
-      const codespaceName = window.location.hostname.split('-3000')[0];
-      return `https://${codespaceName}-8000.app.github.dev${path}`;
-    }
-    return `http://localhost:8000${path}`;
-  };
-
   const addLog = (msg: string) => {
     const time = new Date().toLocaleTimeString();
     setLogs(prev => [{msg, time}, ...prev].slice(0, 5));
@@ -80,14 +84,19 @@ export default function Home() {
 
   const fetchData = async () => {
     try {
-      const [statsRes, tradesRes] = await Promise.all([
+      const [statsRes, curveRes, tradesRes] = await Promise.all([
         fetch(getApiUrl('/stats/')),
-        fetch(getApiUrl('/trades/'))
+        // min/max downsampling keeps drawdown troughs visible
+        fetch(getApiUrl(`/stats/equity-curve?max_points=${EQUITY_CURVE_POINTS}&method=minmax`)),
+        // Only the latest trades and only the columns the dashboard shows
+        fetch(getApiUrl(`/trades/?order=desc&limit=200&fields=${TRADE_FIELDS}`))
       ]);
       const statsData = await statsRes.json();
+      const curveData = await curveRes.json();
       const tradesData = await tradesRes.json();
       setStats(statsData);
-      setTrades(tradesData.reverse());
+      setEquityCurve(curveData);
+      setTrades(tradesData);
       addLog('System data synchronized');
     } catch (error) {
       console.error('Failed to fetch data:', error);
@@ -122,6 +131,11 @@ export default function Home() {
       });
       if (response.ok) {
         fetchData();
+        // Refresh once the background AI analysis has finished
+        waitForAnalysis(tradeId).then(result => {
+          if (result?.status === 'failed') addLog(`ERROR: AI analysis failed: ${result.error ?? 'unknown error'}`);
+          fetchData();
+        });
         addLog(`Position closed: ${tradeId}`);
       }
     } catch (error) {
@@ -322,7 +336,7 @@ export default function Home() {
             </h2>
             <div className="h-[250px] w-full">
               <ResponsiveContainer width="100%" height="100%">
-                <AreaChart data={stats?.equity_curve || []}>
+                <AreaChart data={equityCurve?.points || []}>
                   <defs>
                     <linearGradient id="colorBalance" x1="0" y1="0" x2="0" y2="1">
                       <stop offset="5%" stopColor="#00ff9f" stopOpacity={0.3}/>
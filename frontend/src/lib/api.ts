@@ -0,0 +1,36 @@
+// Backend URL: in Codespaces the API is served on the forwarded port 8000
+export const getApiUrl = (path: string) => {
+  if (typeof window !== 'undefined' && window.location.hostname.includes('github.dev')) {
+    const codespaceName = window.location.hostname.split('-3000')[0];
+    return `https://${codespaceName}-8000.app.github.dev${path}`;
+  }
+  return `http://localhost:8000${path}`;
+};
+
+export interface TradeAnalysisStatus {
+  trade_id: number;
+  status: 'pending' | 'running' | 'done' | 'failed' | null;
+  analysis: Record<string, unknown> | null;
+  error: string | null;
+}
+
+// AI analysis runs in the background: poll until it is done or failed.
+// Resolves with the last status seen (null if the status could not be fetched).
+export const waitForAnalysis = async (
+  tradeId: number,
+  attempts = 30,
+  intervalMs = 1000
+): Promise<TradeAnalysisStatus | null> => {
+  let last: TradeAnalysisStatus | null = null;
+  for (let attempt = 0; attempt < attempts; attempt++) {
+    await new Promise(resolve => setTimeout(resolve, intervalMs));
+    try {
+      const res = await fetch(getApiUrl(`/trades/${tradeId}/analysis`));
+      last = await res.json();
+      if (last?.status === 'done' || last?.status === 'failed') break;
+    } catch (error) {
+      break;
+    }
+  }
+  return last;
+};